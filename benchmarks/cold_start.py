@@ -0,0 +1,148 @@
+"""
+Cold-start benchmark for lambda_function.
+
+Every run starts a fresh Python interpreter, imports lambda_function and sends
+one request for a single route, so the import time and the first-request
+latency are measured the way a new Lambda container experiences them. A
+second request in the same process is timed as the warm reference.
+
+AWS is replaced by the same moto stand-ins as load_replay.py, served over HTTP
+on a local port so every child process talks to one seeded set of tables: the
+benchmark account, its API key and one link. If AWS_ENDPOINT_URL is set,
+requests go to that endpoint instead and nothing is seeded; pass the short
+code, API key and credentials of existing data.
+
+Usage:
+    python benchmarks/cold_start.py --runs 10
+    python benchmarks/cold_start.py --routes redirect,login --short-code abc123
+    python benchmarks/cold_start.py --importtime
+"""
+import argparse
+import contextlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.events import ROUTES, BenchmarkContext, route_event  # noqa: E402
+from benchmarks.load_replay import BENCH_EMAIL, BENCH_PASSWORD, seed, start_stand_ins  # noqa: E402
+
+
+def run_child(route, options):
+    """Import lambda_function and time the first and second request for one route."""
+    start = time.perf_counter()
+    import lambda_function
+    import_seconds = time.perf_counter() - start
+
+    event = route_event(route, short_code=options.short_code, api_key=options.api_key,
+                        email=options.email, password=options.password)
+    timings = []
+    status = None
+    for _ in range(2):
+        start = time.perf_counter()
+        response = lambda_function.lambda_handler(json.loads(json.dumps(event)), BenchmarkContext())
+        timings.append(time.perf_counter() - start)
+        status = response.get('statusCode')
+
+    print(json.dumps({
+        'import_s': import_seconds,
+        'first_request_s': timings[0],
+        'warm_request_s': timings[1],
+        'status': status
+    }))
+
+
+def spawn(route, options):
+    """Run one cold start in a new interpreter and return its measurements."""
+    command = [
+        sys.executable, os.path.abspath(__file__), '--child', route,
+        '--short-code', options.short_code, '--api-key', options.api_key,
+        '--email', options.email, '--password', options.password
+    ]
+    # Let the first run write __pycache__, so the rest measure a package shipped with compiled modules
+    env = {name: value for name, value in os.environ.items() if name != 'PYTHONDONTWRITEBYTECODE'}
+    result = subprocess.run(command, capture_output=True, text=True, env=env, cwd=REPO_ROOT)
+    if result.returncode != 0:
+        raise RuntimeError(f'{route} run failed:\n{result.stderr}')
+    # The handler logs to stdout; the measurements are the last line
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def report_import_time(limit):
+    """Print the slowest imports of lambda_function using python -X importtime."""
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import lambda_function'],
+        capture_output=True, text=True, cwd=REPO_ROOT
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative_us), int(self_us), name.strip()))
+
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")
+    for cumulative_us, self_us, name in sorted(rows, reverse=True)[:limit]:
+        print(f"{cumulative_us / 1000:14.1f} {self_us / 1000:9.1f}  {name}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--routes', default=','.join(ROUTES), help='Comma-separated routes to measure')
+    parser.add_argument('--runs', type=int, default=5, help='Cold starts per route')
+    parser.add_argument('--short-code', help='Short code to redirect (default: the seeded link)')
+    parser.add_argument('--api-key', help='API key for authenticated routes (default: the seeded key)')
+    parser.add_argument('--email', default=BENCH_EMAIL)
+    parser.add_argument('--password', default=BENCH_PASSWORD)
+    parser.add_argument('--importtime', action='store_true', help='Show the slowest imports and exit')
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    options = parser.parse_args()
+
+    if options.child:
+        run_child(options.child, options)
+        return
+
+    if options.importtime:
+        report_import_time(limit=20)
+        return
+
+    # Read by lambda_function at import, here and in every child: create the tables in the stand-in and
+    # don't rate limit the repeated requests from one client address
+    os.environ.setdefault('TABLE_AUTO_CREATE', 'true')
+    os.environ['RATE_LIMITS'] = ''
+    stand_ins = start_stand_ins(server=True)
+    try:
+        if stand_ins:
+            import lambda_function
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                api_key, short_codes = seed(lambda_function, links=1)
+            options.api_key = options.api_key or api_key
+            options.short_code = options.short_code or short_codes[0]
+        options.api_key = options.api_key or 'benchmark-api-key'
+        options.short_code = options.short_code or 'zzzzzz'
+
+        print(f"{'route':<14} {'import p50':>11} {'first p50':>10} {'first p90':>10} {'warm p50':>9}  status")
+        for route in options.routes.split(','):
+            samples = [spawn(route, options) for _ in range(options.runs)]
+            imports = [s['import_s'] * 1000 for s in samples]
+            firsts = [s['first_request_s'] * 1000 for s in samples]
+            warms = [s['warm_request_s'] * 1000 for s in samples]
+            print(f"{route:<14} {statistics.median(imports):9.1f}ms {statistics.median(firsts):8.1f}ms "
+                  f"{percentile(firsts, 0.9):8.1f}ms {statistics.median(warms):7.1f}ms  {samples[-1]['status']}")
+    finally:
+        if stand_ins:
+            stand_ins.stop()
+
+
+if __name__ == '__main__':
+    main()
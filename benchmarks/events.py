@@ -0,0 +1,83 @@
+"""
+Synthetic API Gateway (REST, proxy integration) events for driving lambda_handler locally.
+"""
+import json
+
+
+class BenchmarkContext:
+    """Minimal stand-in for the Lambda context object."""
+    function_name = 'linq-red-benchmark'
+    function_version = '$LATEST'
+    memory_limit_in_mb = 128
+    aws_request_id = 'benchmark'
+
+    def get_remaining_time_in_millis(self):
+        return 30000
+
+
+def api_event(method, path, body=None, headers=None, query=None, source_ip='203.0.113.10'):
+    """
+    Build an API Gateway proxy event.
+
+    Args:
+        method (str): HTTP method
+        path (str): Request path
+        body (dict, optional): JSON body
+        headers (dict, optional): Request headers
+        query (dict, optional): Query string parameters
+        source_ip (str): Client IP reported in the request context
+
+    Returns:
+        dict: The event
+    """
+    return {
+        'resource': '/{proxy+}',
+        'path': path,
+        'httpMethod': method,
+        'headers': headers or {},
+        'queryStringParameters': query,
+        'pathParameters': None,
+        'body': json.dumps(body) if body is not None else None,
+        'requestContext': {
+            'identity': {'sourceIp': source_ip},
+            'httpMethod': method,
+            'path': path
+        }
+    }
+
+
+def route_event(route, short_code='zzzzzz', api_key='benchmark-api-key',
+                email='bench@example.com', password='benchmark-password'):
+    """
+    Build the event for a named route.
+
+    Args:
+        route (str): One of ROUTES
+        short_code (str): Short code used by redirect and analytics requests
+        api_key (str): API key sent by authenticated requests
+        email (str): Email used by the login request
+        password (str): Password used by the login request
+
+    Returns:
+        dict: The event
+    """
+    auth = {'x-api-key': api_key}
+    if route == 'redirect':
+        return api_event('GET', f'/{short_code}', headers={
+            'User-Agent': 'Mozilla/5.0 (iPhone; CPU iPhone OS 17_0 like Mac OS X) Mobile',
+            'Referer': 'https://news.example.com/story'
+        })
+    if route == 'root':
+        return api_event('GET', '/')
+    if route == 'login':
+        return api_event('POST', '/auth/login', body={'email': email, 'password': password})
+    if route == 'shorten':
+        return api_event('POST', '/urls', body={'long_url': 'https://example.com/benchmark'}, headers=auth)
+    if route == 'list_urls':
+        return api_event('GET', '/urls', headers=auth, query={'limit': '50'})
+    if route == 'url_analytics':
+        return api_event('GET', '/urls/analytics', headers=auth, query={'short_code': short_code})
+    raise ValueError(f'Unknown route: {route}')
+
+
+ROUTES = ('redirect', 'root', 'login', 'shorten', 'list_urls', 'url_analytics')
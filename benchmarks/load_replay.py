@@ -0,0 +1,344 @@
+"""
+Load-replay benchmark for lambda_function.
+
+Replays a synthetic traffic mix through lambda_handler in one process, the way
+a single warm Lambda container serves it, and reports per route throughput,
+p50/p95/p99 latency and the number of AWS API calls each request made. Calls
+made while flushing buffered clicks, counters and metrics are reported as a
+separate total: the request that happens to cross a flush threshold would
+otherwise be charged for data buffered by all the others.
+
+AWS is replaced by moto's in-memory DynamoDB, S3, CloudWatch, API Gateway and
+SES, so the numbers measure the handler's own CPU time plus the call pattern,
+not network latency. Use --aws-latency-ms to add a fixed delay per AWS call
+when a change trades CPU for round trips. If AWS_ENDPOINT_URL is set, requests
+go to that endpoint (e.g. LocalStack) instead of moto.
+
+Short codes are drawn from a Zipf distribution over --links seeded links, so a
+few links get most of the redirects as in production traffic.
+
+Usage:
+    python benchmarks/load_replay.py --requests 5000
+    python benchmarks/load_replay.py --mix redirect=80,shorten=10,list_urls=10 --zipf 1.2
+    python benchmarks/load_replay.py --json before.json
+    python benchmarks/load_replay.py --compare before.json
+"""
+import argparse
+import contextlib
+import functools
+import itertools
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from collections import defaultdict
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from benchmarks.events import BenchmarkContext, api_event, route_event  # noqa: E402
+
+DEFAULT_MIX = 'redirect=90,shorten=3,list_urls=3,url_analytics=2,login=2'
+REPLAY_ROUTES = ('redirect', 'shorten', 'list_urls', 'url_analytics', 'login')
+BENCH_EMAIL = 'bench@example.com'
+BENCH_PASSWORD = 'benchmark-password'
+AWS_SERVICES = ('s3', 'cloudwatch', 'apigateway', 'ses')
+
+
+class CallRecorder:
+    """Counts AWS API calls per operation, apart for buffer flushes, and optionally delays each one."""
+
+    def __init__(self, latency_ms=0):
+        self.latency = latency_ms / 1000
+        self.calls = defaultdict(int)
+        self.flush_calls = defaultdict(int)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def __call__(self, model, **kwargs):
+        operation = f'{model.service_model.service_name}.{model.name}'
+        # The background flush thread runs on an executor named 'flush'
+        flushing = getattr(self._local, 'flushing', False) or threading.current_thread().name.startswith('flush')
+        with self._lock:
+            (self.flush_calls if flushing else self.calls)[operation] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def attribute_to_flush(self, function):
+        """Wrap a flush function so that the calls it makes on this thread are counted as flush calls."""
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            self._local.flushing = True
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self._local.flushing = False
+        return wrapper
+
+    def take(self):
+        """Return the request calls recorded since the last take and reset the counters."""
+        with self._lock:
+            calls, self.calls = dict(self.calls), defaultdict(int)
+        return calls
+
+    def take_flush(self):
+        """Return the flush calls recorded since the last take_flush and reset the counters."""
+        with self._lock:
+            calls, self.flush_calls = dict(self.flush_calls), defaultdict(int)
+        return calls
+
+
+def start_stand_ins(server=False):
+    """
+    Start moto unless an explicit endpoint was configured.
+
+    Args:
+        server (bool): Serve the stand-ins over HTTP on a local port and point AWS_ENDPOINT_URL
+            at it, so that other processes started from this one share them
+
+    Returns:
+        The mock or server to stop, or None
+    """
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    if os.environ.get('AWS_ENDPOINT_URL'):
+        return None
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+    extras = 'server' if server else 'dynamodb,s3'
+    try:
+        from moto import mock_aws
+        if server:
+            from moto.server import ThreadedMotoServer
+    except ImportError:
+        sys.exit(f'moto is required for the in-memory stand-ins: pip install "moto[{extras}]" '
+                 '(or set AWS_ENDPOINT_URL to a local endpoint)')
+    if server:
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)  # One access log line per AWS call otherwise
+        moto_server = ThreadedMotoServer(ip_address='127.0.0.1', port=0, verbose=False)
+        moto_server.start()
+        host, port = moto_server.get_host_and_port()
+        os.environ['AWS_ENDPOINT_URL'] = f'http://{host}:{port}'
+        return moto_server
+    mock = mock_aws()
+    mock.start()
+    return mock
+
+
+def install_clients(lambda_function, recorder):
+    """Attach the call recorder to every AWS client the handler creates, and create the common ones up front."""
+    instrument_client = lambda_function.instrument_client
+
+    def instrument_and_record(client):
+        instrument_client(client)
+        client.meta.events.register('before-call', recorder)
+
+    # Also covers clients created later, e.g. by the background flush thread
+    lambda_function.instrument_client = instrument_and_record
+    for name in ('flush_ingestion_buffers', 'flush_metrics'):
+        setattr(lambda_function, name, recorder.attribute_to_flush(getattr(lambda_function, name)))
+    lambda_function.get_dynamodb()
+    for service_name in AWS_SERVICES:
+        lambda_function.get_aws_client(service_name)
+    lambda_function.get_redirect_table()
+
+
+def seed(lambda_function, links):
+    """Create the React app object, the benchmark account and its links. Returns (api_key, short_codes)."""
+    s3 = lambda_function.get_aws_client('s3')
+    s3.create_bucket(Bucket=lambda_function.S3_BUCKET_NAME)
+    s3.put_object(Bucket=lambda_function.S3_BUCKET_NAME, Key=lambda_function.REACT_APP_INDEX_KEY, Body=b'<html></html>')
+
+    response = lambda_function.lambda_handler(
+        api_event('POST', '/auth/register', body={'email': BENCH_EMAIL, 'password': BENCH_PASSWORD}),
+        BenchmarkContext()
+    )
+    if response['statusCode'] != 201:
+        sys.exit(f"Could not register the benchmark account: {response['body']}")
+    api_key = json.loads(response['body'])['api_key']
+
+    short_codes = [f'bench{i:05d}' for i in range(links)]
+    with lambda_function.get_urls_table().batch_writer() as batch:
+        for i, short_code in enumerate(short_codes):
+            batch.put_item(Item={
+                'short_code': short_code,
+                'long_url': f'https://example.com/article/{i}',
+                'creation_date': f'2025-01-01T00:00:{i % 60:02d}.{i:06d}',
+                'usage_count': 0,
+                'status': 'active',
+                'api_key': api_key,
+                'owner_email': BENCH_EMAIL
+            })
+    return api_key, short_codes
+
+
+def parse_mix(mix):
+    """Parse 'route=weight,...' into {route: weight}."""
+    weights = {}
+    for entry in mix.split(','):
+        route, _, weight = entry.partition('=')
+        route = route.strip()
+        if route not in REPLAY_ROUTES:
+            raise argparse.ArgumentTypeError(f"Unknown route '{route}', expected one of {', '.join(REPLAY_ROUTES)}")
+        weights[route] = float(weight or 1)
+    return weights
+
+
+def build_schedule(options, api_key, short_codes):
+    """Draw the request sequence up front so generating it is not part of the measurement."""
+    rng = random.Random(options.seed)
+    routes, route_weights = zip(*options.mix.items())
+    # Zipf: the link with popularity rank k gets weight 1 / k^s
+    code_weights = list(itertools.accumulate(1 / rank ** options.zipf for rank in range(1, len(short_codes) + 1)))
+    ranked_codes = short_codes[:]
+    rng.shuffle(ranked_codes)
+
+    schedule = []
+    for route in rng.choices(routes, weights=route_weights, k=options.warmup + options.requests):
+        short_code = rng.choices(ranked_codes, cum_weights=code_weights)[0]
+        event = route_event(route, short_code=short_code, api_key=api_key, email=BENCH_EMAIL, password=BENCH_PASSWORD)
+        schedule.append((route, event))
+    return schedule
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def replay(lambda_function, recorder, schedule, warmup):
+    """Run the schedule and return per route latencies, statuses and AWS calls, and the flush calls."""
+    results = defaultdict(lambda: {'latencies': [], 'statuses': defaultdict(int), 'calls': defaultdict(int)})
+    context = BenchmarkContext()
+
+    # The handler logs every request to stdout; keep the formatting cost but not the output
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for route, event in schedule[:warmup]:
+            lambda_function.lambda_handler(json.loads(json.dumps(event)), context)
+        recorder.take()
+        recorder.take_flush()
+
+        started_at = time.perf_counter()
+        for route, event in schedule[warmup:]:
+            event = json.loads(json.dumps(event))  # API Gateway hands every invocation a fresh event
+            request_started_at = time.perf_counter()
+            response = lambda_function.lambda_handler(event, context)
+            latency = time.perf_counter() - request_started_at
+
+            result = results[route]
+            result['latencies'].append(latency)
+            result['statuses'][response['statusCode']] += 1
+            for operation, count in recorder.take().items():
+                result['calls'][operation] += count
+        elapsed = time.perf_counter() - started_at
+        flush_calls = recorder.take_flush()
+
+        # Buffered clicks and counters would be written by a later request or at shutdown
+        lambda_function.flush_ingestion_buffers(force=True)
+        lambda_function.flush_metrics(force=True)
+        shutdown_calls = recorder.take_flush()
+
+    return results, elapsed, flush_calls, shutdown_calls
+
+
+def summarize(results, elapsed, flush_calls, shutdown_calls):
+    """Reduce raw measurements to the reported numbers."""
+    summary = {'elapsed_s': elapsed, 'routes': {}, 'flush_calls': flush_calls, 'shutdown_calls': shutdown_calls}
+    total = 0
+    for route, result in sorted(results.items()):
+        latencies = [latency * 1000 for latency in result['latencies']]
+        requests = len(latencies)
+        total += requests
+        summary['routes'][route] = {
+            'requests': requests,
+            'rps': requests / (sum(latencies) / 1000),
+            'p50_ms': statistics.median(latencies),
+            'p95_ms': percentile(latencies, 0.95),
+            'p99_ms': percentile(latencies, 0.99),
+            'aws_calls_per_request': sum(result['calls'].values()) / requests,
+            'calls_per_request': {op: count / requests for op, count in sorted(result['calls'].items())},
+            'statuses': {str(status): count for status, count in sorted(result['statuses'].items())}
+        }
+    summary['requests'] = total
+    summary['rps'] = total / elapsed
+    return summary
+
+
+def print_summary(summary, baseline=None, show_operations=False):
+    def delta(route, key):
+        if not baseline or route not in baseline['routes']:
+            return ''
+        before = baseline['routes'][route][key]
+        return f" ({(summary['routes'][route][key] - before) / before * 100:+.0f}%)" if before else ''
+
+    print(f"{'route':<14} {'requests':>8} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'AWS calls':>10}  statuses")
+    for route, numbers in summary['routes'].items():
+        statuses = ' '.join(f'{status}x{count}' for status, count in numbers['statuses'].items())
+        print(f"{route:<14} {numbers['requests']:>8} {numbers['rps']:>9.0f} {numbers['p50_ms']:>8.2f} "
+              f"{numbers['p95_ms']:>8.2f} {numbers['p99_ms']:>8.2f} {numbers['aws_calls_per_request']:>10.2f}  {statuses}")
+        if baseline:
+            print(f"{'':<14} {'vs baseline':>8} {delta(route, 'rps'):>9} {delta(route, 'p50_ms'):>8} "
+                  f"{delta(route, 'p95_ms'):>8} {delta(route, 'p99_ms'):>8} {delta(route, 'aws_calls_per_request'):>10}")
+        if show_operations:
+            for operation, per_request in numbers['calls_per_request'].items():
+                print(f"{'':<16}{operation:<44} {per_request:.3f}/req")
+
+    print(f"\n{summary['requests']} requests in {summary['elapsed_s']:.2f}s ({summary['rps']:.0f} req/s overall)")
+    if summary['flush_calls']:
+        print(f"Calls to flush buffers during the run ({sum(summary['flush_calls'].values()) / summary['requests']:.2f}/req): "
+              + ', '.join(f'{op} x{count}' for op, count in sorted(summary['flush_calls'].items())))
+    if summary['shutdown_calls']:
+        print('Calls to drain buffers at the end: '
+              + ', '.join(f'{op} x{count}' for op, count in sorted(summary['shutdown_calls'].items())))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=2000, help='Measured requests')
+    parser.add_argument('--warmup', type=int, default=200, help='Requests replayed before measuring')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX), help=f'Traffic mix (default {DEFAULT_MIX})')
+    parser.add_argument('--links', type=int, default=1000, help='Seeded short links')
+    parser.add_argument('--zipf', type=float, default=1.1, help='Zipf exponent of short code popularity')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed for the request sequence')
+    parser.add_argument('--aws-latency-ms', type=float, default=0, help='Delay added to every AWS call')
+    parser.add_argument('--operations', action='store_true', help='Break AWS calls down by operation')
+    parser.add_argument('--rate-limits', default='', help='RATE_LIMITS for the replay (default: no limits)')
+    parser.add_argument('--json', metavar='PATH', help='Also write the results as JSON')
+    parser.add_argument('--compare', metavar='PATH', help='Show changes against results written with --json')
+    options = parser.parse_args()
+
+    # Read by lambda_function at import: let it create the tables in the stand-in, and replay every request
+    # from one client address without rate limiting unless --rate-limits asks for it
+    os.environ.setdefault('TABLE_AUTO_CREATE', 'true')
+    os.environ['RATE_LIMITS'] = options.rate_limits
+    mock = start_stand_ins()
+    try:
+        import lambda_function
+
+        recorder = CallRecorder(options.aws_latency_ms)
+        install_clients(lambda_function, recorder)
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            api_key, short_codes = seed(lambda_function, options.links)
+        schedule = build_schedule(options, api_key, short_codes)
+        results, elapsed, flush_calls, shutdown_calls = replay(lambda_function, recorder, schedule, options.warmup)
+    finally:
+        if mock:
+            mock.stop()
+
+    summary = summarize(results, elapsed, flush_calls, shutdown_calls)
+    baseline = None
+    if options.compare:
+        with open(options.compare) as f:
+            baseline = json.load(f)
+    print_summary(summary, baseline, options.operations)
+
+    if options.json:
+        with open(options.json, 'w') as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
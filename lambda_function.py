@@ -5,15 +5,21 @@ import random
 import time
 import hashlib
 import os
+import signal
+import threading
 import base64
 import hmac
-import jwt
+import bisect
+import heapq
+import math
+import re
 import uuid
-from datetime import datetime, timedelta
-from urllib.parse import urlparse, quote
-from botocore.exceptions import ClientError
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
+from collections import OrderedDict
+from decimal import Decimal
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlparse
+from botocore.config import Config
+from botocore.exceptions import BotoCoreError, ClientError
 
 # Constants
 #USAGE_PLAN_ID = 'uxvvve'
@@ -22,7 +28,12 @@ REACT_APP_INDEX_KEY = 'index.html'
 TABLE_NAME = 'linqs'
 ACCOUNTS_TABLE_NAME = 'linqs_accounts'
 URL_CLICKS_TABLE_NAME = 'linqs_url_clicks'  # Table for detailed click analytics
-API_USAGE_TABLE_NAME = 'linqs_api_usage'  # Table for API usage tracking
+URL_CLICK_ROLLUPS_TABLE_NAME = 'linqs_url_click_rollups'  # Per short_code per day click counters
+API_USAGE_TABLE_NAME = 'linqs_api_usage'  # Per API key, per day request counters
+URL_COUNTERS_TABLE_NAME = 'linqs_url_counters'  # Sharded usage counters for hot short codes
+OWNER_INDEX_NAME = 'owner_email-creation_date-index'  # GSI on linqs for listing a user's URLs newest first
+API_KEYS_TABLE_NAME = 'linqs_api_keys'  # Maps a SHA-256 digest of each API key to its account
+SEQUENCES_TABLE_NAME = 'linqs_sequences'  # Atomic counters used to lease blocks of short code IDs
 REACT_APP_URL = "https://linq-red-react-app-deployments.s3.us-east-1.amazonaws.com/index.html"
 JWT_SECRET = os.environ.get('JWT_SECRET', 'development_secret_key')  # Use environment variable in production
 JWT_EXPIRY = 24  # Token expiry in hours
@@ -30,52 +41,902 @@ SERVICE_EMAIL = os.environ.get('SERVICE_EMAIL', 'no-reply@linq.red')  # Email se
 DEFAULT_HEADERS = {
     'Access-Control-Allow-Origin': '*',
     'Access-Control-Allow-Methods': 'POST, GET, OPTIONS',
-    'Access-Control-Allow-Headers': 'Content-Type, x-api-key, Authorization'
+    'Access-Control-Allow-Headers': 'Content-Type, x-api-key, Authorization, If-None-Match',
+    'Access-Control-Expose-Headers': 'ETag, Server-Timing'
 }
 
-# Initialize clients
-apigateway = boto3.client('apigateway')
-cloudwatch = boto3.client('cloudwatch')
-dynamodb = boto3.resource('dynamodb')
-s3 = boto3.client('s3')
-ses = boto3.client('ses', region_name='us-east-1')
+# Password hashing: new hashes use PASSWORD_HASH_ITERATIONS and store their parameters on the account.
+# Accounts without parameters were hashed with the legacy cost and are rehashed on their next login.
+PASSWORD_HASH_ALGORITHM = 'pbkdf2_sha256'
+PASSWORD_HASH_ITERATIONS = int(os.environ.get('PASSWORD_HASH_ITERATIONS', '100000'))
+PASSWORD_HASH_LEGACY_ITERATIONS = 100000
+PASSWORD_HASH_MIN_ITERATIONS = 100000  # Lowest cost the calibration task recommends
+PASSWORD_HASH_TARGET_MS = float(os.environ.get('PASSWORD_HASH_TARGET_MS', '250'))  # Default calibration target
+
+# Short code allocation: sequential IDs leased in blocks, mapped to base62 codes by a keyed permutation
+SHORT_CODE_ALPHABET = string.digits + string.ascii_uppercase + string.ascii_lowercase
+SHORT_CODE_LENGTH = 6
+SHORT_CODE_SPACE = len(SHORT_CODE_ALPHABET) ** SHORT_CODE_LENGTH
+SHORT_CODE_BLOCK_SIZE = int(os.environ.get('SHORT_CODE_BLOCK_SIZE', '1000'))
+SHORT_CODE_PERMUTATION_KEY = os.environ.get('SHORT_CODE_PERMUTATION_KEY', JWT_SECRET).encode('utf-8')
+SHORT_CODE_MAX_ATTEMPTS = 5  # Conditional writes tried before giving up on a generated code
+
+# Bulk shortening settings
+BATCH_SHORTEN_MAX_ITEMS = int(os.environ.get('BATCH_SHORTEN_MAX_ITEMS', '500'))
+BATCH_WRITE_MAX_ROUNDS = 5  # Write rounds before unprocessed items are reported as failed
+BATCH_WRITE_CHUNK_SIZE = 25  # Items per TransactWriteItems call; one throttled item cancels the whole chunk
+DYNAMODB_THROTTLING_CODES = {
+    'ProvisionedThroughputExceeded', 'ProvisionedThroughputExceededException', 'ThrottlingError',
+    'ThrottlingException', 'RequestLimitExceeded'
+}
+
+# Fall back to scanning linqs_accounts for API keys missing from linqs_api_keys. Set to false once the
+# backfill_api_key_index task has run, until then accounts created before linqs_api_keys are only found by the scan.
+API_KEY_SCAN_FALLBACK = os.environ.get('API_KEY_SCAN_FALLBACK', 'true').lower() == 'true'
+
+# Analytics settings: rollup attributes are named '<prefix><value>' on each per-day item
+ANALYTICS_DEFAULT_RANGE_DAYS = 30
+ANALYTICS_MAX_RANGE_DAYS = int(os.environ.get('ANALYTICS_MAX_RANGE_DAYS', '366'))
+ANALYTICS_RAW_ROW_BUDGET = int(os.environ.get('ANALYTICS_RAW_ROW_BUDGET', '20000'))  # Max raw click rows read per request
+ANALYTICS_RAW_CONCURRENCY = int(os.environ.get('ANALYTICS_RAW_CONCURRENCY', '4'))  # Day buckets queried in parallel
+ANALYTICS_RAW_PAGE_SIZE = 1000
+ROLLUP_REFERRER_PREFIX = 'ref:'
+ROLLUP_COUNTRY_PREFIX = 'cty:'
+ROLLUP_DEVICE_PREFIX = 'dev:'
+
+# Rate limiting: token buckets per API key (per client IP without one), checked before any other work.
+# RATE_LIMITS entries are '<route>=<rate>/<burst>' or '<usage plan ID>:<route>=<rate>/<burst>', in requests
+# per second. '*' matches every route of a plan and 'default' covers routes without their own entry; routes
+# matched by the same entry share one bucket. Buckets are per container unless RATE_LIMIT_TABLE names a
+# DynamoDB table (hash key 'bucket', TTL on expires_at) that containers lease tokens from.
+def _parse_rate_limits(spec):
+    """Parse RATE_LIMITS into {selector: (rate, burst)}, failing at import on malformed entries."""
+    limits = {}
+    for entry in filter(None, (entry.strip() for entry in spec.split(','))):
+        selector, _, limit = entry.partition('=')
+        rate, _, burst = limit.partition('/')
+        try:
+            rate, burst = float(rate), float(burst)
+        except ValueError:
+            rate = burst = 0.0
+        # A zero rate would divide by zero when computing the wait, a burst below 1 never admits a request
+        if not selector.strip() or not (rate > 0 and burst >= 1):
+            raise ValueError(f"Invalid RATE_LIMITS entry '{entry}', expected [usage plan ID:]route=rate/burst "
+                             "with rate > 0 and burst >= 1")
+        limits[selector.strip()] = (rate, burst)
+    return limits
+
+RATE_LIMITS = _parse_rate_limits(os.environ.get(
+    'RATE_LIMITS', 'default=10/20,redirect=50/100,login=1/5,register=0.1/3,forgot_password=0.1/3,shorten_batch=0.5/2'
+))
+RATE_LIMIT_MAX_BUCKETS = int(os.environ.get('RATE_LIMIT_MAX_BUCKETS', '10000'))
+RATE_LIMIT_TABLE_NAME = os.environ.get('RATE_LIMIT_TABLE', '')  # Empty keeps buckets per container
+RATE_LIMIT_LEASE_FRACTION = 0.1  # Share of a shared bucket's burst a container takes per lease
+
+# Authentication cache settings (per container)
+AUTH_CACHE_MAX_ENTRIES = int(os.environ.get('AUTH_CACHE_MAX_ENTRIES', '1000'))
+AUTH_CACHE_API_KEY_TTL = float(os.environ.get('AUTH_CACHE_API_KEY_TTL', '300'))  # Seconds an API key identity is reused
+AUTH_CACHE_NEGATIVE_TTL = float(os.environ.get('AUTH_CACHE_NEGATIVE_TTL', '30'))  # Seconds an unknown API key is remembered
+
+# Logging settings: LOG_LEVEL is DEBUG, INFO, WARNING or ERROR; LOG_SAMPLE_RATES gives the share of
+# requests per route whose debug/info lines are logged, e.g. "redirect=0.01,default=1"
+LOG_LEVELS = {'debug': 10, 'info': 20, 'warning': 30, 'error': 40}
+LOG_LEVEL = LOG_LEVELS.get(os.environ.get('LOG_LEVEL', 'INFO').lower(), LOG_LEVELS['info'])
+LOG_SAMPLE_RATES = {
+    route.strip(): float(rate)
+    for route, rate in (
+        entry.split('=', 1) for entry in os.environ.get('LOG_SAMPLE_RATES', '').split(',') if '=' in entry
+    )
+}
+
+# Metrics settings: 'emf' writes Embedded Metric Format log lines, 'api' batches put_metric_data calls
+METRICS_NAMESPACE = 'linq.red/Metrics'
+METRICS_EMIT_MODE = os.environ.get('METRICS_EMIT_MODE', 'emf')
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', '60'))  # Seconds between put_metric_data calls in 'api' mode
+METRICS_REQUEUE_MAX_VALUES = 1000  # Distinct values per metric kept while CloudWatch cannot be reached
+API_ROUTES = {
+    ('POST', '/auth/register'): 'register',
+    ('POST', '/auth/login'): 'login',
+    ('POST', '/auth/forgot-password'): 'forgot_password',
+    ('GET', '/auth/profile'): 'profile',
+    ('POST', '/urls'): 'shorten',
+    ('POST', '/urls/batch'): 'shorten_batch',
+    ('GET', '/urls'): 'list_urls',
+    ('GET', '/urls/analytics'): 'url_analytics',
+    ('GET', '/'): 'root'
+}
+
+# Root page settings: index.html metadata is re-read from S3 at most once per TTL per container
+REACT_APP_METADATA_TTL = float(os.environ.get('REACT_APP_METADATA_TTL', '300'))  # Seconds
+REACT_APP_METADATA_ERROR_TTL = 30  # Seconds a failed head_object is remembered
+ROOT_PAGE_MAX_AGE = int(os.environ.get('ROOT_PAGE_MAX_AGE', '60'))  # Cache-Control max-age for GET /
+
+# Create missing DynamoDB tables on first use (intended for new environments only)
+TABLE_AUTO_CREATE = os.environ.get('TABLE_AUTO_CREATE', 'false').lower() == 'true'
+
+# Redirect cache settings (per container)
+REDIRECT_CACHE_MAX_ENTRIES = int(os.environ.get('REDIRECT_CACHE_MAX_ENTRIES', '1000'))
+REDIRECT_CACHE_TTL = float(os.environ.get('REDIRECT_CACHE_TTL', '60'))  # Seconds a found link is served from memory
+REDIRECT_CACHE_NEGATIVE_TTL = float(os.environ.get('REDIRECT_CACHE_NEGATIVE_TTL', '10'))  # Seconds a 404 is remembered
+REDIRECT_CACHE_STALE_TTL = float(os.environ.get('REDIRECT_CACHE_STALE_TTL', '3600'))  # Seconds an expired link may be served when DynamoDB fails
+REDIRECT_CACHE_ATTRIBUTES = ('short_code', 'long_url', 'status', 'owner_email', 'redirect_type', 'cache_max_age')
+REDIRECT_CACHE_STATS_INTERVAL = float(os.environ.get('REDIRECT_CACHE_STATS_INTERVAL', '60'))  # Seconds between cache metric emissions
+
+# Hot-set snapshot: the top HOT_SET_SIZE active links by usage_count, exported to S3 by the export_hot_set task
+# and loaded by each container on its first redirect. The snapshot answers only the first request for each of its
+# links in a container; the redirect cache then holds the link for REDIRECT_CACHE_TTL and later requests read
+# DynamoDB, so a deactivated link is revalidated like any other. Snapshots older than HOT_SET_MAX_AGE are not used.
+HOT_SET_BUCKET = os.environ.get('HOT_SET_BUCKET', '')  # Empty disables the hot set; not the React bucket (synced with --delete)
+HOT_SET_KEY = os.environ.get('HOT_SET_KEY', 'hot-set/v1/snapshot.json')
+HOT_SET_FORMAT = 1
+HOT_SET_SIZE = int(os.environ.get('HOT_SET_SIZE', '1000'))
+HOT_SET_MAX_AGE = float(os.environ.get('HOT_SET_MAX_AGE', '7200'))  # Seconds
+
+# Short code rules. New codes, generated or custom, must match SHORT_CODE_PATTERN and must not be a JUNK_PATHS
+# entry. Redirects only reject JUNK_PATHS (and paths below them): links created before the pattern existed may not match it.
+SHORT_CODE_PATTERN = re.compile(os.environ.get('SHORT_CODE_PATTERN', r'[A-Za-z0-9_-]{1,64}'))
+JUNK_PATHS = frozenset(
+    path.strip().strip('/').lower()
+    for path in os.environ.get(
+        'JUNK_PATHS',
+        'favicon.ico,robots.txt,sitemap.xml,apple-touch-icon.png,wp-login.php,wp-admin,xmlrpc.php,.env,.git'
+    ).split(',')
+    if path.strip()
+)
+
+# Bloom filter of existing short codes, rebuilt by the rebuild_short_code_filter task. Codes created after a
+# rebuild are added to delta items in the sequences table before their link is written, one item per interval
+# and shard of the code's hash. Before answering a miss a container re-reads the deltas of the code's shard,
+# at most every SHORT_CODE_DELTA_REFRESH seconds, so a new link is found everywhere within that time.
+SHORT_CODE_FILTER_BUCKET = os.environ.get('SHORT_CODE_FILTER_BUCKET', HOT_SET_BUCKET)  # Empty disables the filter
+SHORT_CODE_FILTER_KEY = os.environ.get('SHORT_CODE_FILTER_KEY', 'short-code-filter/v1/bloom.bin')
+SHORT_CODE_FILTER_FALSE_POSITIVE_RATE = float(os.environ.get('SHORT_CODE_FILTER_FALSE_POSITIVE_RATE', '0.01'))
+SHORT_CODE_FILTER_REFRESH = float(os.environ.get('SHORT_CODE_FILTER_REFRESH', '300'))  # Seconds between S3 checks
+SHORT_CODE_DELTA_REFRESH = float(os.environ.get('SHORT_CODE_DELTA_REFRESH', '1'))  # Seconds
+SHORT_CODE_DELTA_INTERVAL = 600  # Seconds covered by one delta item
+SHORT_CODE_DELTA_SHARDS = 8  # Delta items per interval; an ADD is billed on the size of the item it grows
+SHORT_CODE_DELTA_MARGIN = 300  # Seconds before a rebuild started whose deltas are still read
+
+# Redirect lookups use their own DynamoDB client: short timeouts, adaptive retries and an overall budget
+REDIRECT_CONNECT_TIMEOUT = float(os.environ.get('REDIRECT_CONNECT_TIMEOUT', '0.5'))  # Seconds
+REDIRECT_READ_TIMEOUT = float(os.environ.get('REDIRECT_READ_TIMEOUT', '0.5'))  # Seconds
+REDIRECT_MAX_ATTEMPTS = int(os.environ.get('REDIRECT_MAX_ATTEMPTS', '3'))
+REDIRECT_LATENCY_BUDGET = float(os.environ.get('REDIRECT_LATENCY_BUDGET', '1.0'))  # Seconds before falling back
+
+# HTTP cache policy. Links may set redirect_type and cache_max_age; links without them use the defaults.
+# A positive cache_max_age lets browsers and CDNs replay the redirect, so those clicks are not counted.
+REDIRECT_STATUS_CODES = {'permanent': 301, 'temporary': 302}
+REDIRECT_DEFAULT_TYPE = os.environ.get('REDIRECT_DEFAULT_TYPE', 'permanent')
+REDIRECT_DEFAULT_MAX_AGE = int(os.environ.get('REDIRECT_DEFAULT_MAX_AGE', '0'))  # Seconds
+REDIRECT_MAX_AGE_LIMIT = 31536000  # One year
+LIST_URLS_CACHE_MAX_AGE = int(os.environ.get('LIST_URLS_CACHE_MAX_AGE', '0'))  # Seconds, private to the caller
+ANALYTICS_CACHE_MAX_AGE = int(os.environ.get('ANALYTICS_CACHE_MAX_AGE', '60'))  # Seconds, private to the caller
+
+# Click ingestion settings: 'buffered' batches click writes, 'sync' writes them during the redirect.
+# Buffers are checked against their thresholds at the end of each request and written on a background thread.
+# Lambda only sends SIGTERM before shutting a container down when an extension is registered; without one,
+# whatever an idle container still buffers when it is reclaimed is lost: fewer than CLICK_BUFFER_MAX_RECORDS
+# clicks, up to USAGE_COUNTER_FLUSH_INTERVAL seconds of counts, up to API_USAGE_FLUSH_INTERVAL seconds of API
+# usage and a batch frozen mid-write. Use 'sync' where every click must be kept.
+CLICK_INGESTION_MODE = os.environ.get('CLICK_INGESTION_MODE', 'buffered')
+CLICK_BUFFER_MAX_RECORDS = int(os.environ.get('CLICK_BUFFER_MAX_RECORDS', '25'))  # One BatchWriteItem worth
+CLICK_BUFFER_MAX_AGE = float(os.environ.get('CLICK_BUFFER_MAX_AGE', '5'))  # Seconds before a flush is forced
+CLICK_BUFFER_HARD_LIMIT = CLICK_BUFFER_MAX_RECORDS * 40  # Records kept while DynamoDB is unavailable
+
+# Usage counter settings: deltas are coalesced per short_code and optionally spread over N shard items.
+# Only ever increase USAGE_COUNTER_SHARDS, reads sum shards 0..N-1.
+USAGE_COUNTER_SHARDS = int(os.environ.get('USAGE_COUNTER_SHARDS', '1'))
+USAGE_COUNTER_FLUSH_INTERVAL = float(os.environ.get('USAGE_COUNTER_FLUSH_INTERVAL', '10'))  # Seconds
+
+# API usage metering: requests authenticated with an API key are counted per key and UTC day, coalesced
+# in memory and flushed like the usage counters. Quotas come from the account's API Gateway usage plan.
+DEFAULT_USAGE_PLAN_ID = os.environ.get('DEFAULT_USAGE_PLAN_ID', '0byjpr')  # Free plan
+API_USAGE_FLUSH_INTERVAL = float(os.environ.get('API_USAGE_FLUSH_INTERVAL', '10'))  # Seconds
+USAGE_PLAN_CACHE_TTL = float(os.environ.get('USAGE_PLAN_CACHE_TTL', '3600'))  # Seconds a usage plan quota is reused
+
+# AWS clients are created on first use, so a route only pays for the clients it needs
+_aws_clients = {}
+# DynamoDB resource of the background flush thread (boto3 resources must not be shared across threads)
+_thread_resources = threading.local()
+AWS_CLIENT_OPTIONS = {
+    'ses': {'region_name': 'us-east-1'}
+}
+
+# AWS call tracing: every call is timed and summarized in one log line per invocation.
+# SERVER_TIMING adds the summary to responses as a Server-Timing header (exposes backend timings to callers).
+AWS_CALL_TRACING = os.environ.get('AWS_CALL_TRACING', 'true').lower() == 'true'
+SERVER_TIMING = os.environ.get('SERVER_TIMING', 'false').lower() == 'true'
+DYNAMODB_CAPACITY_OPERATIONS = {
+    'GetItem', 'PutItem', 'UpdateItem', 'DeleteItem', 'Query', 'Scan',
+    'BatchGetItem', 'BatchWriteItem', 'TransactGetItems', 'TransactWriteItems'
+}
+
+# AWS calls made during the current invocation: [{'operation', 'ms', 'retries', 'capacity', 'error'}]
+_aws_call_trace = []
+
+# Metric samples aggregated across the invocation: (route, name, unit) -> {value: count}
+_metric_buffer = {}
+_metric_buffer_started_at = None
+_current_route = 'unknown'
+
+# Per-invocation logging state: whether debug/info lines of this request are sampled in, and its request ID
+_log_sampled = True
+_request_id = None
+
+# Table resources resolved and validated once per container: table name -> Table
+_table_registry = {}
+
+# Block of short code IDs leased by this container: next_id up to (excluding) end_id
+_short_code_block = {'next_id': 0, 'end_id': 0}
+
+# Token buckets per container: '<client>|<RATE_LIMITS entry>' -> (tokens, updated_at), and tokens leased
+# from the shared buckets but not spent yet (only kept for buckets in _rate_buckets)
+_rate_buckets = OrderedDict()
+_rate_leases = {}
+
+# Resolved identities keyed by a digest of the bearer token or API key: digest -> (expires_at, identity)
+_auth_cache = OrderedDict()
+
+# Container-level redirect cache: short_code -> (expires_at, item or None for a known miss).
+# Expired links are kept for REDIRECT_CACHE_STALE_TTL so they can be served when DynamoDB fails.
+_redirect_cache = OrderedDict()
+redirect_cache_stats = {'hits': 0, 'negative_hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'stale_hits': 0, 'hot_set_hits': 0}
+_redirect_cache_stats_emitted = {'at': 0, 'counts': {}}  # Counter values at the last metric emission
+
+# Hot links loaded from the snapshot: sorted short codes and, at the same positions,
+# (long_url, owner_email, redirect_type, cache_max_age) tuples
+_hot_set = {'loaded': False, 'generated_at': 0, 'codes': (), 'links': (), 'served': set()}
+
+# Loaded short code Bloom filter and, by delta shard, the codes created since it was built
+_short_code_filter = {
+    'bits': None, 'size': 0, 'hashes': 0, 'generated_at': 0, 'etag': None, 'checked_at': 0,
+    'delta': {}, 'delta_checked_at': {}
+}
+
+# Worker threads that run redirect lookups so they can be abandoned when over budget
+_redirect_executor = None
+
+# Buffered click ingestion: raw click records waiting for a BatchWriteItem
+_click_buffer = []
+_click_buffer_started_at = None
+
+# Background flush of the ingestion buffers: the single flush thread and the batch it is writing
+_flush_executor = None
+_flush_future = None
+
+# Coalesced rollup counters waiting to be written: (short_code, day) -> {attribute: count}
+_rollup_increments = {}
+
+# Cached head_object of the React app's index.html: {'expires_at', 'response' or None after an error}
+_react_app_metadata = {'expires_at': 0, 'response': None}
+
+# Rendered root page for the current (last_modified, lambda_version): {'key', 'body', 'etag'}
+_root_page = {'key': None, 'body': None, 'etag': None}
+
+# Coalesced usage_count deltas per short_code waiting to be written, and the owner of each short_code
+_usage_increments = {}
+_usage_increments_started_at = None
+_usage_owners = {}
+
+# Coalesced API request counts waiting to be written: (api_key_hash, day) -> count
+_api_usage_increments = {}
+_api_usage_increments_started_at = None
+
+# Usage plan quotas per container: usage plan ID -> (expires_at, quota dict or None)
+_usage_plan_cache = {}
+
+# total_clicks deltas per account, added once the short codes' own counters were written
+_account_click_increments = {}
+
+def log(level, message, **fields):
+    """
+    Write a structured log line as compact single-line JSON.
+
+    Lines below LOG_LEVEL are dropped before anything is serialized. Debug and
+    info lines are also dropped for requests that were not sampled in for
+    their route; warnings and errors are always written.
+
+    Args:
+        level (str): 'debug', 'info', 'warning' or 'error'
+        message (str): Short, constant description of the event
+        **fields: Additional values to include in the line
+    """
+    severity = LOG_LEVELS[level]
+    if severity < LOG_LEVEL or (severity < LOG_LEVELS['warning'] and not _log_sampled):
+        return
+
+    line = {'level': level.upper(), 'message': message, 'route': _current_route}
+    if _request_id:
+        line['request_id'] = _request_id
+    line.update(fields)
+    print(json.dumps(line, separators=(',', ':'), default=str))
+
+def get_aws_client(service_name):
+    """
+    Get a boto3 client for a service, creating it on first use in this container.
+
+    Args:
+        service_name (str): AWS service name, e.g. 's3' or 'cloudwatch'
+
+    Returns:
+        BaseClient: The boto3 client
+    """
+    client = _aws_clients.get(service_name)
+    if client is None:
+        client = boto3.client(service_name, **AWS_CLIENT_OPTIONS.get(service_name, {}))
+        instrument_client(client)
+        _aws_clients[service_name] = client
+    return client
+
+def get_dynamodb():
+    """
+    Get the DynamoDB service resource, creating it on first use in this container.
+
+    Returns:
+        ServiceResource: The boto3 DynamoDB resource (the thread's own one on the flush thread)
+    """
+    resource = getattr(_thread_resources, 'dynamodb', None) or _aws_clients.get('dynamodb')
+    if resource is None:
+        resource = boto3.resource('dynamodb')
+        instrument_client(resource.meta.client)
+        _aws_clients['dynamodb'] = resource
+    return resource
+
+def get_redirect_table():
+    """
+    Get the URLs table through the redirect DynamoDB client.
+
+    The client fails fast (REDIRECT_CONNECT_TIMEOUT, REDIRECT_READ_TIMEOUT) and
+    uses adaptive retries capped at REDIRECT_MAX_ATTEMPTS, so a throttled table
+    costs the redirect a bounded amount of time instead of the default retries.
+
+    Returns:
+        Table: The boto3 Table resource for redirect lookups
+    """
+    resource = _aws_clients.get('dynamodb_redirect')
+    if resource is None:
+        resource = boto3.resource('dynamodb', config=Config(
+            connect_timeout=REDIRECT_CONNECT_TIMEOUT,
+            read_timeout=REDIRECT_READ_TIMEOUT,
+            retries={'max_attempts': REDIRECT_MAX_ATTEMPTS, 'mode': 'adaptive'}
+        ))
+        instrument_client(resource.meta.client)
+        _aws_clients['dynamodb_redirect'] = resource
+    return resource.Table(get_urls_table().name)
+
+def get_redirect_s3_client():
+    """
+    Get the S3 client for reads on the redirect path (the hot set snapshot).
+
+    Uses the same timeouts and retries as the redirect DynamoDB client.
+
+    Returns:
+        BaseClient: The boto3 S3 client
+    """
+    client = _aws_clients.get('s3_redirect')
+    if client is None:
+        client = boto3.client('s3', config=Config(
+            connect_timeout=REDIRECT_CONNECT_TIMEOUT,
+            read_timeout=REDIRECT_READ_TIMEOUT,
+            retries={'max_attempts': REDIRECT_MAX_ATTEMPTS, 'mode': 'adaptive'}
+        ))
+        instrument_client(client)
+        _aws_clients['s3_redirect'] = client
+    return client
+
+def instrument_client(client):
+    """
+    Register the botocore event hooks that trace every call made with a client.
+
+    DynamoDB calls also ask for their consumed capacity so it can be traced.
+
+    Args:
+        client (BaseClient): The boto3 client
+    """
+    if not AWS_CALL_TRACING:
+        return
+    events = client.meta.events
+    events.register('before-call', _trace_call_started)
+    events.register('after-call', _trace_call_finished)
+    events.register('after-call-error', _trace_call_failed)
+    if client.meta.service_model.service_name == 'dynamodb':
+        events.register('provide-client-params.dynamodb', _request_consumed_capacity)
+
+def _request_consumed_capacity(params, model, **kwargs):
+    if model.name in DYNAMODB_CAPACITY_OPERATIONS:
+        params.setdefault('ReturnConsumedCapacity', 'TOTAL')
+
+def _trace_call_started(model, context, **kwargs):
+    context['trace_operation'] = f'{model.service_model.service_name}.{model.name}'
+    context['trace_started_at'] = time.perf_counter()
+
+def _trace_call_finished(parsed, context, **kwargs):
+    capacity = parsed.get('ConsumedCapacity')
+    if isinstance(capacity, dict):
+        capacity = [capacity]
+    _record_call(context, {
+        'retries': parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0),
+        'capacity': sum(float(entry.get('CapacityUnits', 0)) for entry in capacity or []),
+        'error': parsed.get('Error', {}).get('Code')
+    })
+
+def _trace_call_failed(context, exception, **kwargs):
+    _record_call(context, {'retries': 0, 'capacity': 0, 'error': type(exception).__name__})
+
+def _record_call(context, details):
+    started_at = context.get('trace_started_at')
+    details['operation'] = context.get('trace_operation', 'unknown')
+    details['ms'] = (time.perf_counter() - started_at) * 1000 if started_at else 0
+    # The flush thread keeps its own trace: its calls belong to no invocation. list.append is atomic,
+    # so calls made from redirect worker threads are recorded safely
+    trace = getattr(_thread_resources, 'call_trace', None)
+    (_aws_call_trace if trace is None else trace).append(details)
+
+def summarize_aws_calls(trace=None):
+    """
+    Summarize the AWS calls of the current invocation per operation.
+
+    Args:
+        trace (list, optional): Calls to summarize instead of the invocation's
+
+    Returns:
+        dict: operation -> {'count', 'ms', 'retries', 'capacity', 'errors'}
+    """
+    summary = {}
+    for call in list(_aws_call_trace if trace is None else trace):
+        entry = summary.setdefault(call['operation'], {'count': 0, 'ms': 0.0, 'retries': 0, 'capacity': 0.0, 'errors': 0})
+        entry['count'] += 1
+        entry['ms'] += call['ms']
+        entry['retries'] += call['retries']
+        entry['capacity'] += call['capacity']
+        entry['errors'] += 1 if call['error'] else 0
+    for entry in summary.values():
+        entry['ms'] = round(entry['ms'], 2)
+    return summary
+
+def build_server_timing(summary):
+    """
+    Format an AWS call summary as a Server-Timing header value.
+
+    Args:
+        summary (dict): Result of summarize_aws_calls
+
+    Returns:
+        str: e.g. 'aws;dur=12.4, dynamodb-GetItem;desc="1 call";dur=3.1'
+    """
+    def metric(name, count, ms):
+        return f"{name};desc=\"{count} call{'s' if count != 1 else ''}\";dur={ms:.1f}"
+
+    metrics = [metric('aws', sum(e['count'] for e in summary.values()), sum(e['ms'] for e in summary.values()))]
+    for operation, entry in summary.items():
+        metrics.append(metric(operation.replace('.', '-'), entry['count'], entry['ms']))
+    return ', '.join(metrics)
+
+def get_react_app_metadata():
+    """
+    Return the head_object response for the React app's index.html.
+
+    The response is cached per container for REACT_APP_METADATA_TTL seconds so
+    the root page does not cost an S3 round trip per request. Errors are
+    remembered for a shorter time.
+
+    Returns:
+        dict: head_object response, or None if S3 could not be read
+    """
+    now = time.time()
+    if now < _react_app_metadata['expires_at']:
+        return _react_app_metadata['response']
 
-def get_react_app_version():
     try:
-        # Retrieve the latest version ID for the index.html file
-        response = s3.head_object(Bucket=S3_BUCKET_NAME, Key=REACT_APP_INDEX_KEY)
-        version_id = response.get('VersionId', 'N/A')  # Fallback to 'N/A' if no version ID
-        return version_id
+        response = get_aws_client('s3').head_object(Bucket=S3_BUCKET_NAME, Key=REACT_APP_INDEX_KEY)
+        _react_app_metadata['response'] = response
+        _react_app_metadata['expires_at'] = now + REACT_APP_METADATA_TTL
     except ClientError as e:
-        print(f"Error fetching React app version from S3: {e}")
-        return 'Error'
+        log('error', 'Error fetching React app metadata from S3', error=str(e))
+        _react_app_metadata['response'] = None
+        _react_app_metadata['expires_at'] = now + REACT_APP_METADATA_ERROR_TTL
+    return _react_app_metadata['response']
 
 def get_react_app_last_modified():
-    try:
-        # Retrieve the last modified timestamp for the index.html file
-        response = s3.head_object(Bucket=S3_BUCKET_NAME, Key=REACT_APP_INDEX_KEY)
-        last_modified = response.get('LastModified')  # Get the LastModified timestamp
-        if last_modified:
-            # Format the timestamp to a human-readable format, if needed
-            return last_modified.strftime('%Y-%m-%d %H:%M:%S')
-        else:
-            return 'Unknown'
-    except ClientError as e:
-        print(f"Error fetching React app last modified timestamp from S3: {e}")
+    response = get_react_app_metadata()
+    if response is None:
         return 'Error'
+    last_modified = response.get('LastModified')
+    if last_modified:
+        # Format the timestamp to a human-readable format, if needed
+        return last_modified.strftime('%Y-%m-%d %H:%M:%S')
+    return 'Unknown'
+
+def render_root_page(react_app_last_modified, lambda_version):
+    """
+    Return the root page HTML and its ETag, rendering only when the inputs change.
+
+    Args:
+        react_app_last_modified (str): Display timestamp of the React app build
+        lambda_version (str): Version of this Lambda function
+
+    Returns:
+        tuple: (body, etag)
+    """
+    key = (react_app_last_modified, lambda_version)
+    if _root_page['key'] == key:
+        return _root_page['body'], _root_page['etag']
+
+    body = f"""
+                <html>
+                <head>
+                    <title>linq.red</title>
+                    <style>
+                        body, html {{
+                            margin: 0;
+                            padding: 0;
+                            height: 100%;
+                            font-family: Arial, sans-serif;
+                        }}
+                        iframe {{
+                            border: none;
+                            width: 100vw;
+                            height: calc(100vh - 40px);
+                        }}
+                        footer {{
+                            height: 40px;
+                            background-color: #333;
+                            color: #f1f1f1;
+                            display: flex;
+                            justify-content: space-between;
+                            align-items: center;
+                            padding: 0 20px;
+                            font-size: 0.8em;
+                        }}
+                    </style>
+                </head>
+                <body>
+                    <iframe src="https://{S3_BUCKET_NAME}.s3.amazonaws.com/{REACT_APP_INDEX_KEY}"></iframe>
+                    <footer>
+                        <span>React App Version: {react_app_last_modified}</span>
+                        <span>Lambda Version: {lambda_version}</span>
+                    </footer>
+                </body>
+                </html>
+            """
+    etag = '"' + hashlib.sha256(body.encode('utf-8')).hexdigest()[:32] + '"'
+    _root_page.update(key=key, body=body, etag=etag)
+    return body, etag
+
+def get_header(event, name):
+    """
+    Return a request header value, matching the header name case-insensitively.
+
+    Args:
+        event (dict): API Gateway event object
+        name (str): Header name
+
+    Returns:
+        str: Header value, or None if the header is absent
+    """
+    headers = event.get('headers') or {}
+    value = headers.get(name)
+    if value is not None:
+        return value
+    name = name.lower()
+    for header, value in headers.items():
+        if header.lower() == name:
+            return value
+    return None
+
+def etag_matches(if_none_match, etag):
+    """
+    Check an If-None-Match header against an entity tag (weak comparison).
+
+    Args:
+        if_none_match (str): If-None-Match header value
+        etag (str): Current entity tag, including quotes
+
+    Returns:
+        bool: True if the client's copy is current
+    """
+    if if_none_match.strip() == '*':
+        return True
+    if etag.startswith('W/'):
+        etag = etag[2:]
+    for tag in if_none_match.split(','):
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        if tag == etag:
+            return True
+    return False
+
+def serve_root_page(event, context):
+    """
+    Serve the root page with validators, answering conditional requests with 304.
+
+    Args:
+        event (dict): API Gateway event object
+        context (object): Lambda context object
+
+    Returns:
+        dict: API Gateway response
+    """
+    from email.utils import format_datetime, parsedate_to_datetime
+
+    metadata = get_react_app_metadata()
+    last_modified = metadata.get('LastModified') if metadata else None
+    react_app_last_modified = get_react_app_last_modified()
+    lambda_version = context.function_version
+    body, etag = render_root_page(react_app_last_modified, lambda_version)
+
+    headers = {
+        'Content-Type': 'text/html',
+        'ETag': etag,
+        'Cache-Control': f'public, max-age={ROOT_PAGE_MAX_AGE}',
+        **DEFAULT_HEADERS
+    }
+    if last_modified:
+        headers['Last-Modified'] = format_datetime(last_modified.astimezone(timezone.utc), usegmt=True)
+
+    # If-None-Match takes precedence over If-Modified-Since (RFC 9110 13.2.2)
+    if_none_match = get_header(event, 'If-None-Match')
+    if if_none_match is not None:
+        not_modified = etag_matches(if_none_match, etag)
+    else:
+        not_modified = False
+        if_modified_since = get_header(event, 'If-Modified-Since')
+        if if_modified_since and last_modified:
+            try:
+                not_modified = last_modified.replace(microsecond=0) <= parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                not_modified = False
+
+    if not_modified:
+        headers.pop('Content-Type')
+        return {"statusCode": 304, "headers": headers, "body": ""}
+    return {"statusCode": 200, "headers": headers, "body": body}
 
 def log_metric(name, value, unit='Count'):
-    try:
-        cloudwatch.put_metric_data(
-            Namespace='linq.red/Metrics',
-            MetricData=[{
-                'MetricName': name,
-                'Unit': unit,
-                'Value': value
-            }]
-        )
-    except ClientError as e:
-        print(f"CloudWatch metric error: {e}")
+    """
+    Record a metric sample for the current route.
+
+    Samples are aggregated in memory and emitted by flush_metrics, so recording
+    a metric never makes a network call.
+
+    Args:
+        name (str): Metric name
+        value (float): Sample value
+        unit (str): CloudWatch unit of the sample
+    """
+    global _metric_buffer_started_at
+
+    if not _metric_buffer:
+        _metric_buffer_started_at = time.time()
+    samples = _metric_buffer.setdefault((_current_route, name, unit), {})
+    samples[value] = samples.get(value, 0) + 1
+
+def flush_metrics(force=False):
+    """
+    Emit the aggregated metric samples.
+
+    In 'emf' mode one Embedded Metric Format log line is printed per route and
+    CloudWatch extracts the metrics asynchronously. In 'api' mode all samples
+    are sent as value/count arrays in batched put_metric_data calls, at most
+    once per METRICS_FLUSH_INTERVAL unless forced.
+
+    Args:
+        force (bool): Send buffered samples in 'api' mode even if the flush interval has not passed
+    """
+    global _metric_buffer, _metric_buffer_started_at
+
+    if not _metric_buffer:
+        return
+
+    if METRICS_EMIT_MODE == 'api' and not force and time.time() - _metric_buffer_started_at < METRICS_FLUSH_INTERVAL:
+        return
+
+    metrics, _metric_buffer, _metric_buffer_started_at = _metric_buffer, {}, None
+
+    if METRICS_EMIT_MODE == 'api':
+        put_metric_batches(metrics)
+    else:
+        print_emf_metrics(metrics)
+
+def print_emf_metrics(metrics):
+    """
+    Print aggregated metrics as Embedded Metric Format log lines, one per route.
+
+    Args:
+        metrics (dict): (route, name, unit) -> {value: count}
+    """
+    by_route = {}
+    for (route, name, unit), samples in metrics.items():
+        by_route.setdefault(route, []).append((name, unit, samples))
+
+    for route, route_metrics in by_route.items():
+        pending = [
+            (name, unit, [value for value, count in samples.items() for _ in range(count)])
+            for name, unit, samples in route_metrics
+        ]
+        while pending:
+            document = {
+                '_aws': {
+                    'Timestamp': int(time.time() * 1000),
+                    'CloudWatchMetrics': [{
+                        'Namespace': METRICS_NAMESPACE,
+                        # The dimensionless series is the one dashboards and alarms were built on
+                        'Dimensions': [[], ['Route']],
+                        'Metrics': [{'Name': name, 'Unit': unit} for name, unit, _ in pending]
+                    }]
+                },
+                'Route': route
+            }
+            # EMF accepts at most 100 values per metric in a single document
+            for name, _, values in pending:
+                document[name] = values[:100] if len(values) > 1 else values[0]
+            print(json.dumps(document, separators=(',', ':')))
+            pending = [(name, unit, values[100:]) for name, unit, values in pending if len(values) > 100]
+
+def put_metric_batches(metrics):
+    """
+    Send aggregated metrics to CloudWatch in as few put_metric_data calls as possible.
+
+    Every metric is sent twice: without dimensions, the series dashboards and
+    alarms were built on, and with its Route dimension.
+
+    Args:
+        metrics (dict): (route, name, unit) -> {value: count}
+    """
+    metric_data = []
+    for (route, name, unit), samples in metrics.items():
+        for dimensions in ([], [{'Name': 'Route', 'Value': route}]):
+            datum = {'MetricName': name, 'Dimensions': dimensions, 'Unit': unit}
+            if len(samples) <= 150:
+                # PutMetricData accepts up to 150 distinct values per datum
+                datum['Values'] = list(samples.keys())
+                datum['Counts'] = list(samples.values())
+            else:
+                datum['StatisticValues'] = {
+                    'SampleCount': sum(samples.values()),
+                    'Sum': sum(value * count for value, count in samples.items()),
+                    'Minimum': min(samples),
+                    'Maximum': max(samples)
+                }
+            metric_data.append(datum)
+
+    # PutMetricData accepts up to 1000 metrics per call, two per buffered metric
+    keys = list(metrics)
+    for i in range(0, len(keys), 500):
+        try:
+            get_aws_client('cloudwatch').put_metric_data(Namespace=METRICS_NAMESPACE, MetricData=metric_data[2 * i:2 * i + 1000])
+        except (ClientError, BotoCoreError) as e:
+            log('error', 'CloudWatch metric error', error=str(e))
+            requeue_metrics({key: metrics[key] for key in keys[i:i + 500]})
+
+def requeue_metrics(metrics):
+    """
+    Merge samples that could not be sent back into the metric buffer for the next flush.
+
+    Metrics that already hold METRICS_REQUEUE_MAX_VALUES distinct values keep
+    only those, so an outage cannot grow the buffer without bound.
+
+    Args:
+        metrics (dict): (route, name, unit) -> {value: count}
+    """
+    global _metric_buffer_started_at
+
+    if not _metric_buffer:
+        _metric_buffer_started_at = time.time()
+    for key, samples in metrics.items():
+        pending = _metric_buffer.setdefault(key, {})
+        for value, count in samples.items():
+            if value in pending or len(pending) < METRICS_REQUEUE_MAX_VALUES:
+                pending[value] = pending.get(value, 0) + count
+
+def get_cached_redirect(short_code):
+    """
+    Look up a short code in the container-level redirect cache.
+
+    Args:
+        short_code (str): The short code to look up
+
+    Returns:
+        tuple: (cache_hit, item) where item is None for a cached 404
+    """
+    entry = _redirect_cache.get(short_code)
+    if entry is None:
+        redirect_cache_stats['misses'] += 1
+        return False, None
+
+    expires_at, item = entry
+    now = time.time()
+    if expires_at <= now:
+        # Keep an expired link as a fallback for failed lookups until it is refreshed or too stale
+        if item is None or expires_at + REDIRECT_CACHE_STALE_TTL <= now:
+            del _redirect_cache[short_code]
+        redirect_cache_stats['expirations'] += 1
+        redirect_cache_stats['misses'] += 1
+        return False, None
+
+    _redirect_cache.move_to_end(short_code)
+    if item is None:
+        redirect_cache_stats['negative_hits'] += 1
+    else:
+        redirect_cache_stats['hits'] += 1
+    return True, item
+
+def get_stale_redirect(short_code):
+    """
+    Get an expired cached link that is still within REDIRECT_CACHE_STALE_TTL.
+
+    Args:
+        short_code (str): The short code whose lookup failed
+
+    Returns:
+        dict: The last known URL item, or None if there is none to fall back to
+    """
+    entry = _redirect_cache.get(short_code)
+    if entry is None or entry[1] is None or entry[0] + REDIRECT_CACHE_STALE_TTL <= time.time():
+        return None
+    redirect_cache_stats['stale_hits'] += 1
+    return entry[1]
+
+def cache_redirect(short_code, item):
+    """
+    Store a lookup result in the redirect cache, evicting the least recently used entries.
+
+    Args:
+        short_code (str): The short code that was looked up
+        item (dict or None): The URL item, or None to remember that the code does not exist
+    """
+    if REDIRECT_CACHE_MAX_ENTRIES <= 0:
+        return
+
+    if item is None:
+        ttl = REDIRECT_CACHE_NEGATIVE_TTL
+    else:
+        ttl = REDIRECT_CACHE_TTL
+        item = {k: item[k] for k in REDIRECT_CACHE_ATTRIBUTES if k in item}
+    if ttl <= 0:
+        return
+
+    _redirect_cache[short_code] = (time.time() + ttl, item)
+    _redirect_cache.move_to_end(short_code)
+    while len(_redirect_cache) > REDIRECT_CACHE_MAX_ENTRIES:
+        _redirect_cache.popitem(last=False)
+        redirect_cache_stats['evictions'] += 1
+
+def invalidate_redirect(short_code):
+    """Drop a short code from the redirect cache, e.g. after it was created or changed."""
+    _redirect_cache.pop(short_code, None)
+
+def get_redirect_cache_stats():
+    """Return the redirect cache counters together with its current size."""
+    lookups = redirect_cache_stats['hits'] + redirect_cache_stats['negative_hits'] + redirect_cache_stats['misses']
+    hit_count = redirect_cache_stats['hits'] + redirect_cache_stats['negative_hits']
+    return {
+        **redirect_cache_stats,
+        'size': len(_redirect_cache),
+        'max_entries': REDIRECT_CACHE_MAX_ENTRIES,
+        'hit_ratio': round(hit_count / lookups, 4) if lookups else 0.0
+    }
+
+def emit_redirect_cache_stats():
+    """
+    Record the redirect cache counters as metrics, at most once per REDIRECT_CACHE_STATS_INTERVAL.
+
+    Counters are recorded as the change since the previous emission (e.g.
+    RedirectCacheHits, RedirectCacheEvictions) together with the current
+    RedirectCacheSize, so hit ratio and evictions can be summed across
+    containers when sizing REDIRECT_CACHE_MAX_ENTRIES and the TTLs.
+    """
+    now = time.time()
+    if now - _redirect_cache_stats_emitted['at'] < REDIRECT_CACHE_STATS_INTERVAL:
+        return
+
+    previous = _redirect_cache_stats_emitted['counts']
+    for name, count in redirect_cache_stats.items():
+        log_metric('RedirectCache' + name.title().replace('_', ''), count - previous.get(name, 0))
+    log_metric('RedirectCacheSize', len(_redirect_cache))
+    log('info', 'Redirect cache stats', **get_redirect_cache_stats())
+    _redirect_cache_stats_emitted.update(at=now, counts=dict(redirect_cache_stats))
 
 def build_response(status_code, body=None, extra_headers=None):
     headers = DEFAULT_HEADERS.copy()
@@ -87,6 +948,33 @@ def build_response(status_code, body=None, extra_headers=None):
         'body': json.dumps(body) if body else ""
     }
 
+def with_validators(event, response, max_age=0):
+    """
+    Add an ETag to a successful JSON response and answer If-None-Match with 304.
+
+    The responses are per caller, so they are only cacheable privately.
+
+    Args:
+        event (dict): API Gateway event object
+        response (dict): Response from build_response
+        max_age (int): Seconds the client may reuse the response without revalidating
+
+    Returns:
+        dict: The response with ETag and Cache-Control, or a 304 response
+    """
+    if response.get('statusCode') != 200:
+        return response
+
+    etag = 'W/"' + hashlib.sha256(response['body'].encode('utf-8')).hexdigest()[:32] + '"'
+    response['headers']['ETag'] = etag
+    response['headers']['Cache-Control'] = f'private, max-age={max_age}' if max_age > 0 else 'private, no-cache'
+
+    if_none_match = get_header(event, 'If-None-Match')
+    if if_none_match is not None and etag_matches(if_none_match, etag):
+        log_metric('NotModified', 1)
+        return {'statusCode': 304, 'headers': response['headers'], 'body': ''}
+    return response
+
 def register_user(event):
     """
     Register a new user with email and password, and create an API key.
@@ -100,7 +988,7 @@ def register_user(event):
     body = json.loads(event.get('body', '{}'))
     email = body.get('email')
     password = body.get('password')
-    usage_plan_id = body.get('usage_plan', '0byjpr')  # Default to Free plan ID if none specified
+    usage_plan_id = body.get('usage_plan', DEFAULT_USAGE_PLAN_ID)  # Default to Free plan ID if none specified
 
     if not email or not password:
         return build_response(400, {'error': 'Email and password are required'})
@@ -110,8 +998,9 @@ def register_user(event):
 
     start_time = time.time()
     try:
-        # Get the accounts table
+        # Get the accounts table, and the API key table before an API key exists that could be orphaned
         accounts_table = get_accounts_table()
+        api_keys_table = get_api_keys_table()
 
         # Check if user already exists
         response = accounts_table.get_item(Key={'email': email})
@@ -119,32 +1008,64 @@ def register_user(event):
             return build_response(409, {'error': 'User already exists'})
 
         # Hash the password
-        password_hash, salt = hash_password(password)
+        password_attributes = build_password_attributes(password)
 
         # Create a new API key
-        api_key_response = apigateway.create_api_key(name=email, enabled=True, generateDistinctId=True)
+        api_key_response = get_aws_client('apigateway').create_api_key(name=email, enabled=True, generateDistinctId=True)
         api_key_id = api_key_response['id']
         api_key_value = api_key_response['value']
 
-        # Associate the new API key with the selected usage plan
-        apigateway.create_usage_plan_key(
-            usagePlanId=usage_plan_id,
-            keyId=api_key_id,
-            keyType='API_KEY'
-        )
+        try:
+            # Associate the new API key with the selected usage plan
+            get_aws_client('apigateway').create_usage_plan_key(
+                usagePlanId=usage_plan_id,
+                keyId=api_key_id,
+                keyType='API_KEY'
+            )
 
-        # Create user in DynamoDB
-        accounts_table.put_item(
-            Item={
-                'email': email,
-                'password_hash': base64.b64encode(password_hash).decode('utf-8'),
-                'salt': base64.b64encode(salt).decode('utf-8'),
-                'api_key_id': api_key_id,
-                'api_key': api_key_value,
-                'created_at': datetime.utcnow().isoformat(),
-                'last_login': None
-            }
-        )
+            # Create user and the API key lookup entry in DynamoDB
+            get_dynamodb().meta.client.transact_write_items(TransactItems=[
+                {
+                    'Put': {
+                        'TableName': accounts_table.name,
+                        'Item': {
+                            'email': email,
+                            **password_attributes,
+                            'api_key_id': api_key_id,
+                            'api_key': api_key_value,
+                            'usage_plan_id': usage_plan_id,
+                            'created_at': datetime.utcnow().isoformat(),
+                            'last_login': None,
+                            'url_count': 0,
+                            'total_clicks': 0
+                        },
+                        'ConditionExpression': 'attribute_not_exists(email)'
+                    }
+                },
+                {
+                    'Put': {
+                        'TableName': api_keys_table.name,
+                        'Item': build_api_key_entry(api_key_value, email, api_key_id, usage_plan_id)
+                    }
+                }
+            ])
+        except (ClientError, BotoCoreError) as e:
+            created = False
+            if isinstance(e, BotoCoreError):
+                # A timed out transaction may still have committed; an account must never lose its key
+                try:
+                    account = accounts_table.get_item(Key={'email': email}, ConsistentRead=True).get('Item') or {}
+                    created = account.get('api_key_id') == api_key_id
+                except (ClientError, BotoCoreError):
+                    created = None  # Unknown: keep the key rather than risk deleting a live account's
+            if created is False:
+                # Don't leave an API key behind for an account that was not created
+                try:
+                    get_aws_client('apigateway').delete_api_key(apiKey=api_key_id)
+                except (ClientError, BotoCoreError) as delete_error:
+                    log('error', 'Error deleting orphaned API key', api_key_id=api_key_id, error=str(delete_error))
+            if not created:
+                raise
 
         # Generate JWT token
         token = generate_jwt_token(email)
@@ -161,9 +1082,9 @@ def register_user(event):
             'token': token
         })
 
-    except ClientError as e:
+    except (ClientError, BotoCoreError) as e:
         log_metric('RegisterUserError', 1)
-        print(f"Error registering user: {str(e)}")
+        log('error', 'Error registering user', error=str(e))
         return build_response(500, {'error': 'Failed to register user'})
 
 def login_user(event):
@@ -195,21 +1116,53 @@ def login_user(event):
 
         user = response['Item']
 
-        # Verify password
+        # Verify password with the parameters it was hashed with
         stored_password = base64.b64decode(user['password_hash'])
         stored_salt = base64.b64decode(user['salt'])
+        algorithm, iterations = get_password_parameters(user)
 
-        if not verify_password(stored_password, stored_salt, password):
+        if algorithm != PASSWORD_HASH_ALGORITHM:
+            log('error', 'Unsupported password hash algorithm', algorithm=algorithm)
             return build_response(401, {'error': 'Invalid email or password'})
 
-        # Update last login time
-        accounts_table.update_item(
-            Key={'email': email},
-            UpdateExpression='SET last_login = :time',
-            ExpressionAttributeValues={
-                ':time': datetime.utcnow().isoformat()
-            }
-        )
+        if not verify_password(stored_password, stored_salt, password, iterations):
+            return build_response(401, {'error': 'Invalid email or password'})
+
+        login_time = datetime.utcnow().isoformat()
+        if iterations != PASSWORD_HASH_ITERATIONS:
+            # Rehash with the current parameters in the same write as the login time.
+            # The condition keeps a password reset that raced this login.
+            password_attributes = build_password_attributes(password)
+            try:
+                accounts_table.update_item(
+                    Key={'email': email},
+                    UpdateExpression='SET last_login = :time, password_hash = :hash, salt = :salt, '
+                                     'password_algorithm = :algorithm, password_iterations = :iterations',
+                    ConditionExpression='password_hash = :old_hash',
+                    ExpressionAttributeValues={
+                        ':time': login_time,
+                        ':hash': password_attributes['password_hash'],
+                        ':salt': password_attributes['salt'],
+                        ':algorithm': password_attributes['password_algorithm'],
+                        ':iterations': password_attributes['password_iterations'],
+                        ':old_hash': user['password_hash']
+                    }
+                )
+                log_metric('PasswordRehashed', 1)
+                login_time = None
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+
+        if login_time:
+            # Update last login time
+            accounts_table.update_item(
+                Key={'email': email},
+                UpdateExpression='SET last_login = :time',
+                ExpressionAttributeValues={
+                    ':time': login_time
+                }
+            )
 
         # Generate JWT token
         token = generate_jwt_token(email)
@@ -228,7 +1181,7 @@ def login_user(event):
 
     except ClientError as e:
         log_metric('LoginUserError', 1)
-        print(f"Error logging in user: {str(e)}")
+        log('error', 'Error logging in user', error=str(e))
         return build_response(500, {'error': 'Failed to login'})
 
 def forgot_password(event):
@@ -260,19 +1213,25 @@ def forgot_password(event):
         new_password = generate_secure_password()
 
         # Hash the new password
-        password_hash, salt = hash_password(new_password)
+        password_attributes = build_password_attributes(new_password)
 
         # Save the new password in the database
         accounts_table = get_accounts_table()
         accounts_table.update_item(
             Key={'email': email},
-            UpdateExpression='SET password_hash = :hash, salt = :salt',
+            UpdateExpression='SET password_hash = :hash, salt = :salt, '
+                             'password_algorithm = :algorithm, password_iterations = :iterations',
             ExpressionAttributeValues={
-                ':hash': base64.b64encode(password_hash).decode('utf-8'),
-                ':salt': base64.b64encode(salt).decode('utf-8')
+                ':hash': password_attributes['password_hash'],
+                ':salt': password_attributes['salt'],
+                ':algorithm': password_attributes['password_algorithm'],
+                ':iterations': password_attributes['password_iterations']
             }
         )
 
+        # Credentials resolved before the reset must not be reused from the cache
+        invalidate_auth_cache(email=email)
+
         # Send the password to the user's email
         send_success = send_password_email(email, new_password)
 
@@ -289,7 +1248,7 @@ def forgot_password(event):
 
     except ClientError as e:
         log_metric('ForgotPasswordError', 1)
-        print(f"Error processing forgot password: {str(e)}")
+        log('error', 'Error processing forgot password', error=str(e))
         return build_response(500, {'error': 'An error occurred processing your request'})
 
 def get_user_urls(event):
@@ -317,24 +1276,34 @@ def get_user_urls(event):
         # Get the URLs table
         urls_table = get_urls_table()
 
-        # Prepare scan parameters to find URLs by owner_email
-        scan_params = {
-            'FilterExpression': 'owner_email = :email',
+        # Query the owner index for this user's URLs, newest first
+        query_params = {
+            'IndexName': OWNER_INDEX_NAME,
+            'KeyConditionExpression': 'owner_email = :email',
             'ExpressionAttributeValues': {':email': user_email},
+            'ScanIndexForward': False,
             'Limit': limit
         }
 
         # Add pagination token if provided
         if next_token:
-            scan_params['ExclusiveStartKey'] = json.loads(base64.b64decode(next_token).decode('utf-8'))
+            try:
+                start_key = json.loads(base64.b64decode(next_token).decode('utf-8'))
+            except (ValueError, TypeError):
+                return build_response(400, {'error': 'Invalid pagination token'})
+            # Tokens are index positions, so they can only continue the caller's own listing
+            if not isinstance(start_key, dict) or start_key.get('owner_email') != user_email:
+                return build_response(400, {'error': 'Invalid pagination token'})
+            query_params['ExclusiveStartKey'] = start_key
 
-        # Execute the scan
-        response = urls_table.scan(**scan_params)
+        # Execute the query
+        response = urls_table.query(**query_params)
 
         # Process results
         items = response.get('Items', [])
 
         # Format URLs with basic stats
+        usage_counts = get_usage_counts(items)
         urls = []
         for item in items:
             # Get additional click analytics if available
@@ -344,7 +1313,7 @@ def get_user_urls(event):
                 'long_url': item.get('long_url'),
                 'created_at': item.get('creation_date'),
                 'status': item.get('status'),
-                'total_clicks': item.get('usage_count', 0)
+                'total_clicks': usage_counts[item['short_code']]
             }
             urls.append(url_stats)
 
@@ -362,7 +1331,7 @@ def get_user_urls(event):
         })
 
     except Exception as e:
-        print(f"Error getting user URLs: {str(e)}")
+        log('error', 'Error getting user URLs', error=str(e))
         return build_response(500, {'error': 'Failed to retrieve URLs'})
 
 def get_url_analytics(event):
@@ -388,6 +1357,15 @@ def get_url_analytics(event):
     if not short_code:
         return build_response(400, {'error': 'Short code is required'})
 
+    try:
+        start_day, end_day = parse_analytics_range(query_params)
+    except ValueError as e:
+        return build_response(400, {'error': str(e)})
+
+    source = query_params.get('source', 'rollup')
+    if source not in ('rollup', 'raw'):
+        return build_response(400, {'error': "Source must be 'rollup' or 'raw'"})
+
     # Verify URL ownership
     try:
         urls_table = get_urls_table()
@@ -402,29 +1380,182 @@ def get_url_analytics(event):
         if url_item.get('owner_email') != user_email:
             return build_response(403, {'error': 'You do not have permission to view this URL'})
 
-        # Get click analytics
-        clicks_table = get_analytics_table(URL_CLICKS_TABLE_NAME, 'short_code', 'timestamp')
+        # Aggregate clicks from the daily rollups, or from the raw click rows if requested
+        if source == 'raw':
+            analytics = aggregate_raw_clicks(short_code, start_day, end_day)
+        else:
+            analytics = aggregate_click_rollups(short_code, start_day, end_day)
+
+        # URL basic info
+        url_info = {
+            'short_code': short_code,
+            'short_url': f"https://linq.red/{short_code}",
+            'long_url': url_item.get('long_url'),
+            'created_at': url_item.get('creation_date'),
+            'total_clicks': get_usage_counts([url_item])[short_code],
+            'status': url_item.get('status')
+        }
 
-        # Query for click data (last 30 days by default)
-        thirty_days_ago = (datetime.utcnow() - timedelta(days=30)).isoformat()
+        # Return comprehensive analytics
+        return build_response(200, {
+            'url': url_info,
+            'analytics': analytics
+        })
 
-        clicks_response = clicks_table.query(
-            KeyConditionExpression='short_code = :sc AND #ts >= :start_date',
-            ExpressionAttributeNames={'#ts': 'timestamp'},
-            ExpressionAttributeValues={
-                ':sc': short_code,
-                ':start_date': thirty_days_ago
-            }
-        )
+    except Exception as e:
+        log('error', 'Error retrieving URL analytics', error=str(e))
+        return build_response(500, {'error': 'Failed to retrieve analytics'})
+
+def parse_analytics_range(query_params):
+    """
+    Parse the 'start' and 'end' analytics query parameters into an inclusive day range.
+
+    Args:
+        query_params (dict): Query string parameters; dates are YYYY-MM-DD (or ISO timestamps)
+
+    Returns:
+        tuple: (start_day, end_day) as YYYY-MM-DD strings, defaulting to the last 30 days
+
+    Raises:
+        ValueError: If a date is malformed or the range is empty or too long
+    """
+    try:
+        end = datetime.strptime(query_params['end'][:10], '%Y-%m-%d') if query_params.get('end') else datetime.utcnow()
+        if query_params.get('start'):
+            start = datetime.strptime(query_params['start'][:10], '%Y-%m-%d')
+        else:
+            start = end - timedelta(days=ANALYTICS_DEFAULT_RANGE_DAYS)
+    except ValueError:
+        raise ValueError('Dates must use the YYYY-MM-DD format')
+
+    start_day, end_day = start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d')
+    if start_day > end_day:
+        raise ValueError('Start date must not be after end date')
+    if (end.date() - start.date()).days + 1 > ANALYTICS_MAX_RANGE_DAYS:
+        raise ValueError(f'Date range cannot exceed {ANALYTICS_MAX_RANGE_DAYS} days')
+
+    return start_day, end_day
+
+def format_click_analytics(referrer_stats, country_stats, device_stats, daily_clicks, start_day, end_day, source):
+    """
+    Format aggregated click counters as the analytics response body.
+
+    Args:
+        referrer_stats (dict): Referrer -> clicks
+        country_stats (dict): Country -> clicks
+        device_stats (dict): Device type -> clicks
+        daily_clicks (dict): YYYY-MM-DD -> clicks
+        start_day (str): First day of the range
+        end_day (str): Last day of the range
+        source (str): 'rollup' or 'raw'
+
+    Returns:
+        dict: Analytics summary
+    """
+    return {
+        'total_clicks_analyzed': sum(daily_clicks.values()),
+        'referrers': [{'source': k, 'count': v} for k, v in referrer_stats.items()],
+        'countries': [{'country': k, 'count': v} for k, v in country_stats.items()],
+        'devices': [{'type': k, 'count': v} for k, v in device_stats.items()],
+        'daily_clicks': [{'date': k, 'count': v} for k, v in sorted(daily_clicks.items())],
+        'start': start_day,
+        'end': end_day,
+        'source': source,
+        'sampled': False
+    }
+
+def aggregate_click_rollups(short_code, start_day, end_day):
+    """
+    Build click analytics for a day range from the per-day rollup items.
+
+    Reads one small item per day with clicks, regardless of how many clicks there were.
+
+    Args:
+        short_code (str): The short code to report on
+        start_day (str): First day of the range (YYYY-MM-DD)
+        end_day (str): Last day of the range (YYYY-MM-DD)
+
+    Returns:
+        dict: Analytics summary
+    """
+    rollups_table = get_rollups_table()
+    query_params = {
+        'KeyConditionExpression': 'short_code = :sc AND #day BETWEEN :start_day AND :end_day',
+        'ExpressionAttributeNames': {'#day': 'day'},
+        'ExpressionAttributeValues': {
+            ':sc': short_code,
+            ':start_day': start_day,
+            ':end_day': end_day
+        }
+    }
 
-        click_data = clicks_response.get('Items', [])
+    referrer_stats = {}
+    country_stats = {}
+    device_stats = {}
+    daily_clicks = {}
+    prefixes = (
+        (ROLLUP_REFERRER_PREFIX, referrer_stats),
+        (ROLLUP_COUNTRY_PREFIX, country_stats),
+        (ROLLUP_DEVICE_PREFIX, device_stats)
+    )
+
+    while True:
+        response = rollups_table.query(**query_params)
+        for rollup in response.get('Items', []):
+            daily_clicks[rollup['day']] = daily_clicks.get(rollup['day'], 0) + int(rollup.get('clicks', 0))
+            for attribute, count in rollup.items():
+                for prefix, stats in prefixes:
+                    if attribute.startswith(prefix):
+                        value = attribute[len(prefix):]
+                        stats[value] = stats.get(value, 0) + int(count)
+        if 'LastEvaluatedKey' not in response:
+            break
+        query_params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    return format_click_analytics(referrer_stats, country_stats, device_stats, daily_clicks,
+                                  start_day, end_day, 'rollup')
+
+def aggregate_raw_clicks(short_code, start_day, end_day):
+    """
+    Build click analytics for a day range from the raw click rows.
+
+    Rows are read page by page until the range is complete or
+    ANALYTICS_RAW_ROW_BUDGET rows have been read, in which case the result is
+    flagged as sampled. With ANALYTICS_RAW_CONCURRENCY > 1 each day is queried
+    as its own bucket, several at a time.
+
+    Args:
+        short_code (str): The short code to report on
+        start_day (str): First day of the range (YYYY-MM-DD)
+        end_day (str): Last day of the range (YYYY-MM-DD)
+
+    Returns:
+        dict: Analytics summary
+    """
+    # Resolve the table before any worker thread needs it
+    clicks_table = get_analytics_table(URL_CLICKS_TABLE_NAME, 'short_code', 'timestamp')
+    budget = {'remaining': ANALYTICS_RAW_ROW_BUDGET, 'lock': threading.Lock()}
+
+    if ANALYTICS_RAW_CONCURRENCY > 1 and start_day != end_day:
+        first_day = datetime.strptime(start_day, '%Y-%m-%d')
+        days = [
+            (first_day + timedelta(days=i)).strftime('%Y-%m-%d')
+            for i in range((datetime.strptime(end_day, '%Y-%m-%d') - first_day).days + 1)
+        ]
+        from concurrent.futures import ThreadPoolExecutor
+
+        with ThreadPoolExecutor(max_workers=min(ANALYTICS_RAW_CONCURRENCY, len(days))) as executor:
+            results = list(executor.map(lambda day: query_click_rows(clicks_table, short_code, day, day, budget), days))
+    else:
+        results = [query_click_rows(clicks_table, short_code, start_day, end_day, budget)]
 
-        # Prepare analytics summaries
-        referrer_stats = {}
-        country_stats = {}
-        device_stats = {}
-        daily_clicks = {}
+    # Prepare analytics summaries
+    referrer_stats = {}
+    country_stats = {}
+    device_stats = {}
+    daily_clicks = {}
 
+    for click_data, _ in results:
         for click in click_data:
             # Referrer summary
             referrer = click.get('referrer', 'Direct')
@@ -442,31 +1573,60 @@ def get_url_analytics(event):
             date_only = click.get('timestamp', '').split('T')[0]
             daily_clicks[date_only] = daily_clicks.get(date_only, 0) + 1
 
-        # URL basic info
-        url_info = {
-            'short_code': short_code,
-            'short_url': f"https://linq.red/{short_code}",
-            'long_url': url_item.get('long_url'),
-            'created_at': url_item.get('creation_date'),
-            'total_clicks': url_item.get('usage_count', 0),
-            'status': url_item.get('status')
+    analytics = format_click_analytics(referrer_stats, country_stats, device_stats, daily_clicks,
+                                       start_day, end_day, 'raw')
+    analytics['sampled'] = not all(complete for _, complete in results)
+    return analytics
+
+def query_click_rows(clicks_table, short_code, start_day, end_day, budget):
+    """
+    Query the raw click rows of a short code for a day range, following pagination.
+
+    Only the attributes used for aggregation are projected. The query goes
+    through the thread-safe low-level client so several buckets can run at once.
+
+    Args:
+        clicks_table (Table): The click analytics table
+        short_code (str): The short code to query
+        start_day (str): First day of the range (YYYY-MM-DD)
+        end_day (str): Last day of the range (YYYY-MM-DD)
+        budget (dict): Shared row budget with 'remaining' and a 'lock'
+
+    Returns:
+        tuple: (rows, complete) where complete is False if the row budget ran out first
+    """
+    query_params = {
+        'TableName': clicks_table.name,
+        'KeyConditionExpression': 'short_code = :sc AND #ts BETWEEN :start_date AND :end_date',
+        'ProjectionExpression': '#ts, referrer, country, device_type',
+        'ExpressionAttributeNames': {'#ts': 'timestamp'},
+        'ExpressionAttributeValues': {
+            ':sc': short_code,
+            ':start_date': start_day,
+            ':end_date': end_day + 'T99'
         }
+    }
 
-        # Return comprehensive analytics
-        return build_response(200, {
-            'url': url_info,
-            'analytics': {
-                'total_clicks_analyzed': len(click_data),
-                'referrers': [{'source': k, 'count': v} for k, v in referrer_stats.items()],
-                'countries': [{'country': k, 'count': v} for k, v in country_stats.items()],
-                'devices': [{'type': k, 'count': v} for k, v in device_stats.items()],
-                'daily_clicks': [{'date': k, 'count': v} for k, v in daily_clicks.items()]
-            }
-        })
+    rows = []
+    while True:
+        with budget['lock']:
+            limit = min(ANALYTICS_RAW_PAGE_SIZE, budget['remaining'])
+            budget['remaining'] -= limit
+        if limit <= 0:
+            return rows, False
 
-    except Exception as e:
-        print(f"Error retrieving URL analytics: {str(e)}")
-        return build_response(500, {'error': 'Failed to retrieve analytics'})
+        query_params['Limit'] = limit
+        response = clicks_table.meta.client.query(**query_params)
+        items = response.get('Items', [])
+        rows.extend(items)
+
+        # Give back the part of the reservation this page did not use
+        with budget['lock']:
+            budget['remaining'] += limit - len(items)
+
+        if 'LastEvaluatedKey' not in response:
+            return rows, True
+        query_params['ExclusiveStartKey'] = response['LastEvaluatedKey']
 
 def get_user_profile(event):
     """
@@ -485,14 +1645,11 @@ def get_user_profile(event):
     if not auth_header or not auth_header.startswith('Bearer '):
         return build_response(401, {'error': 'Authorization token is required'})
 
-    token = auth_header.split(' ')[1]
-    payload = verify_jwt_token(token)
+    email = verify_bearer_token(auth_header.split(' ')[1])
 
-    if not payload:
+    if not email:
         return build_response(401, {'error': 'Invalid or expired token'})
 
-    email = payload['email']
-
     try:
         # Get user from DynamoDB
         accounts_table = get_accounts_table()
@@ -506,104 +1663,168 @@ def get_user_profile(event):
         # Remove sensitive information
         user.pop('password_hash', None)
         user.pop('salt', None)
+        user.pop('password_algorithm', None)
+        user.pop('password_iterations', None)
 
-        # Add URL count
-        try:
-            urls_table = get_urls_table()
-            url_count_response = urls_table.scan(
-                FilterExpression='owner_email = :email',
-                ExpressionAttributeValues={':email': email},
-                Select='COUNT'
-            )
-            user['url_count'] = url_count_response.get('Count', 0)
-
-            # Get clicks data
-            total_clicks = 0
-            if user['url_count'] > 0:
-                # Scan for all user's URLs to get total clicks
-                urls_response = urls_table.scan(
-                    FilterExpression='owner_email = :email',
-                    ExpressionAttributeValues={':email': email},
-                    ProjectionExpression='usage_count'
-                )
-                for url_item in urls_response.get('Items', []):
-                    total_clicks += url_item.get('usage_count', 0)
-
-            user['total_clicks'] = total_clicks
-        except Exception as e:
-            print(f"Error getting URL stats: {str(e)}")
-            user['url_count'] = 0
-            user['total_clicks'] = 0
+        # URL count and total clicks are counters kept on the account item
+        user['url_count'] = int(user.get('url_count', 0))
+        user['total_clicks'] = int(user.get('total_clicks', 0))
 
-        # Try to get API usage information
+        # Metered API usage in the current quota period of the account's usage plan
         try:
-            # Get API usage from API Gateway if available
-            # In production, you'd use API Gateway API to get actual usage data
-            # This is simplified for demo purposes
-            user['api_usage'] = {
-                'current_usage': user.get('url_count', 0) * 2,  # Rough estimate: 2 API calls per URL
-                'limit': 1000,  # Example limit based on usage plan
-                'reset_date': (datetime.utcnow() + timedelta(days=30)).isoformat()
-            }
-        except Exception as e:
-            print(f"Error getting API usage: {str(e)}")
-            user['api_usage'] = {'current_usage': 0, 'limit': 1000}
+            user['api_usage'] = get_api_usage(user.get('api_key'), user.get('usage_plan_id', DEFAULT_USAGE_PLAN_ID))
+        except ClientError as e:
+            log('error', 'Error getting API usage', error=str(e))
+            user['api_usage'] = {'current_usage': None, 'limit': None}
 
         return build_response(200, {'user': user})
 
     except ClientError as e:
-        print(f"Error getting user profile: {str(e)}")
+        log('error', 'Error getting user profile', error=str(e))
         return build_response(500, {'error': 'Failed to get user profile'})
 
 
-def get_or_create_table(table_name, key_schema, attribute_definitions):
+def get_or_create_table(table_name, key_schema, attribute_definitions, create_if_missing=None,
+                        global_secondary_indexes=None):
     """
-    Get or create a DynamoDB table with the given specifications.
+    Get a DynamoDB table from the container registry, resolving it on first use.
+
+    The first call per container describes the table once and checks that its
+    key schema matches and that the expected indexes exist; later calls return
+    the registered resource without any control-plane request. Missing tables
+    and indexes are only created when explicitly allowed.
 
     Args:
         table_name (str): Name of the table
         key_schema (list): Key schema for the table
         attribute_definitions (list): Attribute definitions for the table
+        create_if_missing (bool, optional): Create the table if it does not exist.
+            Defaults to the TABLE_AUTO_CREATE setting.
+        global_secondary_indexes (list, optional): Global secondary indexes the table should have
 
     Returns:
         Table: The DynamoDB table resource
     """
+    # The flush thread keeps its own registry of tables bound to its own resource
+    thread_resource = getattr(_thread_resources, 'dynamodb', None)
+    registry = _thread_resources.tables if thread_resource else _table_registry
+    table = registry.get(table_name)
+    if table is not None:
+        return table
+    if thread_resource is not None and table_name in _table_registry:
+        # Already validated by the handler thread
+        table = registry[table_name] = thread_resource.Table(table_name)
+        return table
+
+    if create_if_missing is None:
+        create_if_missing = TABLE_AUTO_CREATE
+
     try:
-        table = dynamodb.Table(table_name)
+        table = get_dynamodb().Table(table_name)
         table.load()
+        expected_keys = sorted((k['AttributeName'], k['KeyType']) for k in key_schema)
+        actual_keys = sorted((k['AttributeName'], k['KeyType']) for k in table.key_schema)
+        if expected_keys != actual_keys:
+            raise ValueError(f"Table {table_name} has key schema {actual_keys}, expected {expected_keys}")
+
+        existing_indexes = {index['IndexName'] for index in table.global_secondary_indexes or []}
+        for index in global_secondary_indexes or []:
+            if index['IndexName'] in existing_indexes:
+                continue
+            if create_if_missing:
+                log('warning', 'Creating missing index', table=table_name, index=index['IndexName'])
+                table.update(
+                    AttributeDefinitions=attribute_definitions,
+                    GlobalSecondaryIndexUpdates=[{'Create': index}]
+                )
+            else:
+                log('warning', 'Table is missing index', table=table_name, index=index['IndexName'])
     except ClientError as e:
-        if e.response['Error']['Code'] == 'ResourceNotFoundException':
-            table = dynamodb.create_table(
-                TableName=table_name,
-                KeySchema=key_schema,
-                AttributeDefinitions=attribute_definitions,
-                ProvisionedThroughput={'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
-            )
+        if e.response['Error']['Code'] == 'ResourceNotFoundException' and create_if_missing:
+            log('warning', 'Creating missing table', table=table_name)
+            create_params = {
+                'TableName': table_name,
+                'KeySchema': key_schema,
+                'AttributeDefinitions': attribute_definitions,
+                'ProvisionedThroughput': {'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
+            }
+            if global_secondary_indexes:
+                create_params['GlobalSecondaryIndexes'] = global_secondary_indexes
+            table = get_dynamodb().create_table(**create_params)
             table.wait_until_exists()
         else:
             raise
+
+    registry[table_name] = table
     return table
 
-def get_urls_table():
-    """Get or create the URLs table"""
+def get_urls_table(create_if_missing=None):
+    """Get the URLs table, with its owner_email + creation_date index, from the registry"""
     key_schema = [{'AttributeName': 'short_code', 'KeyType': 'HASH'}]
-    attribute_definitions = [{'AttributeName': 'short_code', 'AttributeType': 'S'}]
-    return get_or_create_table(TABLE_NAME, key_schema, attribute_definitions)
+    attribute_definitions = [
+        {'AttributeName': 'short_code', 'AttributeType': 'S'},
+        {'AttributeName': 'owner_email', 'AttributeType': 'S'},
+        {'AttributeName': 'creation_date', 'AttributeType': 'S'}
+    ]
+    owner_index = {
+        'IndexName': OWNER_INDEX_NAME,
+        'KeySchema': [
+            {'AttributeName': 'owner_email', 'KeyType': 'HASH'},
+            {'AttributeName': 'creation_date', 'KeyType': 'RANGE'}
+        ],
+        # usage_count is left out: every counter flush would otherwise write the index as well
+        'Projection': {'ProjectionType': 'INCLUDE', 'NonKeyAttributes': ['long_url', 'status']},
+        'ProvisionedThroughput': {'ReadCapacityUnits': 5, 'WriteCapacityUnits': 5}
+    }
+    return get_or_create_table(TABLE_NAME, key_schema, attribute_definitions, create_if_missing,
+                               global_secondary_indexes=[owner_index])
 
-def get_accounts_table():
-    """Get or create the accounts table"""
+def get_accounts_table(create_if_missing=None):
+    """Get the accounts table from the registry"""
     key_schema = [{'AttributeName': 'email', 'KeyType': 'HASH'}]
     attribute_definitions = [{'AttributeName': 'email', 'AttributeType': 'S'}]
-    return get_or_create_table(ACCOUNTS_TABLE_NAME, key_schema, attribute_definitions)
-
-def get_analytics_table(table_name, hash_key, range_key=None):
+    return get_or_create_table(ACCOUNTS_TABLE_NAME, key_schema, attribute_definitions, create_if_missing)
+
+def get_api_keys_table(create_if_missing=None):
+    """Get the API key lookup table from the registry"""
+    key_schema = [{'AttributeName': 'api_key_hash', 'KeyType': 'HASH'}]
+    attribute_definitions = [{'AttributeName': 'api_key_hash', 'AttributeType': 'S'}]
+    return get_or_create_table(API_KEYS_TABLE_NAME, key_schema, attribute_definitions, create_if_missing)
+
+def get_api_usage_table(create_if_missing=None):
+    """Get the per API key, per day usage counters table from the registry"""
+    return get_analytics_table(API_USAGE_TABLE_NAME, 'api_key_hash', 'day', create_if_missing)
+
+def get_rate_limits_table(create_if_missing=None):
+    """Get the shared rate limit buckets table from the registry"""
+    key_schema = [{'AttributeName': 'bucket', 'KeyType': 'HASH'}]
+    attribute_definitions = [{'AttributeName': 'bucket', 'AttributeType': 'S'}]
+    return get_or_create_table(RATE_LIMIT_TABLE_NAME, key_schema, attribute_definitions, create_if_missing)
+
+def get_rollups_table(create_if_missing=None):
+    """Get the per-day click rollups table from the registry"""
+    return get_analytics_table(URL_CLICK_ROLLUPS_TABLE_NAME, 'short_code', 'day', create_if_missing)
+
+def get_sequences_table(create_if_missing=None):
+    """Get the sequences table from the registry"""
+    key_schema = [{'AttributeName': 'name', 'KeyType': 'HASH'}]
+    attribute_definitions = [{'AttributeName': 'name', 'AttributeType': 'S'}]
+    return get_or_create_table(SEQUENCES_TABLE_NAME, key_schema, attribute_definitions, create_if_missing)
+
+def get_counters_table(create_if_missing=None):
+    """Get the sharded usage counters table from the registry"""
+    return get_analytics_table(URL_COUNTERS_TABLE_NAME, 'short_code', 'shard', create_if_missing)
+
+def get_analytics_table(table_name, hash_key, range_key=None, create_if_missing=None):
     """
-    Get or create an analytics table with the specified name and key structure.
+    Get an analytics table with the specified name and key structure from the registry.
 
     Args:
         table_name (str): The name of the table
         hash_key (str): The partition key attribute name
         range_key (str, optional): The sort key attribute name
+        create_if_missing (bool, optional): Create the table if it does not exist.
+            Defaults to the TABLE_AUTO_CREATE setting.
 
     Returns:
         Table: The DynamoDB table resource
@@ -623,15 +1844,16 @@ def get_analytics_table(table_name, hash_key, range_key=None):
         key_schema = [{'AttributeName': hash_key, 'KeyType': 'HASH'}]
         attribute_definitions = [{'AttributeName': hash_key, 'AttributeType': 'S'}]
 
-    return get_or_create_table(table_name, key_schema, attribute_definitions)
+    return get_or_create_table(table_name, key_schema, attribute_definitions, create_if_missing)
 
-def hash_password(password, salt=None):
+def hash_password(password, salt=None, iterations=None):
     """
     Hash a password using PBKDF2 with SHA-256.
 
     Args:
         password (str): The password to hash
         salt (bytes, optional): Salt for hashing. If None, a new random salt is generated.
+        iterations (int, optional): PBKDF2 iterations. Defaults to PASSWORD_HASH_ITERATIONS.
 
     Returns:
         tuple: (hashed_password, salt)
@@ -639,17 +1861,16 @@ def hash_password(password, salt=None):
     if salt is None:
         salt = os.urandom(32)  # 32 bytes of random salt
 
-    # Use PBKDF2 with 100,000 iterations of SHA-256
     key = hashlib.pbkdf2_hmac(
         'sha256',
         password.encode('utf-8'),
         salt,
-        100000
+        iterations or PASSWORD_HASH_ITERATIONS
     )
 
     return key, salt
 
-def verify_password(stored_password, stored_salt, provided_password):
+def verify_password(stored_password, stored_salt, provided_password, iterations=PASSWORD_HASH_LEGACY_ITERATIONS):
     """
     Verify a password against its hash.
 
@@ -657,13 +1878,85 @@ def verify_password(stored_password, stored_salt, provided_password):
         stored_password (bytes): The stored password hash
         stored_salt (bytes): The salt used to hash the stored password
         provided_password (str): The password to verify
+        iterations (int): PBKDF2 iterations the stored hash was created with
 
     Returns:
         bool: True if the password matches, False otherwise
     """
-    key, _ = hash_password(provided_password, stored_salt)
+    key, _ = hash_password(provided_password, stored_salt, iterations)
     return hmac.compare_digest(key, stored_password)
 
+def build_password_attributes(password):
+    """
+    Hash a password with the current parameters and return the account attributes to store.
+
+    Args:
+        password (str): The password to hash
+
+    Returns:
+        dict: password_hash, salt, password_algorithm and password_iterations
+    """
+    password_hash, salt = hash_password(password, iterations=PASSWORD_HASH_ITERATIONS)
+    return {
+        'password_hash': base64.b64encode(password_hash).decode('utf-8'),
+        'salt': base64.b64encode(salt).decode('utf-8'),
+        'password_algorithm': PASSWORD_HASH_ALGORITHM,
+        'password_iterations': PASSWORD_HASH_ITERATIONS
+    }
+
+def get_password_parameters(user):
+    """
+    Get the hashing parameters of an account, treating accounts without them as legacy hashes.
+
+    Args:
+        user (dict): Account item
+
+    Returns:
+        tuple: (algorithm, iterations)
+    """
+    algorithm = user.get('password_algorithm', PASSWORD_HASH_ALGORITHM)
+    iterations = int(user.get('password_iterations', PASSWORD_HASH_LEGACY_ITERATIONS))
+    return algorithm, iterations
+
+def calibrate_password_hash(target_ms=None):
+    """
+    Recommend PASSWORD_HASH_ITERATIONS for a target hashing latency on this Lambda size.
+
+    Run it as a maintenance task on the function configuration that serves
+    logins, then set PASSWORD_HASH_ITERATIONS to the result. Accounts pick up
+    the new cost on their next login.
+
+    Args:
+        target_ms (float, optional): Target milliseconds per hash. Defaults to PASSWORD_HASH_TARGET_MS.
+
+    Returns:
+        dict: Recommended iterations with the measurements behind them
+    """
+    target_ms = float(target_ms or PASSWORD_HASH_TARGET_MS)
+    sample_iterations = 20000
+    password, salt = 'calibration-password', os.urandom(32)
+
+    # Best of a few runs, so a noisy neighbour does not inflate the estimate
+    timings = []
+    for _ in range(5):
+        started_at = time.perf_counter()
+        hash_password(password, salt, sample_iterations)
+        timings.append(time.perf_counter() - started_at)
+    seconds_per_iteration = min(timings) / sample_iterations
+
+    iterations = int(target_ms / 1000 / seconds_per_iteration) // 10000 * 10000
+    iterations = max(iterations, PASSWORD_HASH_MIN_ITERATIONS)
+
+    return {
+        'algorithm': PASSWORD_HASH_ALGORITHM,
+        'recommended_iterations': iterations,
+        'expected_ms': round(iterations * seconds_per_iteration * 1000, 1),
+        'current_iterations': PASSWORD_HASH_ITERATIONS,
+        'current_ms': round(PASSWORD_HASH_ITERATIONS * seconds_per_iteration * 1000, 1),
+        'target_ms': target_ms,
+        'memory_mb': os.environ.get('AWS_LAMBDA_FUNCTION_MEMORY_SIZE')
+    }
+
 def generate_jwt_token(email):
     """
     Generate a JWT token for the given email.
@@ -678,6 +1971,8 @@ def generate_jwt_token(email):
         'email': email,
         'exp': datetime.utcnow() + timedelta(hours=JWT_EXPIRY)
     }
+    import jwt  # Imported on first use to keep it out of the redirect cold start
+
     token = jwt.encode(payload, JWT_SECRET, algorithm='HS256')
     return token
 
@@ -691,11 +1986,13 @@ def verify_jwt_token(token):
     Returns:
         dict or None: Payload if token is valid, None otherwise
     """
+    import jwt  # Imported on first use to keep it out of the redirect cold start
+
     try:
         payload = jwt.decode(token, JWT_SECRET, algorithms=['HS256'])
         return payload
     except jwt.PyJWTError as e:
-        print(f"JWT verification error: {e}")
+        log('info', 'JWT verification error', error=str(e))
         return None
 
 def lambda_handler(event, context):
@@ -709,137 +2006,436 @@ def lambda_handler(event, context):
     Returns:
         dict: Response with status code and body
     """
-    # Log the entire incoming event for debugging
-    print("Received event:", json.dumps(event, indent=2))
+    global _current_route, _log_sampled, _request_id
+
+    _request_id = getattr(context, 'aws_request_id', None)
+    _aws_call_trace.clear()
+
+    # Scheduled or manually invoked maintenance tasks carry a 'task' instead of an HTTP request
+    if 'task' in event and 'httpMethod' not in event:
+        _current_route, _log_sampled = 'task', True
+        return run_maintenance_task(event)
 
     http_method = event.get('httpMethod')
-    query_params = event.get('queryStringParameters') or {}
-    action = query_params.get('action')
     path = event.get('path', '')
+    _current_route = get_route_name(http_method, path)
+    sample_rate = LOG_SAMPLE_RATES.get(_current_route, LOG_SAMPLE_RATES.get('default', 1.0))
+    _log_sampled = sample_rate >= 1 or random.random() < sample_rate
+
+    # Shed excess load before authentication or any other table work
+    retry_after = check_rate_limit(event, _current_route)
+    if retry_after is not None:
+        log('info', 'Rate limited', retry_after=retry_after)
+        log_metric('RateLimited', 1)
+        flush_metrics()
+        return build_response(429, {'error': 'Too many requests'}, {'Retry-After': str(retry_after)})
 
-    print(f"Processing request: method={http_method}, path={path}, action={action}")
-
-    # Handle CORS preflight requests
-    if http_method == 'OPTIONS':
-        return build_response(200)
+    try:
+        response = route_request(event, context)
+        if SERVER_TIMING and AWS_CALL_TRACING and isinstance(response, dict):
+            headers = response.setdefault('headers', {})
+            headers['Server-Timing'] = build_server_timing(summarize_aws_calls())
+            headers['Timing-Allow-Origin'] = '*'
+        return response
+    finally:
+        # Buffers are written in the background once their size or age threshold is reached; only a
+        # shutdown drains them
+        flush_ingestion_buffers()
+        if _current_route == 'redirect':
+            emit_redirect_cache_stats()
+        flush_metrics()
+        if _aws_call_trace:
+            # Includes a metric flush above, which the Server-Timing header cannot; background
+            # buffer flushes log their own calls
+            log('info', 'AWS calls', calls=len(_aws_call_trace), operations=summarize_aws_calls())
+
+def check_rate_limit(event, route):
+    """
+    Take a token from the caller's bucket for a route.
 
-    # Handle base path - serve HTML with React app iframe
-    if http_method == "GET" and path == "/":
-        react_app_version = get_react_app_version()
-        react_app_last_modified = get_react_app_last_modified()
-        lambda_version = context.function_version
-
-        return {
-            "statusCode": 200,
-            "headers": {"Content-Type": "text/html", **DEFAULT_HEADERS},
-            "body": f"""
-                <html>
-                <head>
-                    <title>linq.red</title>
-                    <style>
-                        body, html {{
-                            margin: 0;
-                            padding: 0;
-                            height: 100%;
-                            font-family: Arial, sans-serif;
-                        }}
-                        iframe {{
-                            border: none;
-                            width: 100vw;
-                            height: calc(100vh - 40px);
-                        }}
-                        footer {{
-                            height: 40px;
-                            background-color: #333;
-                            color: #f1f1f1;
-                            display: flex;
-                            justify-content: space-between;
-                            align-items: center;
-                            padding: 0 20px;
-                            font-size: 0.8em;
-                        }}
-                    </style>
-                </head>
-                <body>
-                    <iframe src="https://{S3_BUCKET_NAME}.s3.amazonaws.com/{REACT_APP_INDEX_KEY}"></iframe>
-                    <footer>
-                        <span>React App Version: {react_app_last_modified}</span>
-                        <span>Lambda Version: {lambda_version}</span>
-                    </footer>
-                </body>
-                </html>
-            """
-        }
+    Callers are identified by API key once the key's identity is in the auth
+    cache, and get its usage plan's limits. Requests with any other key, or
+    none, are identified by source IP, so made-up keys cannot open new buckets.
 
-    # User authentication and management endpoints
-    elif http_method == 'POST' and path == '/auth/register':
-        return register_user(event)
-    elif http_method == 'POST' and path == '/auth/login':
-        return login_user(event)
-    elif http_method == 'POST' and path == '/auth/forgot-password':
-        return forgot_password(event)
-    elif http_method == 'GET' and path == '/auth/profile':
-        return get_user_profile(event)
+    Args:
+        event (dict): API Gateway event object
+        route (str): Route name from get_route_name
 
-    # URL shortening endpoints
-    elif http_method == 'POST' and path == '/urls':
-        return shorten_url(event)
-    elif http_method == 'GET' and path == '/urls':
-        # Get user's URLs with basic stats
-        return get_user_urls(event)
-    elif http_method == 'GET' and path == '/urls/analytics':
-        # Get detailed analytics for a specific URL
-        return get_url_analytics(event)
+    Returns:
+        int or None: Seconds to wait before retrying, or None if the request may proceed
+    """
+    if route == 'options':
+        return None
 
-    # API endpoints that are not for redirection should be checked first
-    elif http_method == 'POST' and action == 'register':
-        return build_response(301, {'message': 'Please use /auth/register endpoint'}, {'Location': '/auth/register'})
+    api_key = get_header(event, 'x-api-key')
+    # Same digest-based key as the auth cache; only a cached identity is used, never a table read
+    cache_key = 'key:' + hash_api_key(api_key) if api_key else None
+    identity = get_cached_identity(cache_key) if cache_key else None
+    if identity:
+        client, usage_plan_id = cache_key, identity.get('usage_plan_id')
+    else:
+        request_context = event.get('requestContext') or {}
+        source_ip = (request_context.get('identity') or {}).get('sourceIp') or (request_context.get('http') or {}).get('sourceIp')
+        if not source_ip:
+            return None
+        client, usage_plan_id = 'ip:' + source_ip, None
+
+    selector = next(
+        (candidate for candidate in (f'{usage_plan_id}:{route}', f'{usage_plan_id}:*', route, 'default')
+         if candidate in RATE_LIMITS),
+        None
+    )
+    if selector is None:
+        return None
+    rate, burst = RATE_LIMITS[selector]
+    bucket = f'{client}|{selector}'
 
-    # Check if this is a short URL redirect request
-    # This should be the last check before returning method not allowed
-    elif http_method == 'GET':
-        # First, check if this is a known API path that should NOT be treated as a short code
-        known_api_paths = ['/auth/', '/urls', '/api/']
-        is_api_path = path == '/' or any(path.startswith(prefix) for prefix in known_api_paths)
+    wait = take_local_token(bucket, rate, burst)
+    if wait == 0 and RATE_LIMIT_TABLE_NAME:
+        wait = take_shared_token(bucket, rate, burst)
+    return math.ceil(wait) if wait > 0 else None
 
-        # Special case: direct path access (likely a short URL)
-        if not is_api_path:
-            print(f"Handling potential URL redirection for path: {path}")
+def take_local_token(bucket, rate, burst):
+    """
+    Take a token from a container-local bucket.
 
-            # Just pass the event directly to retrieve_url
-            # The function will extract the short code in multiple ways
-            return retrieve_url(event)
+    Args:
+        bucket (str): Bucket name
+        rate (float): Tokens added per second
+        burst (float): Bucket capacity
 
-    # Fallback for unsupported methods/paths
-    print(f"No matching handler for method={http_method}, path={path}")
-    return build_response(405, {'error': 'Method not allowed'})
+    Returns:
+        float: 0 if a token was taken, otherwise seconds until one is available
+    """
+    now = time.monotonic()
+    tokens, updated_at = _rate_buckets.get(bucket, (burst, now))
+    tokens = min(burst, tokens + (now - updated_at) * rate)
 
+    wait = 0
+    if tokens >= 1:
+        tokens -= 1
+    else:
+        wait = (1 - tokens) / rate
 
-# Function to generate a random short code
-def generate_short_code(length=6):
-    characters = string.ascii_letters + string.digits
-    return ''.join(random.choice(characters) for _ in range(length))
+    _rate_buckets[bucket] = (tokens, now)
+    _rate_buckets.move_to_end(bucket)
+    while len(_rate_buckets) > RATE_LIMIT_MAX_BUCKETS:
+        # Unspent leased tokens of an evicted bucket are dropped with it
+        evicted, _ = _rate_buckets.popitem(last=False)
+        _rate_leases.pop(evicted, None)
+    return wait
 
-# Function to generate a secure random password
-def generate_secure_password(length=12):
+def take_shared_token(bucket, rate, burst):
     """
-    Generate a secure random password with at least one uppercase letter,
-    one lowercase letter, one digit, and one special character.
+    Take a token from the bucket shared by all containers in RATE_LIMIT_TABLE.
+
+    Tokens are leased in batches of RATE_LIMIT_LEASE_FRACTION of the burst so
+    most requests are served from the lease without touching DynamoDB. The
+    shared bucket fails open: if DynamoDB cannot be reached the request is let
+    through and only the local bucket applies.
 
     Args:
-        length (int): The length of the password (minimum 8)
+        bucket (str): Bucket name
+        rate (float): Tokens added per second
+        burst (float): Bucket capacity
 
     Returns:
-        str: A secure random password
+        float: 0 if a token was taken, otherwise seconds until one is available
     """
-    if length < 8:
-        length = 8  # Minimum secure length
+    if _rate_leases.get(bucket, 0) > 0:
+        _rate_leases[bucket] -= 1
+        return 0
 
-    # Character sets
-    uppercase = string.ascii_uppercase
-    lowercase = string.ascii_lowercase
-    digits = string.digits
-    special = '!@#$%^&*()-_=+[]{}|;:,.<>?'
+    lease = max(1, int(burst * RATE_LIMIT_LEASE_FRACTION))
+    try:
+        table = get_rate_limits_table()
+        for _ in range(3):
+            now = time.time()
+            item = table.get_item(Key={'bucket': bucket}, ConsistentRead=True).get('Item')
+            if item is None:
+                tokens = burst
+            else:
+                tokens = min(burst, float(item['tokens']) + (now - float(item['updated_at'])) * rate)
+            granted = min(lease, int(tokens))
+            if granted == 0:
+                return (1 - tokens) / rate
+
+            try:
+                # Optimistic concurrency: only write if no other container updated the bucket since the read
+                table.put_item(
+                    Item={
+                        'bucket': bucket,
+                        'tokens': Decimal(str(round(tokens - granted, 3))),
+                        'updated_at': Decimal(str(round(now, 3))),
+                        'expires_at': int(now + burst / rate) + 60
+                    },
+                    ConditionExpression='attribute_not_exists(#bucket) OR updated_at = :updated_at',
+                    ExpressionAttributeNames={'#bucket': 'bucket'},
+                    ExpressionAttributeValues={':updated_at': item['updated_at'] if item else Decimal(0)}
+                )
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+                continue
+
+            _rate_leases[bucket] = granted - 1
+            return 0
+        log('warning', 'Shared rate limit bucket contended', bucket=bucket)
+    except (ClientError, BotoCoreError) as e:
+        log('error', 'Shared rate limit check failed', error=str(e))
+    return 0
+
+def run_maintenance_task(event):
+    """
+    Run a maintenance task from a direct invocation or an EventBridge schedule.
+
+    Args:
+        event (dict): Event with a 'task' name and optional task parameters
+
+    Returns:
+        dict: Task name and its result
+    """
+    task = event.get('task')
+    log('info', 'Running maintenance task', task=task)
+
+    if task == 'provision_tables':
+        result = provision_tables()
+    elif task == 'backfill_api_key_index':
+        result = backfill_api_key_index()
+    elif task == 'rebuild_click_rollups':
+        result = rebuild_click_rollups(event.get('short_code'))
+    elif task == 'reconcile_account_counters':
+        result = reconcile_account_counters(event.get('email'))
+    elif task == 'rebuild_short_code_filter':
+        result = rebuild_short_code_filter()
+    elif task == 'export_hot_set':
+        result = export_hot_set(event.get('size'))
+    elif task == 'calibrate_password_hash':
+        result = calibrate_password_hash(event.get('target_ms'))
+    else:
+        return {'task': task, 'error': 'Unknown task'}
+
+    return {'task': task, 'result': result}
+
+def get_route_name(http_method, path):
+    """
+    Get the route name used as the metrics dimension for a request.
+
+    Args:
+        http_method (str): The HTTP method of the request
+        path (str): The request path
+
+    Returns:
+        str: Route name such as 'redirect', 'shorten' or 'login'
+    """
+    if http_method == 'OPTIONS':
+        return 'options'
+    if (http_method, path) in API_ROUTES:
+        return API_ROUTES[(http_method, path)]
+    if is_redirect_path(http_method, path):
+        return 'redirect'
+    return 'other'
+
+def is_redirect_path(http_method, path):
+    """
+    Check whether a request should be treated as a short URL redirect.
+
+    Args:
+        http_method (str): The HTTP method of the request
+        path (str): The request path
+
+    Returns:
+        bool: True if the path is not a known API path and should be resolved as a short code
+    """
+    if http_method != 'GET':
+        return False
+    known_api_paths = ['/auth/', '/urls', '/api/']
+    return not (path == '/' or any(path.startswith(prefix) for prefix in known_api_paths))
+
+def route_request(event, context):
+    """
+    Dispatch an API Gateway event to the matching endpoint handler.
+
+    Args:
+        event (dict): Lambda event object
+        context (LambdaContext): Lambda context object
+
+    Returns:
+        dict: Response with status code and body
+    """
+    # The full event is only serialized when debug logging is enabled
+    log('debug', 'Received event', event=event)
+
+    http_method = event.get('httpMethod')
+    query_params = event.get('queryStringParameters') or {}
+    action = query_params.get('action')
+    path = event.get('path', '')
+
+    log('info', 'Processing request', method=http_method, path=path, action=action)
+
+    # Handle CORS preflight requests
+    if http_method == 'OPTIONS':
+        return build_response(200)
+
+    # Handle base path - serve HTML with React app iframe
+    if http_method == "GET" and path == "/":
+        return serve_root_page(event, context)
+
+    # User authentication and management endpoints
+    elif http_method == 'POST' and path == '/auth/register':
+        return register_user(event)
+    elif http_method == 'POST' and path == '/auth/login':
+        return login_user(event)
+    elif http_method == 'POST' and path == '/auth/forgot-password':
+        return forgot_password(event)
+    elif http_method == 'GET' and path == '/auth/profile':
+        return get_user_profile(event)
+
+    # URL shortening endpoints
+    elif http_method == 'POST' and path == '/urls':
+        return shorten_url(event)
+    elif http_method == 'POST' and path == '/urls/batch':
+        # Shorten many URLs with one authenticated request
+        return shorten_urls_batch(event)
+    elif http_method == 'GET' and path == '/urls':
+        # Get user's URLs with basic stats
+        return with_validators(event, get_user_urls(event), LIST_URLS_CACHE_MAX_AGE)
+    elif http_method == 'GET' and path == '/urls/analytics':
+        # Get detailed analytics for a specific URL
+        return with_validators(event, get_url_analytics(event), ANALYTICS_CACHE_MAX_AGE)
+
+    # API endpoints that are not for redirection should be checked first
+    elif http_method == 'POST' and action == 'register':
+        return build_response(301, {'message': 'Please use /auth/register endpoint'}, {'Location': '/auth/register'})
+
+    # Check if this is a short URL redirect request
+    # This should be the last check before returning method not allowed
+    elif is_redirect_path(http_method, path):
+        log('debug', 'Handling potential URL redirection', path=path)
+
+        # Just pass the event directly to retrieve_url
+        # The function will extract the short code in multiple ways
+        return retrieve_url(event)
+
+    # Fallback for unsupported methods/paths
+    log('info', 'No matching handler', method=http_method, path=path)
+    return build_response(405, {'error': 'Method not allowed'})
+
+
+# Function to generate a random short code
+def generate_short_code(length=6):
+    characters = string.ascii_letters + string.digits
+    return ''.join(random.choice(characters) for _ in range(length))
+
+def allocate_short_code():
+    """
+    Allocate a new short code from this container's leased block of IDs.
+
+    IDs are unique across containers, and the keyed permutation turns each one
+    into a distinct, non-sequential code, so generated codes never collide with
+    each other. If no block can be leased, a random code is returned instead.
+
+    Returns:
+        str: A short code of SHORT_CODE_LENGTH base62 characters
+    """
+    if _short_code_block['next_id'] >= _short_code_block['end_id']:
+        try:
+            lease_short_code_block()
+        except (ClientError, BotoCoreError, RuntimeError) as e:
+            log('error', 'Error leasing short code block, using a random code', error=str(e))
+            return generate_short_code(SHORT_CODE_LENGTH)
+
+    short_code_id = _short_code_block['next_id']
+    _short_code_block['next_id'] += 1
+    return encode_short_code(permute_short_code_id(short_code_id))
+
+def lease_short_code_block():
+    """
+    Lease the next block of SHORT_CODE_BLOCK_SIZE sequential IDs with one atomic counter update.
+
+    Raises:
+        RuntimeError: If the short code space is exhausted
+    """
+    response = get_sequences_table().update_item(
+        Key={'name': 'short_code'},
+        UpdateExpression='ADD next_id :block',
+        ExpressionAttributeValues={':block': SHORT_CODE_BLOCK_SIZE},
+        ReturnValues='UPDATED_NEW'
+    )
+    end_id = int(response['Attributes']['next_id'])
+    if end_id > SHORT_CODE_SPACE:
+        raise RuntimeError('Short code space exhausted, increase SHORT_CODE_LENGTH')
+
+    _short_code_block['next_id'] = end_id - SHORT_CODE_BLOCK_SIZE
+    _short_code_block['end_id'] = end_id
+    log('info', 'Leased short code IDs', first_id=_short_code_block['next_id'], last_id=end_id - 1)
+
+def permute_short_code_id(short_code_id):
+    """
+    Map an ID to another ID in [0, SHORT_CODE_SPACE) with a keyed permutation.
+
+    A balanced Feistel network over the smallest even bit width covering the
+    code space, with cycle-walking to stay inside it, gives a bijection.
+
+    Args:
+        short_code_id (int): Sequential ID in [0, SHORT_CODE_SPACE)
+
+    Returns:
+        int: Permuted ID in [0, SHORT_CODE_SPACE)
+    """
+    half_bits = ((SHORT_CODE_SPACE - 1).bit_length() + 1) // 2
+    mask = (1 << half_bits) - 1
+    value = short_code_id
+
+    while True:
+        left, right = value >> half_bits, value & mask
+        for round_number in range(4):
+            digest = hmac.new(
+                SHORT_CODE_PERMUTATION_KEY,
+                bytes([round_number]) + right.to_bytes(8, 'big'),
+                hashlib.sha256
+            ).digest()
+            left, right = right, left ^ (int.from_bytes(digest[:8], 'big') & mask)
+        value = (left << half_bits) | right
+        if value < SHORT_CODE_SPACE:
+            return value
+
+def encode_short_code(value):
+    """
+    Encode an integer as a fixed-length base62 short code.
+
+    Args:
+        value (int): Value in [0, SHORT_CODE_SPACE)
+
+    Returns:
+        str: The short code
+    """
+    characters = []
+    for _ in range(SHORT_CODE_LENGTH):
+        value, remainder = divmod(value, len(SHORT_CODE_ALPHABET))
+        characters.append(SHORT_CODE_ALPHABET[remainder])
+    return ''.join(reversed(characters))
+
+# Function to generate a secure random password
+def generate_secure_password(length=12):
+    """
+    Generate a secure random password with at least one uppercase letter,
+    one lowercase letter, one digit, and one special character.
+
+    Args:
+        length (int): The length of the password (minimum 8)
+
+    Returns:
+        str: A secure random password
+    """
+    if length < 8:
+        length = 8  # Minimum secure length
+
+    # Character sets
+    uppercase = string.ascii_uppercase
+    lowercase = string.ascii_lowercase
+    digits = string.digits
+    special = '!@#$%^&*()-_=+[]{}|;:,.<>?'
 
     # Ensure at least one of each character type
     password = [
@@ -868,161 +2464,529 @@ def authenticate_request(event):
     Returns:
         tuple: (is_authenticated, user_email)
     """
-    headers = event.get('headers', {})
+    identity = get_authenticated_identity(event)
+    if identity:
+        return True, identity['email']
+
+    # No valid authentication found
+    return False, None
+
+def get_authenticated_identity(event):
+    """
+    Resolve the identity behind a request's bearer token or API key.
+
+    Resolved identities are cached per container, so repeated calls with the
+    same credentials skip JWT decoding and the API key lookup.
+
+    Args:
+        event (dict): Lambda event object
+
+    Returns:
+        dict or None: Identity with 'email' (and 'api_key' for API key callers), None if unauthenticated
+    """
+    headers = event.get('headers', {}) or {}
 
     # Method 1: Try JWT token authentication
     auth_header = headers.get('Authorization')
     if auth_header and auth_header.startswith('Bearer '):
-        token = auth_header.split(' ')[1]
-        payload = verify_jwt_token(token)
-        if payload:
-            return True, payload['email']
+        email = verify_bearer_token(auth_header.split(' ')[1])
+        if email:
+            return {'email': email}
 
     # Method 2: Try API key authentication
     api_key = headers.get('x-api-key')
     if api_key:
-        # Find the user associated with this API key
-        accounts_table = get_accounts_table()
+        cache_key = 'key:' + hash_api_key(api_key)
+        identity = get_cached_identity(cache_key)
+        if identity:
+            record_api_usage(api_key)
+            return identity
+        if cache_key in _auth_cache:
+            # Looked up moments ago and not found (get_cached_identity drops expired entries)
+            return None
         try:
-            # Scan for users with this API key (inefficient but works for small tables)
-            response = accounts_table.scan(
-                FilterExpression='api_key = :api_key',
-                ExpressionAttributeValues={':api_key': api_key}
-            )
-            items = response.get('Items', [])
-            if items:
-                # Found a user with this API key
-                return True, items[0]['email']
+            # Find the user associated with this API key
+            entry = get_api_key_entry(api_key)
+            if entry:
+                # The usage plan lets the rate limiter apply plan limits to later requests with this key
+                identity = {'email': entry['email'], 'api_key': api_key, 'usage_plan_id': entry.get('usage_plan_id')}
+                cache_identity(cache_key, identity, time.time() + AUTH_CACHE_API_KEY_TTL)
+                record_api_usage(api_key)
+                return identity
+            # Unknown keys cost two reads and possibly a scan; don't repeat them for every request
+            cache_identity(cache_key, None, time.time() + AUTH_CACHE_NEGATIVE_TTL)
         except Exception as e:
-            print(f"Error checking API key: {str(e)}")
+            log('error', 'Error checking API key', error=str(e))
 
-    # No valid authentication found
-    return False, None
+    return None
 
-def get_user_by_email(email):
+def verify_bearer_token(token):
     """
-    Get a user by email.
+    Verify a JWT bearer token, reusing the cached result until the token expires.
 
     Args:
-        email (str): User email
+        token (str): JWT token from the Authorization header
 
     Returns:
-        dict or None: User data if found, None otherwise
+        str or None: The token's email if it is valid, None otherwise
     """
-    accounts_table = get_accounts_table()
-    response = accounts_table.get_item(Key={'email': email})
-    return response.get('Item')
+    cache_key = 'jwt:' + hashlib.sha256(token.encode('utf-8')).hexdigest()
+    identity = get_cached_identity(cache_key)
+    if identity:
+        return identity['email']
 
-def send_password_email(email, password):
+    payload = verify_jwt_token(token)
+    if not payload:
+        return None
+
+    expires_at = payload.get('exp', time.time() + AUTH_CACHE_API_KEY_TTL)
+    cache_identity(cache_key, {'email': payload['email']}, expires_at)
+    return payload['email']
+
+def get_cached_identity(cache_key):
     """
-    Send an email with the user's password.
+    Get a cached identity if it has not expired.
 
     Args:
-        email (str): Recipient's email address
-        password (str): User's password
+        cache_key (str): Digest-based key of the credentials
 
     Returns:
-        bool: True if the email was sent successfully, False otherwise
+        dict or None: The cached identity
     """
-    try:
-        # Create the email message
-        msg = MIMEMultipart()
-        msg['Subject'] = 'Your Password for Linq.red'
-        msg['From'] = SERVICE_EMAIL
-        msg['To'] = email
+    entry = _auth_cache.get(cache_key)
+    if entry is None:
+        return None
 
-        # Create the HTML body
-        html_body = f"""
-        <html>
-        <head>
-            <style>
-                body {{ font-family: Arial, sans-serif; margin: 0; padding: 20px; color: #333; }}
-                .container {{ max-width: 600px; margin: 0 auto; }}
-                .header {{ background-color: #f44336; color: white; padding: 10px; text-align: center; }}
-                .content {{ padding: 20px; }}
-                .footer {{ font-size: 12px; color: #999; text-align: center; margin-top: 20px; }}
-                .password {{ background: #f5f5f5; padding: 10px; font-family: monospace; margin: 10px 0; }}
-            </style>
-        </head>
-        <body>
-            <div class="container">
-                <div class="header">
-                    <h1>Your Linq.red Password</h1>
-                </div>
-                <div class="content">
-                    <p>Hello,</p>
-                    <p>You requested your password for your Linq.red account. Here it is:</p>
-                    <div class="password">{password}</div>
-                    <p>For security reasons, we recommend changing your password after logging in.</p>
-                    <p>If you did not request this password, please ignore this email.</p>
-                    <p>Thank you,<br>The Linq.red Team</p>
-                </div>
-                <div class="footer">
-                    <p>This is an automated message, please do not reply to this email.</p>
-                </div>
-            </div>
-        </body>
-        </html>
-        """
+    expires_at, identity = entry
+    if expires_at <= time.time():
+        del _auth_cache[cache_key]
+        return None
 
-        # Attach the HTML content
-        msg.attach(MIMEText(html_body, 'html'))
+    _auth_cache.move_to_end(cache_key)
+    return identity
 
-        # Create a simple text version as fallback
-        text_body = f"""
-        Your Linq.red Password
+def cache_identity(cache_key, identity, expires_at):
+    """
+    Cache a resolved identity, evicting the least recently used entries.
 
-        Hello,
+    Args:
+        cache_key (str): Digest-based key of the credentials
+        identity (dict): The resolved identity, or None for credentials that were not found
+        expires_at (float): Epoch seconds after which the identity must be resolved again
+    """
+    if AUTH_CACHE_MAX_ENTRIES <= 0:
+        return
 
-        You requested your password for your Linq.red account. Here it is:
+    _auth_cache[cache_key] = (expires_at, identity)
+    _auth_cache.move_to_end(cache_key)
+    while len(_auth_cache) > AUTH_CACHE_MAX_ENTRIES:
+        _auth_cache.popitem(last=False)
 
-        {password}
+def invalidate_auth_cache(email=None, api_key=None):
+    """
+    Drop cached identities after a password reset or API key rotation.
 
-        For security reasons, we recommend changing your password after logging in.
+    Args:
+        email (str, optional): Drop every cached identity of this account
+        api_key (str, optional): Drop the cached identity of this API key
+    """
+    if api_key:
+        _auth_cache.pop('key:' + hash_api_key(api_key), None)
+    if email:
+        for cache_key, (_, identity) in list(_auth_cache.items()):
+            if identity and identity['email'] == email:
+                del _auth_cache[cache_key]
 
-        If you did not request this password, please ignore this email.
+def hash_api_key(api_key):
+    """
+    Get the lookup digest of an API key, so the key itself is never used as a table key.
 
-        Thank you,
-        The Linq.red Team
+    Args:
+        api_key (str): The API key value
 
-        This is an automated message, please do not reply to this email.
-        """
-        msg.attach(MIMEText(text_body, 'plain'))
+    Returns:
+        str: Hex SHA-256 digest of the API key
+    """
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()
 
-        # Send the email
-        response = ses.send_raw_email(
-            Source=SERVICE_EMAIL,
-            Destinations=[email],
-            RawMessage={'Data': msg.as_string()}
-        )
+def build_api_key_entry(api_key, email, api_key_id=None, usage_plan_id=None):
+    """
+    Build the linqs_api_keys item that maps an API key digest to its account.
 
-        print(f"Email sent to {email}, message ID: {response.get('MessageId')}")
-        return True
+    Args:
+        api_key (str): The API key value
+        email (str): Email of the account owning the key
+        api_key_id (str, optional): API Gateway ID of the key
+        usage_plan_id (str, optional): Usage plan the key was added to
 
-    except ClientError as e:
-        print(f"Error sending email: {str(e)}")
-        return False
+    Returns:
+        dict: Item for the API keys table
+    """
+    entry = {
+        'api_key_hash': hash_api_key(api_key),
+        'email': email,
+        'created_at': datetime.utcnow().isoformat()
+    }
+    if api_key_id:
+        entry['api_key_id'] = api_key_id
+    if usage_plan_id:
+        entry['usage_plan_id'] = usage_plan_id
+    return entry
 
-def shorten_url(event):
+def get_api_key_entry(api_key):
     """
-    Create a shortened URL. Requires authentication.
+    Find the linqs_api_keys entry of an API key with a direct lookup on its digest.
 
     Args:
-        event (dict): Lambda event object
+        api_key (str): The API key from the request
 
     Returns:
-        dict: Response with status code and body
+        dict or None: The entry with the owner's email (and usage_plan_id when known), None if the key is unknown
     """
-    # Authenticate the request
-    is_authenticated, user_email = authenticate_request(event)
+    api_keys_table = get_api_keys_table()
+    key = {'api_key_hash': hash_api_key(api_key)}
 
-    if not is_authenticated:
+    response = api_keys_table.get_item(Key=key)
+    if 'Item' not in response:
+        # A key registered moments ago may not be visible to an eventually consistent read yet
+        response = api_keys_table.get_item(Key=key, ConsistentRead=True)
+    if 'Item' in response:
+        return response['Item']
+
+    if not API_KEY_SCAN_FALLBACK:
+        return None
+
+    # Accounts created before linqs_api_keys existed: scan once, then index the key
+    response = get_accounts_table().scan(
+        FilterExpression='api_key = :api_key',
+        ExpressionAttributeValues={':api_key': api_key},
+        ProjectionExpression='email, api_key_id, usage_plan_id'
+    )
+    items = response.get('Items', [])
+    while not items and 'LastEvaluatedKey' in response:
+        response = get_accounts_table().scan(
+            FilterExpression='api_key = :api_key',
+            ExpressionAttributeValues={':api_key': api_key},
+            ProjectionExpression='email, api_key_id, usage_plan_id',
+            ExclusiveStartKey=response['LastEvaluatedKey']
+        )
+        items = response.get('Items', [])
+    if not items:
+        return None
+
+    entry = build_api_key_entry(api_key, items[0]['email'], items[0].get('api_key_id'), items[0].get('usage_plan_id'))
+    api_keys_table.put_item(Item=entry)
+    return entry
+
+def export_hot_set(size=None):
+    """
+    Write the most used active links to the hot-set snapshot in S3.
+
+    Scans linqs (and the counter shards when USAGE_COUNTER_SHARDS > 1), so run
+    it on a schedule rather than per request.
+
+    Args:
+        size (int, optional): Number of links to export. Defaults to HOT_SET_SIZE.
+
+    Returns:
+        dict: Number of links scanned and exported, and the snapshot location
+    """
+    if not HOT_SET_BUCKET:
+        return {'error': 'HOT_SET_BUCKET is not configured'}
+    size = int(size or HOT_SET_SIZE)
+
+    urls_table = get_urls_table()
+    scan_params = {
+        'ProjectionExpression': 'short_code, long_url, owner_email, usage_count, redirect_type, cache_max_age',
+        'FilterExpression': '#status = :active',
+        'ExpressionAttributeNames': {'#status': 'status'},
+        'ExpressionAttributeValues': {':active': 'active'}
+    }
+    links = {}
+    while True:
+        response = urls_table.scan(**scan_params)
+        for item in response.get('Items', []):
+            links[item['short_code']] = item
+        if 'LastEvaluatedKey' not in response:
+            break
+        scan_params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    usage_counts = {short_code: int(item.get('usage_count', 0)) for short_code, item in links.items()}
+    if USAGE_COUNTER_SHARDS > 1:
+        counters_table = get_counters_table()
+        scan_params = {'ProjectionExpression': 'short_code, usage_count'}
+        while True:
+            response = counters_table.scan(**scan_params)
+            for counter in response.get('Items', []):
+                if counter['short_code'] in usage_counts:
+                    usage_counts[counter['short_code']] += int(counter.get('usage_count', 0))
+            if 'LastEvaluatedKey' not in response:
+                break
+            scan_params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    hottest = heapq.nlargest(size, usage_counts, key=usage_counts.get)
+    rows = []
+    for short_code in sorted(hottest):
+        item = links[short_code]
+        cache_max_age = item.get('cache_max_age')
+        rows.append([
+            short_code,
+            item['long_url'],
+            item.get('owner_email'),
+            item.get('redirect_type'),
+            int(cache_max_age) if cache_max_age is not None else None
+        ])
+
+    snapshot = {'format': HOT_SET_FORMAT, 'generated_at': time.time(), 'links': rows}
+    get_aws_client('s3').put_object(
+        Bucket=HOT_SET_BUCKET,
+        Key=HOT_SET_KEY,
+        Body=json.dumps(snapshot, separators=(',', ':')).encode('utf-8'),
+        ContentType='application/json'
+    )
+
+    log('info', 'Exported hot set snapshot', links=len(rows), links_scanned=len(links))
+    return {'links_scanned': len(links), 'links_exported': len(rows), 'location': f's3://{HOT_SET_BUCKET}/{HOT_SET_KEY}'}
+
+def rebuild_short_code_filter():
+    """
+    Build the Bloom filter of every existing short code and upload it to S3.
+
+    The filter is sized for the current number of codes at
+    SHORT_CODE_FILTER_FALSE_POSITIVE_RATE. Codes created while the scan runs
+    are covered by the deltas, which are read from shortly before the start.
+
+    Returns:
+        dict: Number of codes, filter size and hash count
+    """
+    if not SHORT_CODE_FILTER_BUCKET:
+        return {'error': 'SHORT_CODE_FILTER_BUCKET is not configured'}
+
+    started_at = time.time()
+    urls_table = get_urls_table()
+    scan_params = {'ProjectionExpression': 'short_code'}
+    short_codes = []
+    while True:
+        response = urls_table.scan(**scan_params)
+        short_codes.extend(item['short_code'] for item in response.get('Items', []))
+        if 'LastEvaluatedKey' not in response:
+            break
+        scan_params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    # Optimal size m = -n ln p / (ln 2)^2 bits and k = m / n ln 2 hashes, with room for growth until the next rebuild
+    expected = max(len(short_codes), 1000) * 2
+    size = int(math.ceil(-expected * math.log(SHORT_CODE_FILTER_FALSE_POSITIVE_RATE) / math.log(2) ** 2 / 8)) * 8
+    hashes = max(1, min(16, round(size / expected * math.log(2))))
+    bits = bytearray(size // 8)
+    for short_code in short_codes:
+        for position in get_bloom_positions(short_code, size, hashes):
+            bits[position >> 3] |= 1 << (position & 7)
+
+    get_aws_client('s3').put_object(
+        Bucket=SHORT_CODE_FILTER_BUCKET,
+        Key=SHORT_CODE_FILTER_KEY,
+        Body=bytes(bits),
+        ContentType='application/octet-stream',
+        Metadata={'size': str(size), 'hashes': str(hashes), 'generated-at': repr(started_at)}
+    )
+
+    log('info', 'Rebuilt short code filter', short_codes=len(short_codes), size=size, hashes=hashes)
+    return {'short_codes': len(short_codes), 'size_bytes': size // 8, 'hashes': hashes}
+
+def provision_tables():
+    """
+    Create the DynamoDB tables and indexes this version uses that do not exist yet.
+
+    Run once per environment after deploying, before the new code takes
+    traffic. Optional tables are only created when their setting enables them
+    (USAGE_COUNTER_SHARDS > 1, RATE_LIMIT_TABLE). New indexes are built in the
+    background; DynamoDB reports them as CREATING until they are backfilled.
+
+    Returns:
+        dict: Names of the tables checked
+    """
+    tables = [
+        get_urls_table(create_if_missing=True),
+        get_accounts_table(create_if_missing=True),
+        get_api_keys_table(create_if_missing=True),
+        get_sequences_table(create_if_missing=True),
+        get_analytics_table(URL_CLICKS_TABLE_NAME, 'short_code', 'timestamp', create_if_missing=True),
+        get_rollups_table(create_if_missing=True),
+        get_api_usage_table(create_if_missing=True)
+    ]
+    if USAGE_COUNTER_SHARDS > 1:
+        tables.append(get_counters_table(create_if_missing=True))
+    if RATE_LIMIT_TABLE_NAME:
+        rate_limits_table = get_rate_limits_table(create_if_missing=True)
+        tables.append(rate_limits_table)
+        client = get_dynamodb().meta.client
+        ttl = client.describe_time_to_live(TableName=rate_limits_table.name)['TimeToLiveDescription']
+        if ttl.get('TimeToLiveStatus') in (None, 'DISABLED'):
+            # Buckets of clients that went quiet expire instead of accumulating
+            client.update_time_to_live(
+                TableName=rate_limits_table.name,
+                TimeToLiveSpecification={'Enabled': True, 'AttributeName': 'expires_at'}
+            )
+
+    names = [table.name for table in tables]
+    log('info', 'Provisioned tables', tables=names)
+    return {'tables': names}
+
+def backfill_api_key_index():
+    """
+    Add a linqs_api_keys entry for every account that has an API key.
+
+    Returns:
+        dict: Number of accounts scanned and entries written
+    """
+    accounts_table = get_accounts_table()
+    api_keys_table = get_api_keys_table()
+    scan_params = {'ProjectionExpression': 'email, api_key, api_key_id, usage_plan_id'}
+    scanned = 0
+    written = 0
+
+    with api_keys_table.batch_writer(overwrite_by_pkeys=['api_key_hash']) as batch:
+        while True:
+            response = accounts_table.scan(**scan_params)
+            for account in response.get('Items', []):
+                scanned += 1
+                if account.get('api_key'):
+                    batch.put_item(Item=build_api_key_entry(
+                        account['api_key'], account['email'], account.get('api_key_id'), account.get('usage_plan_id')
+                    ))
+                    written += 1
+            if 'LastEvaluatedKey' not in response:
+                break
+            scan_params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    log('info', 'Backfilled API key entries', entries_written=written, accounts_scanned=scanned)
+    return {'accounts_scanned': scanned, 'entries_written': written}
+
+def get_user_by_email(email):
+    """
+    Get a user by email.
+
+    Args:
+        email (str): User email
+
+    Returns:
+        dict or None: User data if found, None otherwise
+    """
+    accounts_table = get_accounts_table()
+    response = accounts_table.get_item(Key={'email': email})
+    return response.get('Item')
+
+def send_password_email(email, password):
+    """
+    Send an email with the user's password.
+
+    Args:
+        email (str): Recipient's email address
+        password (str): User's password
+
+    Returns:
+        bool: True if the email was sent successfully, False otherwise
+    """
+    # Only the password reset route sends email, so the MIME modules are imported here
+    from email.mime.multipart import MIMEMultipart
+    from email.mime.text import MIMEText
+
+    try:
+        # Create the email message
+        msg = MIMEMultipart()
+        msg['Subject'] = 'Your Password for Linq.red'
+        msg['From'] = SERVICE_EMAIL
+        msg['To'] = email
+
+        # Create the HTML body
+        html_body = f"""
+        <html>
+        <head>
+            <style>
+                body {{ font-family: Arial, sans-serif; margin: 0; padding: 20px; color: #333; }}
+                .container {{ max-width: 600px; margin: 0 auto; }}
+                .header {{ background-color: #f44336; color: white; padding: 10px; text-align: center; }}
+                .content {{ padding: 20px; }}
+                .footer {{ font-size: 12px; color: #999; text-align: center; margin-top: 20px; }}
+                .password {{ background: #f5f5f5; padding: 10px; font-family: monospace; margin: 10px 0; }}
+            </style>
+        </head>
+        <body>
+            <div class="container">
+                <div class="header">
+                    <h1>Your Linq.red Password</h1>
+                </div>
+                <div class="content">
+                    <p>Hello,</p>
+                    <p>You requested your password for your Linq.red account. Here it is:</p>
+                    <div class="password">{password}</div>
+                    <p>For security reasons, we recommend changing your password after logging in.</p>
+                    <p>If you did not request this password, please ignore this email.</p>
+                    <p>Thank you,<br>The Linq.red Team</p>
+                </div>
+                <div class="footer">
+                    <p>This is an automated message, please do not reply to this email.</p>
+                </div>
+            </div>
+        </body>
+        </html>
+        """
+
+        # Attach the HTML content
+        msg.attach(MIMEText(html_body, 'html'))
+
+        # Create a simple text version as fallback
+        text_body = f"""
+        Your Linq.red Password
+
+        Hello,
+
+        You requested your password for your Linq.red account. Here it is:
+
+        {password}
+
+        For security reasons, we recommend changing your password after logging in.
+
+        If you did not request this password, please ignore this email.
+
+        Thank you,
+        The Linq.red Team
+
+        This is an automated message, please do not reply to this email.
+        """
+        msg.attach(MIMEText(text_body, 'plain'))
+
+        # Send the email
+        response = get_aws_client('ses').send_raw_email(
+            Source=SERVICE_EMAIL,
+            Destinations=[email],
+            RawMessage={'Data': msg.as_string()}
+        )
+
+        log('info', 'Email sent', email=email, message_id=response.get('MessageId'))
+        return True
+
+    except ClientError as e:
+        log('error', 'Error sending email', error=str(e))
+        return False
+
+def shorten_url(event):
+    """
+    Create a shortened URL. Requires authentication.
+
+    Args:
+        event (dict): Lambda event object
+
+    Returns:
+        dict: Response with status code and body
+    """
+    # Authenticate the request
+    identity = get_authenticated_identity(event)
+
+    if not identity:
         return build_response(401, {'error': 'Authentication required'})
 
-    # Get user data
-    user = get_user_by_email(user_email)
-    if not user:
-        return build_response(401, {'error': 'User not found'})
+    user_email = identity['email']
 
     # Parse request body
     body = json.loads(event.get('body', '{}'))
@@ -1032,48 +2996,60 @@ def shorten_url(event):
         return build_response(400, {'error': 'Long URL is required'})
 
     # Validate URL format
-    try:
-        parsed_url = urlparse(long_url)
-        if not parsed_url.scheme or not parsed_url.netloc:
-            return build_response(400, {'error': 'Invalid URL format'})
-    except Exception:
+    if not is_valid_long_url(long_url):
         return build_response(400, {'error': 'Invalid URL format'})
 
-    # Get the API key from the user's profile
-    api_key = user.get('api_key')
+    cache_policy, error = parse_cache_policy(body)
+    if error:
+        return build_response(400, {'error': error})
 
-    # If we somehow don't have the API key in the user profile, try getting it from headers
-    if not api_key:
-        api_key = event.get('headers', {}).get('x-api-key')
+    api_key, error_response = get_owner_api_key(identity, event)
+    if error_response:
+        return error_response
 
-    if not api_key:
-        return build_response(403, {'error': 'API Key is required'})
+    custom_code = body.get('custom_code')
+    if custom_code is not None and not (isinstance(custom_code, str) and is_valid_short_code(custom_code)):
+        return build_response(400, {'error': 'Invalid custom short code'})
 
-    # Generate a unique short code
-    short_code = body.get('custom_code') or generate_short_code(6)
     urls_table = get_urls_table()
     start_time = time.time()
 
     try:
-        # Check if custom short code exists
-        if body.get('custom_code'):
-            response = urls_table.get_item(Key={'short_code': short_code})
-            if 'Item' in response:
-                return build_response(409, {'error': 'Custom short code already exists'})
-
-        # Add short code, long URL, creation date, usage count, status, API key, and owner email to the DynamoDB table
-        urls_table.put_item(
-            Item={
-                'short_code': short_code,
-                'long_url': long_url,
-                'creation_date': datetime.utcnow().isoformat(),
-                'usage_count': 0,
-                'status': 'active',
-                'api_key': api_key,  # Store the API key used to create the shortened URL
-                'owner_email': user_email  # Store the owner's email
-            },
-            ConditionExpression='attribute_not_exists(short_code)'  # Ensure no duplicate short codes
-        )
+        # Custom codes get a single conditional write; generated codes are retried
+        # a bounded number of times in case they hit an existing custom or legacy code
+        attempts = 1 if custom_code else SHORT_CODE_MAX_ATTEMPTS
+        for attempt in range(attempts):
+            short_code = custom_code or allocate_short_code()
+            try:
+                record_new_short_codes([short_code])
+                # Add short code, long URL, creation date, usage count, status, API key, and owner email to the DynamoDB table
+                urls_table.put_item(
+                    Item={
+                        'short_code': short_code,
+                        'long_url': long_url,
+                        'creation_date': datetime.utcnow().isoformat(),
+                        'usage_count': 0,
+                        'status': 'active',
+                        'api_key': api_key,  # Store the API key used to create the shortened URL
+                        'owner_email': user_email,  # Store the owner's email
+                        **cache_policy  # Optional redirect_type and cache_max_age
+                    },
+                    ConditionExpression='attribute_not_exists(short_code)'  # Ensure no duplicate short codes
+                )
+                break
+            except ClientError as e:
+                if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+                    raise
+                if custom_code:
+                    return build_response(409, {'error': 'Custom short code already exists'})
+                log('warning', 'Short code already taken', short_code=short_code, attempt=attempt + 1)
+        else:
+            log_metric('ShortenURLCollision', 1)
+            return build_response(503, {'error': 'Could not allocate a short code, please retry'})
+
+        # Forget any cached 404 for this code in this container
+        invalidate_redirect(short_code)
+        add_created_urls_to_account(user_email, 1)
 
         # Log metrics and return response
         latency = time.time() - start_time
@@ -1084,14 +3060,279 @@ def shorten_url(event):
             'short_url': f'https://linq.red/{short_code}',
             'short_code': short_code,
             'long_url': long_url,
-            'creation_date': datetime.utcnow().isoformat()
+            'creation_date': datetime.utcnow().isoformat(),
+            **cache_policy
         })
-    except ClientError as e:
+    except (ClientError, BotoCoreError) as e:
         # Log error metrics and return error response
         log_metric('ShortenURLError', 1)
-        print(f"Error shortening URL: {str(e)}")
+        log('error', 'Error shortening URL', error=str(e))
         return build_response(500, {'error': 'Failed to create shortened URL'})
 
+def is_valid_long_url(long_url):
+    """
+    Check that a destination URL has a scheme and a host.
+
+    Args:
+        long_url (str): The URL to shorten
+
+    Returns:
+        bool: True if the URL can be shortened
+    """
+    try:
+        parsed_url = urlparse(long_url)
+        return bool(parsed_url.scheme and parsed_url.netloc)
+    except Exception:
+        return False
+
+def parse_cache_policy(entry):
+    """
+    Validate the optional redirect_type and cache_max_age of a link to create.
+
+    Args:
+        entry (dict): Request entry for one link
+
+    Returns:
+        tuple: (attributes, error) where attributes holds the fields to store on the
+            item and error is a message when the values are invalid
+    """
+    attributes = {}
+
+    redirect_type = entry.get('redirect_type')
+    if redirect_type is not None:
+        if redirect_type not in REDIRECT_STATUS_CODES:
+            return None, f"redirect_type must be one of: {', '.join(REDIRECT_STATUS_CODES)}"
+        attributes['redirect_type'] = redirect_type
+
+    cache_max_age = entry.get('cache_max_age')
+    if cache_max_age is not None:
+        if isinstance(cache_max_age, bool) or not isinstance(cache_max_age, int) or not 0 <= cache_max_age <= REDIRECT_MAX_AGE_LIMIT:
+            return None, f'cache_max_age must be an integer between 0 and {REDIRECT_MAX_AGE_LIMIT}'
+        attributes['cache_max_age'] = cache_max_age
+
+    return attributes, None
+
+def get_owner_api_key(identity, event):
+    """
+    Get the API key to store on URLs created by an authenticated caller.
+
+    Args:
+        identity (dict): Identity from get_authenticated_identity
+        event (dict): Lambda event object
+
+    Returns:
+        tuple: (api_key, error_response) where error_response is None on success
+    """
+    # API key callers already proved which key they own; token callers use the key from their profile
+    api_key = identity.get('api_key')
+    if not api_key:
+        user = get_user_by_email(identity['email'])
+        if not user:
+            return None, build_response(401, {'error': 'User not found'})
+        api_key = user.get('api_key')
+
+    # If we somehow don't have the API key in the user profile, try getting it from headers
+    if not api_key:
+        api_key = event.get('headers', {}).get('x-api-key')
+
+    if not api_key:
+        return None, build_response(403, {'error': 'API Key is required'})
+
+    return api_key, None
+
+def shorten_urls_batch(event):
+    """
+    Create up to BATCH_SHORTEN_MAX_ITEMS shortened URLs in one request. Requires authentication.
+
+    The caller is authenticated once and every entry is validated up front.
+    Valid entries are written with conditional TransactWriteItems calls of
+    BATCH_WRITE_CHUNK_SIZE items. Cancellation reasons give per-item results:
+    generated codes that collide get a new code, taken custom codes fail with
+    409, and conflicting items are retried with backoff. Once a chunk is
+    throttled the rest of the round waits too, and the next round backs off longer.
+    A chunk that failed for any other reason, including in transit, is resent
+    unchanged with its ClientRequestToken, so a retry never duplicates links.
+
+    Args:
+        event (dict): Lambda event object with body {"urls": [{"long_url": ..., "custom_code": ...}, ...]}
+
+    Returns:
+        dict: Response with a result per submitted entry, in request order
+    """
+    # Authenticate the request
+    identity = get_authenticated_identity(event)
+
+    if not identity:
+        return build_response(401, {'error': 'Authentication required'})
+
+    user_email = identity['email']
+
+    # Parse request body
+    try:
+        body = json.loads(event.get('body') or '{}')
+    except ValueError:
+        return build_response(400, {'error': 'Request body must be JSON'})
+    entries = body.get('urls')
+
+    if not isinstance(entries, list) or not entries:
+        return build_response(400, {'error': 'A non-empty list of urls is required'})
+
+    if len(entries) > BATCH_SHORTEN_MAX_ITEMS:
+        return build_response(400, {'error': f'At most {BATCH_SHORTEN_MAX_ITEMS} urls can be shortened per request'})
+
+    api_key, error_response = get_owner_api_key(identity, event)
+    if error_response:
+        return error_response
+
+    start_time = time.time()
+    results = [None] * len(entries)
+    pending = []  # (index, custom_code, item) waiting to be written
+    seen_custom_codes = set()
+
+    # Validate every entry before writing anything
+    for index, entry in enumerate(entries):
+        if isinstance(entry, str):
+            entry = {'long_url': entry}
+        if not isinstance(entry, dict):
+            entry = {}
+        long_url = entry.get('long_url')
+        custom_code = entry.get('custom_code')
+        cache_policy, error = parse_cache_policy(entry)
+
+        if not long_url:
+            results[index] = {'index': index, 'status': 400, 'error': 'Long URL is required'}
+        elif not is_valid_long_url(long_url):
+            results[index] = {'index': index, 'status': 400, 'error': 'Invalid URL format'}
+        elif error:
+            results[index] = {'index': index, 'status': 400, 'error': error}
+        elif custom_code is not None and not (isinstance(custom_code, str) and is_valid_short_code(custom_code)):
+            results[index] = {'index': index, 'status': 400, 'error': 'Invalid custom short code'}
+        elif custom_code and custom_code in seen_custom_codes:
+            results[index] = {'index': index, 'status': 409, 'error': 'Custom short code already exists'}
+        else:
+            if custom_code:
+                seen_custom_codes.add(custom_code)
+            pending.append((index, custom_code, {
+                'short_code': custom_code,
+                'long_url': long_url,
+                'creation_date': datetime.utcnow().isoformat(),
+                'usage_count': 0,
+                'status': 'active',
+                'api_key': api_key,
+                'owner_email': user_email,
+                **cache_policy
+            }))
+
+    urls_table = get_urls_table()
+    attempts = {}
+    throttled = False
+    # Chunks to send again exactly as they were, with the same ClientRequestToken: if a transaction whose
+    # response was lost did commit, DynamoDB answers the resend with success instead of condition failures
+    resend = []
+
+    for round_number in range(BATCH_WRITE_MAX_ROUNDS):
+        if not pending and not resend:
+            break
+        if round_number:
+            # Back off before retrying conflicting items, longer (with jitter) when the table is throttling
+            if throttled:
+                time.sleep(min(0.25 * (2 ** round_number), 2.0) * random.uniform(0.5, 1.0))
+            else:
+                time.sleep(min(0.05 * (2 ** round_number), 1.0))
+
+        chunks = resend + [
+            (pending[i:i + BATCH_WRITE_CHUNK_SIZE], uuid.uuid4().hex)
+            for i in range(0, len(pending), BATCH_WRITE_CHUNK_SIZE)
+        ]
+        retry, resend = [], []
+        throttled = False
+        for chunk, token in chunks:
+            if throttled:
+                # More writes now would only be throttled as well; leave the rest for the next round
+                resend.append((chunk, token))
+                continue
+            for index, custom_code, item in chunk:
+                if not item['short_code']:
+                    item['short_code'] = allocate_short_code()
+                attempts[index] = attempts.get(index, 0) + 1
+
+            try:
+                record_new_short_codes([item['short_code'] for _, _, item in chunk])
+                get_dynamodb().meta.client.transact_write_items(
+                    TransactItems=[
+                        {
+                            'Put': {
+                                'TableName': urls_table.name,
+                                'Item': item,
+                                'ConditionExpression': 'attribute_not_exists(short_code)'
+                            }
+                        }
+                        for _, _, item in chunk
+                    ],
+                    ClientRequestToken=token
+                )
+            except BotoCoreError as e:
+                # The transaction may or may not have committed
+                log('error', 'Error writing URL batch', error=str(e))
+                resend.append((chunk, token))
+                continue
+            except ClientError as e:
+                reasons = e.response.get('CancellationReasons') or []
+                error_code = e.response['Error']['Code']
+                if error_code in DYNAMODB_THROTTLING_CODES or any(reason.get('Code') in DYNAMODB_THROTTLING_CODES for reason in reasons):
+                    log('warning', 'URL batch write throttled', items=len(chunk))
+                    throttled = True
+                if error_code != 'TransactionCanceledException' or len(reasons) != len(chunk):
+                    if not throttled:
+                        log('error', 'Error writing URL batch', error=str(e))
+                    resend.append((chunk, token))
+                    continue
+
+                for (index, custom_code, item), reason in zip(chunk, reasons):
+                    if reason.get('Code') != 'ConditionalCheckFailed':
+                        # Cancelled because of another item, throttling or a conflicting transaction
+                        retry.append((index, custom_code, item))
+                    elif custom_code:
+                        results[index] = {'index': index, 'status': 409, 'error': 'Custom short code already exists'}
+                    elif attempts[index] < SHORT_CODE_MAX_ATTEMPTS:
+                        item['short_code'] = allocate_short_code()
+                        retry.append((index, custom_code, item))
+                    else:
+                        results[index] = {'index': index, 'status': 503, 'error': 'Could not allocate a short code, please retry'}
+                continue
+
+            for index, _, item in chunk:
+                invalidate_redirect(item['short_code'])
+                results[index] = {
+                    'index': index,
+                    'status': 201,
+                    'short_url': f"https://linq.red/{item['short_code']}",
+                    'short_code': item['short_code'],
+                    'long_url': item['long_url'],
+                    'creation_date': item['creation_date'],
+                    **{k: item[k] for k in ('redirect_type', 'cache_max_age') if k in item}
+                }
+        pending = retry
+
+    pending += [entry for chunk, _ in resend for entry in chunk]
+    for index, _, _ in pending:
+        results[index] = {'index': index, 'status': 503, 'error': 'Failed to create shortened URL, please retry'}
+
+    created = sum(1 for result in results if result['status'] == 201)
+    if created:
+        add_created_urls_to_account(user_email, created)
+    latency = time.time() - start_time
+    log_metric('BatchShortenURLLatency', latency, 'Seconds')
+    log_metric('BatchShortenURLCreated', created)
+    if created < len(results):
+        log_metric('BatchShortenURLFailed', len(results) - created)
+
+    return build_response(200, {
+        'results': results,
+        'created': created,
+        'failed': len(results) - created
+    })
+
 def retrieve_url(event):
     """
     Retrieve and redirect to the original URL for a given short code.
@@ -1102,9 +3343,6 @@ def retrieve_url(event):
     Returns:
         dict: HTTP redirect response or error response
     """
-    # Debug log the entire event
-    print(f"Retrieve URL event: {json.dumps(event, indent=2)}")
-
     # Try multiple ways to extract the short code
     short_code = None
 
@@ -1112,7 +3350,7 @@ def retrieve_url(event):
     path_params = event.get('pathParameters', {}) or {}
     if path_params and 'short_code' in path_params:
         short_code = path_params.get('short_code')
-        print(f"Extracted short code from pathParameters: {short_code}")
+        log('debug', 'Extracted short code from pathParameters', short_code=short_code)
 
     # Method 2: Try from the path
     if not short_code and 'path' in event:
@@ -1121,7 +3359,7 @@ def retrieve_url(event):
         path_short_code = path[1:] if path.startswith('/') else path
         if path_short_code and path_short_code != '/':
             short_code = path_short_code
-            print(f"Extracted short code from path: {short_code}")
+            log('debug', 'Extracted short code from path', short_code=short_code)
 
     # Method 3: Try from the resource path
     if not short_code and 'resource' in event:
@@ -1129,7 +3367,7 @@ def retrieve_url(event):
         if resource and resource != '/' and resource != '/{proxy+}':
             resource_short_code = resource[1:] if resource.startswith('/') else resource
             short_code = resource_short_code
-            print(f"Extracted short code from resource: {short_code}")
+            log('debug', 'Extracted short code from resource', short_code=short_code)
 
     # Method 4: Try from the URL itself
     if not short_code and 'requestContext' in event and 'http' in event['requestContext']:
@@ -1139,76 +3377,61 @@ def retrieve_url(event):
             http_short_code = http_path[1:] if http_path.startswith('/') else http_path
             if http_short_code and http_short_code != '/':
                 short_code = http_short_code
-                print(f"Extracted short code from HTTP context: {short_code}")
+                log('debug', 'Extracted short code from HTTP context', short_code=short_code)
 
-    print(f"Final extracted short code: {short_code}")
 
     if not short_code:
         return build_response(400, {'error': 'Short code is required'})
 
-    # Use the correct table getter
-    urls_table = get_urls_table()
+    # Scanner and browser junk (favicon.ico, wp-login.php) never reaches DynamoDB
+    if is_junk_path(short_code):
+        log_metric('RetrieveURLRejected', 1)
+        return build_response(404, {'error': 'Short code not found'}, {'Cache-Control': 'public, max-age=86400'})
+
     start_time = time.time()
 
     try:
-        print(f"Looking up short code: {short_code}")
-        response = urls_table.get_item(Key={'short_code': short_code})
-        item = response.get('Item')
-        print(f"DynamoDB response: {json.dumps(response, default=str)}")
+        # Serve hot links (and recent 404s) from the container cache when possible
+        cache_hit, item = get_cached_redirect(short_code)
+        if cache_hit:
+            log('debug', 'Redirect cache hit', short_code=short_code, cache=redirect_cache_stats)
+        else:
+            log('debug', 'Looking up short code', short_code=short_code)
+            try:
+                # Popular links exported to the hot-set snapshot need no DynamoDB read,
+                # and codes the Bloom filter rules out are answered as misses right away
+                item = get_hot_link(short_code)
+                filtered = False
+                if item is None:
+                    if short_code_might_exist(short_code):
+                        item = lookup_redirect(short_code)
+                    else:
+                        log_metric('RetrieveURLFilteredMiss', 1)
+                        filtered = True
+            except (ClientError, BotoCoreError, TimeoutError) as e:
+                # Degrade to the last known destination rather than failing the redirect
+                item = get_stale_redirect(short_code)
+                if item is None:
+                    log('error', 'Redirect lookup failed', short_code=short_code, error=str(e))
+                    log_metric('RetrieveURLUnavailable', 1)
+                    return build_response(503, {'error': 'Service temporarily unavailable'}, {'Retry-After': '1'})
+                log('warning', 'Serving stale redirect', short_code=short_code, error=str(e))
+                log_metric('RetrieveURLStale', 1)
+            else:
+                # Filtered misses are not cached: answering them again is cheap, and a link created
+                # since then must be found as soon as the deltas show it
+                if not filtered:
+                    cache_redirect(short_code, item)
 
         if item and item['status'] == 'active':
-            # Update the usage count atomically
-            print(f"Found active URL: {item.get('long_url')}")
-            urls_table.update_item(
-                Key={'short_code': short_code},
-                UpdateExpression='SET usage_count = if_not_exists(usage_count, :zero) + :inc',
-                ExpressionAttributeValues={
-                    ':zero': 0,
-                    ':inc': 1
-                }
-            )
+            log('debug', 'Found active URL', short_code=short_code, long_url=item.get('long_url'))
 
-            # Track detailed analytics about this click
+            # Count the click and record its analytics (buffered unless CLICK_INGESTION_MODE is 'sync')
             try:
-                # Extract useful information from the request
-                headers = event.get('headers', {}) or {}
-                request_context = event.get('requestContext', {}) or {}
-
-                # Get referrer information
-                referrer = headers.get('Referer') or headers.get('referer', 'Direct')
-
-                # Get user agent
-                user_agent = headers.get('User-Agent') or headers.get('user-agent', 'Unknown')
-
-                # Get IP address and location info if available
-                ip_address = None
-                if 'identity' in request_context:
-                    ip_address = request_context.get('identity', {}).get('sourceIp', 'Unknown')
-                elif 'http' in request_context:
-                    ip_address = request_context.get('http', {}).get('sourceIp', 'Unknown')
-
-                # Try to get country/region information
-                country = headers.get('CloudFront-Viewer-Country', 'Unknown')
-
-                # Store detailed click information
-                clicks_table = get_analytics_table(URL_CLICKS_TABLE_NAME, 'short_code', 'timestamp')
-                clicks_table.put_item(
-                    Item={
-                        'short_code': short_code,
-                        'timestamp': datetime.utcnow().isoformat(),
-                        'referrer': referrer,
-                        'user_agent': user_agent,
-                        'ip_address': ip_address or 'Unknown',
-                        'country': country,
-                        'owner_email': item.get('owner_email', 'Unknown'),
-                        'device_type': 'desktop' if 'desktop' in user_agent.lower() else
-                                     ('mobile' if any(mobile in user_agent.lower() for mobile in ['mobile', 'android', 'iphone', 'ipad']) else 'unknown')
-                    }
-                )
-                print(f"Recorded click analytics for {short_code}")
+                record_click(short_code, item, event)
             except Exception as e:
                 # Don't fail the redirect if analytics tracking fails
-                print(f"Error recording click analytics: {str(e)}")
+                log('error', 'Error recording click analytics', error=str(e))
 
             latency = time.time() - start_time
             log_metric('RetrieveURLLatency', latency, 'Seconds')
@@ -1219,21 +3442,1068 @@ def retrieve_url(event):
             if not (long_url.startswith('http://') or long_url.startswith('https://')):
                 long_url = 'https://' + long_url
 
-            # Return a 301 Moved Permanently redirect
-            return build_response(301, {}, {'Location': long_url})
+            # Redirect with the link's cache policy (301 Moved Permanently unless configured otherwise)
+            status_code, cache_control = get_redirect_policy(item)
+            return build_response(status_code, {}, {'Location': long_url, 'Cache-Control': cache_control})
         elif item:
-            print(f"URL found but inactive: {short_code}")
+            log('info', 'URL found but inactive', short_code=short_code)
             return build_response(403, {'error': 'This link is inactive'})
 
-        print(f"Short code not found: {short_code}")
+        log('info', 'Short code not found', short_code=short_code)
         return build_response(404, {'error': 'Short code not found'})
-    except ClientError as e:
-        error_msg = str(e)
-        print(f"DynamoDB error: {error_msg}")
-        log_metric('RetrieveURLError', 1)
-        return build_response(500, {'error': error_msg})
     except Exception as e:
         error_msg = str(e)
-        print(f"Unexpected error: {error_msg}")
+        log('error', 'Unexpected error', error=error_msg)
         log_metric('RetrieveURLError', 1)
-        return build_response(500, {'error': 'An unexpected error occurred'})
\ No newline at end of file
+        return build_response(500, {'error': 'An unexpected error occurred'})
+
+def get_redirect_policy(item):
+    """
+    Return the status code and Cache-Control header for redirecting to a link.
+
+    Args:
+        item (dict): URL item with optional redirect_type and cache_max_age
+
+    Returns:
+        tuple: (status_code, cache_control)
+    """
+    status_code = REDIRECT_STATUS_CODES.get(
+        item.get('redirect_type'), REDIRECT_STATUS_CODES.get(REDIRECT_DEFAULT_TYPE, 301)
+    )
+    max_age = int(item.get('cache_max_age', REDIRECT_DEFAULT_MAX_AGE))
+    if max_age > 0:
+        return status_code, f'public, max-age={max_age}'
+    # Without an explicit max-age browsers may cache a 301 indefinitely, hiding later clicks
+    return status_code, 'no-cache'
+
+def lookup_redirect(short_code):
+    """
+    Read a short code from DynamoDB within REDIRECT_LATENCY_BUDGET.
+
+    Args:
+        short_code (str): The short code to look up
+
+    Returns:
+        dict: The URL item, or None if the code does not exist
+
+    Raises:
+        TimeoutError: If the lookup did not finish within the budget
+        ClientError, BotoCoreError: If the lookup failed
+    """
+    from concurrent import futures
+
+    # Resolved here: boto3 resources are not thread-safe, their clients are
+    table = get_redirect_table()
+    client = table.meta.client
+
+    def get_item():
+        return client.get_item(TableName=table.name, Key={'short_code': short_code}).get('Item')
+
+    future = get_redirect_executor().submit(get_item)
+    try:
+        return future.result(timeout=REDIRECT_LATENCY_BUDGET)
+    except futures.TimeoutError:
+        # The call finishes (or times out) in the background; its result is discarded
+        raise TimeoutError(f'Lookup exceeded {REDIRECT_LATENCY_BUDGET}s budget') from None
+
+def get_redirect_executor():
+    """Get the thread pool that runs redirect path reads under REDIRECT_LATENCY_BUDGET."""
+    global _redirect_executor
+    from concurrent import futures
+
+    if _redirect_executor is None:
+        _redirect_executor = futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix='redirect')
+    return _redirect_executor
+
+def load_hot_set(s3_client):
+    """
+    Load the hot-set snapshot from S3 into this container.
+
+    A missing, unreadable or too old snapshot leaves the hot set empty; the
+    container then resolves every link from DynamoDB as before.
+
+    Args:
+        s3_client (BaseClient): The redirect S3 client
+    """
+    try:
+        response = s3_client.get_object(Bucket=HOT_SET_BUCKET, Key=HOT_SET_KEY)
+        snapshot = json.loads(response['Body'].read())
+    except (ClientError, BotoCoreError, ValueError) as e:
+        log('warning', 'Hot set snapshot not loaded', error=str(e))
+        return
+
+    if snapshot.get('format') != HOT_SET_FORMAT:
+        log('warning', 'Unsupported hot set snapshot format', format=snapshot.get('format'))
+        return
+    if snapshot['generated_at'] + HOT_SET_MAX_AGE <= time.time():
+        log('warning', 'Hot set snapshot too old', generated_at=snapshot['generated_at'])
+        return
+
+    # Rows are written sorted by short code, so lookups can bisect without building a dict
+    rows = snapshot['links']
+    _hot_set.update(
+        codes=tuple(row[0] for row in rows),
+        links=tuple(tuple(row[1:]) for row in rows),
+        generated_at=snapshot['generated_at']
+    )
+    log('info', 'Loaded hot set snapshot', links=len(rows), age=round(time.time() - snapshot['generated_at']))
+
+def get_hot_link(short_code):
+    """
+    Look up a short code in the hot-set snapshot.
+
+    The first call loads the snapshot, waiting for it at most
+    REDIRECT_LATENCY_BUDGET; a slower load finishes in the background. Each
+    code is answered from the snapshot once per container, so that once the
+    redirect cache expires its status is read from DynamoDB again.
+
+    Args:
+        short_code (str): The short code to look up
+
+    Returns:
+        dict: A URL item in the shape stored by the redirect cache, or None
+    """
+    if not _hot_set['loaded']:
+        from concurrent import futures
+
+        _hot_set['loaded'] = True
+        if not HOT_SET_BUCKET:
+            return None
+        try:
+            # The client is created here: creating clients from the default session is not thread-safe
+            future = get_redirect_executor().submit(load_hot_set, get_redirect_s3_client())
+            future.result(timeout=REDIRECT_LATENCY_BUDGET)
+        except futures.TimeoutError:
+            log('warning', 'Hot set snapshot still loading', budget=REDIRECT_LATENCY_BUDGET)
+            return None
+
+    codes = _hot_set['codes']
+    if not codes:
+        return None
+    if _hot_set['generated_at'] + HOT_SET_MAX_AGE <= time.time():
+        # Too old to trust the links are still active; fall back to DynamoDB from now on
+        _hot_set.update(codes=(), links=())
+        return None
+
+    index = bisect.bisect_left(codes, short_code)
+    if index == len(codes) or codes[index] != short_code or short_code in _hot_set['served']:
+        return None
+    _hot_set['served'].add(short_code)
+
+    long_url, owner_email, redirect_type, cache_max_age = _hot_set['links'][index]
+    item = {'short_code': short_code, 'long_url': long_url, 'status': 'active', 'owner_email': owner_email}
+    if redirect_type is not None:
+        item['redirect_type'] = redirect_type
+    if cache_max_age is not None:
+        item['cache_max_age'] = cache_max_age
+    redirect_cache_stats['hot_set_hits'] += 1
+    return item
+
+def is_valid_short_code(short_code):
+    """
+    Check a new short code against the syntax rules and the junk path deny-list.
+
+    Args:
+        short_code (str): Short code requested for a new link
+
+    Returns:
+        bool: True if a link may be created with this code
+    """
+    return bool(SHORT_CODE_PATTERN.fullmatch(short_code)) and not is_junk_path(short_code)
+
+def is_junk_path(path):
+    """
+    Check whether a redirect path can never be a short code.
+
+    Args:
+        path (str): Path taken from the request, without the leading slash
+
+    Returns:
+        bool: True for JUNK_PATHS entries, paths below them and paths too long for a DynamoDB key
+    """
+    return path.split('/', 1)[0].lower() in JUNK_PATHS or len(path.encode('utf-8')) > 2048
+
+def get_bloom_positions(short_code, size, hashes):
+    """Yield the bit positions of a short code in a Bloom filter of size bits (double hashing)."""
+    digest = hashlib.blake2b(short_code.encode('utf-8'), digest_size=16).digest()
+    first, second = int.from_bytes(digest[:8], 'big'), int.from_bytes(digest[8:], 'big') | 1
+    for i in range(hashes):
+        yield (first + i * second) % size
+
+def get_short_code_delta_shard(short_code):
+    """Return the delta shard a short code is recorded in."""
+    return hashlib.blake2b(short_code.encode('utf-8'), digest_size=1).digest()[0] % SHORT_CODE_DELTA_SHARDS
+
+def get_short_code_delta_keys(since, until, shard):
+    """Return the sequences table keys of one shard's delta items covering [since, until]."""
+    first = int(since // SHORT_CODE_DELTA_INTERVAL)
+    last = int(until // SHORT_CODE_DELTA_INTERVAL)
+    return [
+        {'name': f'code_delta#{interval * SHORT_CODE_DELTA_INTERVAL}#{shard}'}
+        for interval in range(first, last + 1)
+    ]
+
+def record_new_short_codes(short_codes):
+    """
+    Add short codes to the current delta items of their shards before their links are written.
+
+    Containers consult the deltas when the Bloom filter reports a miss, so a
+    failure here must fail the create rather than leave a code undiscoverable.
+
+    Args:
+        short_codes (list): Codes about to be written
+    """
+    if not SHORT_CODE_FILTER_BUCKET or not short_codes:
+        return
+    by_shard = {}
+    for short_code in short_codes:
+        by_shard.setdefault(get_short_code_delta_shard(short_code), set()).add(short_code)
+
+    sequences_table = get_sequences_table()
+    now = time.time()
+    for shard, codes in by_shard.items():
+        sequences_table.update_item(
+            Key=get_short_code_delta_keys(now, now, shard)[0],
+            UpdateExpression='ADD codes :codes',
+            ExpressionAttributeValues={':codes': codes}
+        )
+        _short_code_filter['delta'].setdefault(shard, set()).update(codes)
+
+def start_short_code_filter_load():
+    """
+    Fetch the Bloom filter on the redirect executor, at most every SHORT_CODE_FILTER_REFRESH seconds.
+
+    The filter can be several MB. Only the first load in a container is waited
+    for, and at most REDIRECT_LATENCY_BUDGET; refreshes replace the filter in
+    use when they complete.
+    """
+    from concurrent import futures
+
+    _short_code_filter['checked_at'] = time.time()
+    # The client is created here: creating clients from the default session is not thread-safe
+    future = get_redirect_executor().submit(load_short_code_filter, get_redirect_s3_client(), _short_code_filter['etag'])
+    if _short_code_filter['bits'] is None:
+        try:
+            future.result(timeout=REDIRECT_LATENCY_BUDGET)
+        except futures.TimeoutError:
+            log('warning', 'Short code filter still loading', budget=REDIRECT_LATENCY_BUDGET)
+
+def load_short_code_filter(s3_client, etag):
+    """
+    Fetch the Bloom filter from S3 if it changed since the loaded version.
+
+    Args:
+        s3_client (BaseClient): The redirect S3 client
+        etag (str): ETag of the loaded filter, or None
+    """
+    params = {'Bucket': SHORT_CODE_FILTER_BUCKET, 'Key': SHORT_CODE_FILTER_KEY}
+    if etag:
+        params['IfNoneMatch'] = etag
+    try:
+        response = s3_client.get_object(**params)
+        metadata = response['Metadata']
+        loaded = {
+            'bits': response['Body'].read(),
+            'size': int(metadata['size']),
+            'hashes': int(metadata['hashes']),
+            'generated_at': float(metadata['generated-at']),
+            'etag': response['ETag']
+        }
+    except ClientError as e:
+        if e.response['Error']['Code'] not in ('304', 'NotModified'):
+            log('warning', 'Short code filter not loaded', error=str(e))
+        return
+    except (BotoCoreError, KeyError, ValueError) as e:
+        log('warning', 'Short code filter not loaded', error=str(e))
+        return
+
+    # One update, so the handler thread never sees the bits of one filter with the size of another
+    _short_code_filter.update(delta_checked_at={}, **loaded)
+    log('info', 'Loaded short code filter', size=_short_code_filter['size'], generated_at=_short_code_filter['generated_at'])
+
+def refresh_short_code_delta(shard):
+    """
+    Re-read the codes of one delta shard created since the filter was built.
+
+    Reads go through the redirect DynamoDB client and are abandoned after
+    REDIRECT_LATENCY_BUDGET, like redirect lookups.
+
+    Args:
+        shard (int): The delta shard
+
+    Returns:
+        bool: False if the deltas could not be read completely
+    """
+    from concurrent import futures
+
+    keys = get_short_code_delta_keys(_short_code_filter['generated_at'] - SHORT_CODE_DELTA_MARGIN, time.time(), shard)
+    if len(keys) > 100:
+        # The filter has not been rebuilt for too long to cover its gap with one BatchGetItem
+        return False
+
+    # Resolved here: boto3 resources are not thread-safe, their clients are
+    table_name = get_sequences_table().name
+    client = get_redirect_table().meta.client
+
+    def read_deltas():
+        codes = set()
+        request = {table_name: {'Keys': keys, 'ConsistentRead': True}}
+        while request:
+            response = client.batch_get_item(RequestItems=request)
+            for item in response.get('Responses', {}).get(table_name, []):
+                codes.update(item.get('codes', ()))
+            request = response.get('UnprocessedKeys')
+        return codes
+
+    try:
+        delta = get_redirect_executor().submit(read_deltas).result(timeout=REDIRECT_LATENCY_BUDGET)
+    except futures.TimeoutError:
+        log('warning', 'Short code delta read exceeded budget', budget=REDIRECT_LATENCY_BUDGET)
+        return False
+
+    _short_code_filter['delta'][shard] = delta
+    _short_code_filter['delta_checked_at'][shard] = time.time()
+    return True
+
+def short_code_might_exist(short_code):
+    """
+    Check whether a short code may exist, using the Bloom filter and the recent code deltas.
+
+    Any problem with the filter or the deltas answers True, so the caller
+    falls back to reading DynamoDB.
+
+    Args:
+        short_code (str): A syntactically valid short code
+
+    Returns:
+        bool: False only if the code definitely does not exist
+    """
+    if not SHORT_CODE_FILTER_BUCKET:
+        return True
+    try:
+        if time.time() - _short_code_filter['checked_at'] >= SHORT_CODE_FILTER_REFRESH:
+            start_short_code_filter_load()
+        bits = _short_code_filter['bits']
+        if not bits:
+            return True
+
+        positions = get_bloom_positions(short_code, _short_code_filter['size'], _short_code_filter['hashes'])
+        if all(bits[position >> 3] & (1 << (position & 7)) for position in positions):
+            return True
+        shard = get_short_code_delta_shard(short_code)
+        if short_code in _short_code_filter['delta'].get(shard, ()):
+            return True
+
+        # Only a definite miss pays for re-reading its shard's deltas, and only once per refresh interval
+        if time.time() - _short_code_filter['delta_checked_at'].get(shard, 0) >= SHORT_CODE_DELTA_REFRESH:
+            if not refresh_short_code_delta(shard):
+                return True
+        return short_code in _short_code_filter['delta'][shard]
+    except (ClientError, BotoCoreError, KeyError, ValueError) as e:
+        log('warning', 'Short code filter check failed', error=str(e))
+        return True
+
+def build_click_record(short_code, item, event):
+    """
+    Build the analytics record for a single click from the redirect request.
+
+    Args:
+        short_code (str): The short code that was clicked
+        item (dict): The URL item for the short code
+        event (dict): Lambda event object of the redirect request
+
+    Returns:
+        dict: Item for the click analytics table
+    """
+    # Extract useful information from the request
+    headers = event.get('headers', {}) or {}
+    request_context = event.get('requestContext', {}) or {}
+
+    # Get referrer information
+    referrer = headers.get('Referer') or headers.get('referer', 'Direct')
+
+    # Get user agent
+    user_agent = headers.get('User-Agent') or headers.get('user-agent', 'Unknown')
+
+    # Get IP address and location info if available
+    ip_address = None
+    if 'identity' in request_context:
+        ip_address = request_context.get('identity', {}).get('sourceIp', 'Unknown')
+    elif 'http' in request_context:
+        ip_address = request_context.get('http', {}).get('sourceIp', 'Unknown')
+
+    # Try to get country/region information
+    country = headers.get('CloudFront-Viewer-Country', 'Unknown')
+
+    return {
+        'short_code': short_code,
+        'timestamp': datetime.utcnow().isoformat(),
+        'referrer': referrer,
+        'user_agent': user_agent,
+        'ip_address': ip_address or 'Unknown',
+        'country': country,
+        'owner_email': item.get('owner_email', 'Unknown'),
+        'device_type': 'desktop' if 'desktop' in user_agent.lower() else
+                     ('mobile' if any(mobile in user_agent.lower() for mobile in ['mobile', 'android', 'iphone', 'ipad']) else 'unknown')
+    }
+
+def record_click(short_code, item, event):
+    """
+    Count a click and record its analytics.
+
+    In 'buffered' mode the click is only queued in memory and written later by
+    flush_ingestion_buffers; in 'sync' mode both writes happen before returning.
+
+    Args:
+        short_code (str): The short code that was clicked
+        item (dict): The URL item for the short code
+        event (dict): Lambda event object of the redirect request
+    """
+    global _click_buffer_started_at
+
+    click = build_click_record(short_code, item, event)
+
+    if CLICK_INGESTION_MODE == 'sync':
+        # The click row first: a failing counter update must not lose the click itself
+        clicks_table = get_analytics_table(URL_CLICKS_TABLE_NAME, 'short_code', 'timestamp')
+        clicks_table.put_item(Item=click)
+        apply_usage_delta(short_code, 1)
+        apply_rollup_counters(short_code, click['timestamp'][:10], get_rollup_counters(click))
+        if item.get('owner_email'):
+            apply_account_counters(item['owner_email'], total_clicks=1)
+        log('debug', 'Recorded click analytics', short_code=short_code)
+        return
+
+    if not _click_buffer:
+        _click_buffer_started_at = time.time()
+    _click_buffer.append(click)
+    if len(_click_buffer) > CLICK_BUFFER_HARD_LIMIT:
+        # Flushes are failing or still in flight; drop the oldest record rather than grow without bound
+        del _click_buffer[0]
+    increment_usage_count(short_code, owner_email=item.get('owner_email'))
+
+    # Coalesce the click into its per-day rollup
+    pending = _rollup_increments.setdefault((short_code, click['timestamp'][:10]), {})
+    for attribute, count in get_rollup_counters(click).items():
+        pending[attribute] = pending.get(attribute, 0) + count
+
+def get_rollup_counters(click):
+    """
+    Get the rollup counter attributes a click contributes to.
+
+    Referrers are reduced to their host name to keep the number of counters per day bounded.
+
+    Args:
+        click (dict): Click record built by build_click_record
+
+    Returns:
+        dict: Rollup attribute name -> 1
+    """
+    referrer = click.get('referrer') or 'Direct'
+    referrer_host = urlparse(referrer).netloc if '://' in referrer else referrer
+    return {
+        'clicks': 1,
+        ROLLUP_REFERRER_PREFIX + (referrer_host or referrer)[:200]: 1,
+        ROLLUP_COUNTRY_PREFIX + str(click.get('country', 'Unknown'))[:50]: 1,
+        ROLLUP_DEVICE_PREFIX + str(click.get('device_type', 'unknown'))[:50]: 1
+    }
+
+def apply_rollup_counters(short_code, day, counters):
+    """
+    Add counters to the rollup item of a short code for one day.
+
+    Args:
+        short_code (str): The short code that was clicked
+        day (str): Day of the clicks (YYYY-MM-DD)
+        counters (dict): Rollup attribute name -> clicks to add
+    """
+    rollups_table = get_rollups_table()
+    counter_items = list(counters.items())
+
+    # Keep each update expression well below DynamoDB's expression size limit
+    for i in range(0, len(counter_items), 50):
+        names = {}
+        values = {}
+        additions = []
+        for j, (attribute, count) in enumerate(counter_items[i:i + 50]):
+            names[f'#c{j}'] = attribute
+            values[f':c{j}'] = count
+            additions.append(f'#c{j} :c{j}')
+        rollups_table.update_item(
+            Key={'short_code': short_code, 'day': day},
+            UpdateExpression='ADD ' + ', '.join(additions),
+            ExpressionAttributeNames=names,
+            ExpressionAttributeValues=values
+        )
+
+def rebuild_click_rollups(short_code=None):
+    """
+    Recompute rollup items from the raw click rows, e.g. for clicks recorded before rollups existed.
+
+    Rollups of the affected days are overwritten, so run this while no clicks are
+    being recorded for them (or for days in the past only).
+
+    Args:
+        short_code (str, optional): Only rebuild this short code instead of scanning every click
+
+    Returns:
+        dict: Number of clicks read and rollup items written
+    """
+    clicks_table = get_analytics_table(URL_CLICKS_TABLE_NAME, 'short_code', 'timestamp')
+    read_params = {
+        'ProjectionExpression': 'short_code, #ts, referrer, country, device_type',
+        'ExpressionAttributeNames': {'#ts': 'timestamp'}
+    }
+    if short_code:
+        read_params['KeyConditionExpression'] = 'short_code = :sc'
+        read_params['ExpressionAttributeValues'] = {':sc': short_code}
+    read = clicks_table.query if short_code else clicks_table.scan
+
+    rollups = {}
+    clicks_read = 0
+    while True:
+        response = read(**read_params)
+        for click in response.get('Items', []):
+            clicks_read += 1
+            rollup = rollups.setdefault((click['short_code'], click['timestamp'][:10]), {})
+            for attribute, count in get_rollup_counters(click).items():
+                rollup[attribute] = rollup.get(attribute, 0) + count
+        if 'LastEvaluatedKey' not in response:
+            break
+        read_params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    with get_rollups_table().batch_writer() as batch:
+        for (code, day), counters in rollups.items():
+            batch.put_item(Item={'short_code': code, 'day': day, **counters})
+
+    log('info', 'Rebuilt click rollups', rollups_written=len(rollups), clicks_read=clicks_read)
+    return {'clicks_read': clicks_read, 'rollups_written': len(rollups)}
+
+def increment_usage_count(short_code, delta=1, owner_email=None):
+    """
+    Add to the pending usage_count delta of a short code.
+
+    Deltas are coalesced in memory and written by flush_ingestion_buffers, so a
+    burst of clicks on one link becomes a single write per flush interval.
+
+    Args:
+        short_code (str): The short code that was clicked
+        delta (int): Number of clicks to add
+        owner_email (str, optional): Account whose total_clicks the delta also counts towards
+    """
+    global _usage_increments_started_at
+
+    if not _usage_increments:
+        _usage_increments_started_at = time.time()
+    _usage_increments[short_code] = _usage_increments.get(short_code, 0) + delta
+    if owner_email:
+        _usage_owners[short_code] = owner_email
+
+def apply_usage_delta(short_code, delta):
+    """
+    Write a usage_count delta for a short code.
+
+    With USAGE_COUNTER_SHARDS > 1 the delta is added to a randomly chosen
+    shard item in the counters table instead of the linqs item itself, so
+    writes for a hot link are spread over several partition keys.
+
+    Args:
+        short_code (str): The short code to update
+        delta (int): Number of clicks to add
+    """
+    if USAGE_COUNTER_SHARDS > 1:
+        get_counters_table().update_item(
+            Key={'short_code': short_code, 'shard': str(random.randrange(USAGE_COUNTER_SHARDS))},
+            UpdateExpression='ADD usage_count :inc',
+            ExpressionAttributeValues={':inc': delta}
+        )
+    else:
+        # Update the usage count atomically
+        get_urls_table().update_item(
+            Key={'short_code': short_code},
+            UpdateExpression='SET usage_count = if_not_exists(usage_count, :zero) + :inc',
+            ExpressionAttributeValues={
+                ':zero': 0,
+                ':inc': delta
+            }
+        )
+
+def apply_account_counters(email, url_count=0, total_clicks=0):
+    """
+    Add to the url_count and total_clicks counters kept on an account item.
+
+    Counts for an account that no longer exists are dropped.
+
+    Args:
+        email (str): Account email
+        url_count (int): Number of links created
+        total_clicks (int): Number of clicks on the account's links
+    """
+    updates = [(name, delta) for name, delta in (('url_count', url_count), ('total_clicks', total_clicks)) if delta]
+    if not updates:
+        return
+    try:
+        get_accounts_table().update_item(
+            Key={'email': email},
+            UpdateExpression='ADD ' + ', '.join(f'{name} :{name}' for name, _ in updates),
+            # Never create an account item for a link whose owner was deleted
+            ConditionExpression='attribute_exists(email)',
+            ExpressionAttributeValues={f':{name}': delta for name, delta in updates}
+        )
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        # Retrying would fail the same way; the counts have no account to go to
+        log('info', 'Dropped counters of a deleted account', email=email, url_count=url_count, total_clicks=total_clicks)
+
+def add_created_urls_to_account(email, count):
+    """Count newly created links on the owner's account; drift from a failed update is repaired by reconciliation."""
+    try:
+        apply_account_counters(email, url_count=count)
+    except (ClientError, BotoCoreError) as e:
+        log('error', 'Error updating account url_count', error=str(e))
+
+def reconcile_account_counters(email=None):
+    """
+    Recompute url_count and total_clicks from the owner index and store them on accounts.
+
+    Repairs drift from failed counter updates. Clicks flushed while an account
+    is being recounted can be lost from its total until the next run.
+
+    Args:
+        email (str, optional): Only reconcile this account instead of scanning every account
+
+    Returns:
+        dict: Number of accounts checked and corrected
+    """
+    accounts_table = get_accounts_table()
+    urls_table = get_urls_table()
+
+    if email:
+        accounts = [get_user_by_email(email) or {}]
+    else:
+        accounts = []
+        scan_params = {'ProjectionExpression': 'email, url_count, total_clicks'}
+        while True:
+            response = accounts_table.scan(**scan_params)
+            accounts.extend(response.get('Items', []))
+            if 'LastEvaluatedKey' not in response:
+                break
+            scan_params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    checked = 0
+    corrected = 0
+    for account in accounts:
+        if 'email' not in account:
+            continue
+        checked += 1
+        query_params = {
+            'IndexName': OWNER_INDEX_NAME,
+            'KeyConditionExpression': 'owner_email = :email',
+            'ExpressionAttributeValues': {':email': account['email']},
+            'ProjectionExpression': 'short_code'
+        }
+        url_count = 0
+        total_clicks = 0
+        while True:
+            response = urls_table.query(**query_params)
+            url_items = response.get('Items', [])
+            url_count += len(url_items)
+            total_clicks += sum(get_usage_counts(url_items).values())
+            if 'LastEvaluatedKey' not in response:
+                break
+            query_params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+        if account.get('url_count') == url_count and account.get('total_clicks') == total_clicks:
+            continue
+        accounts_table.update_item(
+            Key={'email': account['email']},
+            UpdateExpression='SET url_count = :url_count, total_clicks = :total_clicks',
+            ExpressionAttributeValues={':url_count': url_count, ':total_clicks': total_clicks}
+        )
+        corrected += 1
+
+    log('info', 'Reconciled account counters', accounts_checked=checked, accounts_corrected=corrected)
+    return {'accounts_checked': checked, 'accounts_corrected': corrected}
+
+def get_usage_counts(items):
+    """
+    Get the total usage count of URL items, including their counter shards.
+
+    Items read from the owner index carry no usage_count (it is not projected,
+    so counter updates do not also write the index); their counts are read from
+    the URLs table instead.
+
+    Args:
+        items (list): URL items with short_code and, unless read from the owner index, usage_count
+
+    Returns:
+        dict: short_code -> total usage count
+    """
+    totals = {item['short_code']: int(item.get('usage_count', 0)) for item in items}
+
+    reads = []
+    base_keys = [{'short_code': item['short_code']} for item in items if 'usage_count' not in item]
+    if base_keys:
+        reads.append((get_urls_table(), base_keys))
+    if USAGE_COUNTER_SHARDS > 1 and totals:
+        shard_keys = [
+            {'short_code': short_code, 'shard': str(shard)}
+            for short_code in totals
+            for shard in range(USAGE_COUNTER_SHARDS)
+        ]
+        reads.append((get_counters_table(), shard_keys))
+
+    for table, keys in reads:
+        # BatchGetItem accepts up to 100 keys per request
+        for i in range(0, len(keys), 100):
+            request = {table.name: {'Keys': keys[i:i + 100], 'ProjectionExpression': 'short_code, usage_count'}}
+            while request:
+                response = get_dynamodb().batch_get_item(RequestItems=request)
+                for counter in response.get('Responses', {}).get(table.name, []):
+                    totals[counter['short_code']] += int(counter.get('usage_count', 0))
+                request = response.get('UnprocessedKeys')
+
+    return totals
+
+def flush_ingestion_buffers(force=False):
+    """
+    Flush buffered click records, rollups, usage counters and API usage counters.
+
+    Buffers whose size or age threshold was reached are written on a
+    background thread, so the request that crosses a threshold does not wait
+    for DynamoDB. The write continues while the container serves its next
+    requests (or, once the container is frozen, when it is thawed for the next
+    one). At most one batch is in flight; whatever it could not write is merged
+    back into the buffers when a later call finds it finished.
+
+    Args:
+        force (bool): Wait for the batch in flight, then write every buffer before returning
+    """
+    global _flush_executor, _flush_future
+    from concurrent import futures
+
+    if _flush_future is not None:
+        if not force and not _flush_future.done():
+            return
+        requeue_ingestion_batch(_flush_future.result())
+        _flush_future = None
+
+    batch = take_ingestion_batch(force)
+    if not batch:
+        return
+    if force:
+        requeue_ingestion_batch(write_ingestion_batch(batch))
+        return
+
+    if _flush_executor is None:
+        _flush_executor = futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='flush')
+    _flush_future = _flush_executor.submit(run_background_flush, batch)
+
+def take_ingestion_batch(force=False):
+    """
+    Swap out the buffers whose size or age threshold was reached.
+
+    Only called from the handler thread, so clicks and counters recorded while
+    a batch is being written always go to the fresh buffers.
+
+    Args:
+        force (bool): Take every buffer, whatever its thresholds
+
+    Returns:
+        dict: Buffered data keyed by 'clicks', 'rollups', 'usage', 'usage_owners',
+            'account_clicks' and 'api_usage'; empty if nothing is due
+    """
+    global _click_buffer, _click_buffer_started_at, _rollup_increments
+    global _usage_increments, _usage_increments_started_at, _usage_owners, _account_click_increments
+    global _api_usage_increments, _api_usage_increments_started_at
+
+    now = time.time()
+    batch = {}
+
+    if _click_buffer or _rollup_increments:
+        buffer_age = now - (_click_buffer_started_at or now)
+        if force or len(_click_buffer) >= CLICK_BUFFER_MAX_RECORDS or buffer_age >= CLICK_BUFFER_MAX_AGE:
+            batch['clicks'], batch['rollups'] = _click_buffer, _rollup_increments
+            _click_buffer, _click_buffer_started_at, _rollup_increments = [], None, {}
+
+    if _usage_increments and (force or now - _usage_increments_started_at >= USAGE_COUNTER_FLUSH_INTERVAL):
+        batch['usage'], batch['usage_owners'] = _usage_increments, _usage_owners
+        _usage_increments, _usage_increments_started_at, _usage_owners = {}, None, {}
+    if _account_click_increments and (force or 'usage' in batch):
+        batch['account_clicks'] = _account_click_increments
+        _account_click_increments = {}
+
+    if _api_usage_increments and (force or now - _api_usage_increments_started_at >= API_USAGE_FLUSH_INTERVAL):
+        batch['api_usage'] = _api_usage_increments
+        _api_usage_increments, _api_usage_increments_started_at = {}, None
+
+    return batch
+
+def write_ingestion_batch(batch):
+    """
+    Write a batch taken by take_ingestion_batch to DynamoDB.
+
+    Click records go out through BatchWriteItem (25 per request, unprocessed
+    items are retried by the batch writer), each (short_code, day) rollup and
+    each short code's usage_count get a single coalesced update, and each
+    account one total_clicks update. Failed writes are logged and returned
+    rather than raised, so a DynamoDB outage never fails a request.
+
+    Args:
+        batch (dict): Result of take_ingestion_batch
+
+    Returns:
+        dict: The part of the batch that was not written, in the same shape
+    """
+    leftovers = {}
+
+    for (short_code, day), counters in batch.get('rollups', {}).items():
+        try:
+            apply_rollup_counters(short_code, day, counters)
+        except (ClientError, BotoCoreError) as e:
+            log('error', 'Error flushing click rollup', short_code=short_code, day=day, error=str(e))
+            leftovers.setdefault('rollups', {})[(short_code, day)] = counters
+
+    clicks = batch.get('clicks')
+    if clicks:
+        try:
+            clicks_table = get_analytics_table(URL_CLICKS_TABLE_NAME, 'short_code', 'timestamp')
+            with clicks_table.batch_writer(overwrite_by_pkeys=['short_code', 'timestamp']) as writer:
+                for click in clicks:
+                    writer.put_item(Item=click)
+            log('info', 'Flushed click records', count=len(clicks))
+        except (ClientError, BotoCoreError) as e:
+            # Records the batch writer already sent are overwritten with the same item when retried
+            log('error', 'Error flushing click analytics', error=str(e))
+            leftovers['clicks'] = clicks
+
+    usage = batch.get('usage', {})
+    usage_owners = batch.get('usage_owners', {})
+    account_clicks = dict(batch.get('account_clicks', {}))
+    for short_code, delta in usage.items():
+        owner_email = usage_owners.get(short_code)
+        try:
+            apply_usage_delta(short_code, delta)
+        except (ClientError, BotoCoreError) as e:
+            log('error', 'Error flushing usage count', short_code=short_code, error=str(e))
+            leftovers.setdefault('usage', {})[short_code] = delta
+            if owner_email:
+                leftovers.setdefault('usage_owners', {})[short_code] = owner_email
+            continue
+        if owner_email:
+            account_clicks[owner_email] = account_clicks.get(owner_email, 0) + delta
+    if usage:
+        log('info', 'Flushed usage counters', short_codes=len(usage) - len(leftovers.get('usage', {})))
+
+    # One update per account, however many of its links were clicked
+    for owner_email, delta in account_clicks.items():
+        try:
+            apply_account_counters(owner_email, total_clicks=delta)
+        except (ClientError, BotoCoreError) as e:
+            log('error', 'Error flushing account click count', error=str(e))
+            leftovers.setdefault('account_clicks', {})[owner_email] = delta
+
+    api_usage = batch.get('api_usage', {})
+    for (api_key_hash, day), count in api_usage.items():
+        try:
+            get_api_usage_table().update_item(
+                Key={'api_key_hash': api_key_hash, 'day': day},
+                UpdateExpression='ADD requests :count',
+                ExpressionAttributeValues={':count': count}
+            )
+        except (ClientError, BotoCoreError) as e:
+            log('error', 'Error flushing API usage', day=day, error=str(e))
+            leftovers.setdefault('api_usage', {})[(api_key_hash, day)] = count
+    if api_usage:
+        log('info', 'Flushed API usage counters', counters=len(api_usage) - len(leftovers.get('api_usage', {})))
+
+    return leftovers
+
+def requeue_ingestion_batch(leftovers):
+    """
+    Merge the unwritten part of a batch back into the buffers for the next flush.
+
+    Args:
+        leftovers (dict): Result of write_ingestion_batch
+    """
+    global _click_buffer, _click_buffer_started_at, _api_usage_increments_started_at
+
+    if not leftovers:
+        return
+
+    # Click records are kept within a hard limit while DynamoDB is unavailable; counters are coalesced anyway
+    if leftovers.get('clicks'):
+        _click_buffer = (leftovers['clicks'] + _click_buffer)[-CLICK_BUFFER_HARD_LIMIT:]
+    for key, counters in leftovers.get('rollups', {}).items():
+        pending = _rollup_increments.setdefault(key, {})
+        for attribute, count in counters.items():
+            pending[attribute] = pending.get(attribute, 0) + count
+    if (_click_buffer or _rollup_increments) and _click_buffer_started_at is None:
+        _click_buffer_started_at = time.time()
+
+    usage_owners = leftovers.get('usage_owners', {})
+    for short_code, delta in leftovers.get('usage', {}).items():
+        increment_usage_count(short_code, delta, usage_owners.get(short_code))
+    for owner_email, delta in leftovers.get('account_clicks', {}).items():
+        _account_click_increments[owner_email] = _account_click_increments.get(owner_email, 0) + delta
+
+    for key, count in leftovers.get('api_usage', {}).items():
+        if not _api_usage_increments:
+            _api_usage_increments_started_at = time.time()
+        _api_usage_increments[key] = _api_usage_increments.get(key, 0) + count
+
+def run_background_flush(batch):
+    """
+    Write an ingestion batch on the flush thread.
+
+    The thread gets its own DynamoDB resource (boto3 resources are not
+    thread-safe) and never touches the buffers; its leftovers are requeued by
+    the handler thread.
+
+    Args:
+        batch (dict): Result of take_ingestion_batch
+
+    Returns:
+        dict: Result of write_ingestion_batch
+    """
+    _thread_resources.call_trace = []
+    try:
+        if getattr(_thread_resources, 'dynamodb', None) is None:
+            resource = boto3.session.Session().resource('dynamodb')
+            instrument_client(resource.meta.client)
+            _thread_resources.dynamodb, _thread_resources.tables = resource, {}
+        return write_ingestion_batch(batch)
+    except Exception as e:
+        # Nothing is requeued: part of the batch may have been written already
+        log('error', 'Background flush failed', error=str(e))
+        return {}
+    finally:
+        if _thread_resources.call_trace:
+            log('info', 'Background flush AWS calls', calls=len(_thread_resources.call_trace),
+                operations=summarize_aws_calls(_thread_resources.call_trace))
+
+def record_api_usage(api_key):
+    """
+    Count a request made with an API key towards today's usage of that key.
+
+    Args:
+        api_key (str): The API key the request was authenticated with
+    """
+    global _api_usage_increments_started_at
+
+    if not _api_usage_increments:
+        _api_usage_increments_started_at = time.time()
+    key = (hash_api_key(api_key), datetime.utcnow().strftime('%Y-%m-%d'))
+    _api_usage_increments[key] = _api_usage_increments.get(key, 0) + 1
+
+def get_usage_plan_quota(usage_plan_id):
+    """
+    Get the quota of an API Gateway usage plan, cached per container for USAGE_PLAN_CACHE_TTL.
+
+    Args:
+        usage_plan_id (str): Usage plan ID
+
+    Returns:
+        dict or None: Quota with 'limit', 'period' (DAY, WEEK or MONTH) and 'offset', None if the plan has no quota
+    """
+    cached = _usage_plan_cache.get(usage_plan_id)
+    if cached and cached[0] > time.time():
+        return cached[1]
+
+    quota = get_aws_client('apigateway').get_usage_plan(usagePlanId=usage_plan_id).get('quota')
+    _usage_plan_cache[usage_plan_id] = (time.time() + USAGE_PLAN_CACHE_TTL, quota)
+    return quota
+
+def get_quota_period(quota, today):
+    """
+    Get the first day of the current quota period and the day the next one starts.
+
+    Args:
+        quota (dict): Usage plan quota, or None to count the current month
+        today (date): Current UTC date
+
+    Returns:
+        tuple: (period_start, next_period_start) as dates
+    """
+    period = (quota or {}).get('period', 'MONTH')
+    offset = int((quota or {}).get('offset', 0))
+
+    if period == 'DAY':
+        return today, today + timedelta(days=1)
+    if period == 'WEEK':
+        # An offset of 0 starts weeks on Sunday
+        start = today - timedelta(days=(today.isoweekday() - offset) % 7)
+        return start, start + timedelta(days=7)
+
+    # MONTH: an offset of 0 starts periods on the 1st
+    start = today.replace(day=1) + timedelta(days=offset)
+    if start > today:
+        start = (start.replace(day=1) - timedelta(days=1)).replace(day=1) + timedelta(days=offset)
+    next_month = (start.replace(day=1) + timedelta(days=32)).replace(day=1)
+    return start, next_month + timedelta(days=offset)
+
+def get_api_usage(api_key, usage_plan_id):
+    """
+    Get an API key's metered usage in the current quota period of its usage plan.
+
+    Args:
+        api_key (str): The account's API key
+        usage_plan_id (str): The account's usage plan ID
+
+    Returns:
+        dict: current_usage, limit (None without a quota), period and reset_date
+    """
+    quota = get_usage_plan_quota(usage_plan_id)
+    today = datetime.utcnow().date()
+    period_start, next_period_start = get_quota_period(quota, today)
+
+    current_usage = 0
+    if api_key:
+        api_key_hash = hash_api_key(api_key)
+        # Requests counted by this container but not flushed yet (other containers' are up to
+        # API_USAGE_FLUSH_INTERVAL behind)
+        current_usage += sum(
+            count for (key_hash, day), count in _api_usage_increments.items()
+            if key_hash == api_key_hash and period_start.isoformat() <= day <= today.isoformat()
+        )
+        query_params = {
+            'KeyConditionExpression': 'api_key_hash = :hash AND #day BETWEEN :start AND :end',
+            'ExpressionAttributeNames': {'#day': 'day'},
+            'ExpressionAttributeValues': {
+                ':hash': api_key_hash,
+                ':start': period_start.isoformat(),
+                ':end': today.isoformat()
+            }
+        }
+        while True:
+            response = get_api_usage_table().query(**query_params)
+            current_usage += sum(int(item.get('requests', 0)) for item in response.get('Items', []))
+            if 'LastEvaluatedKey' not in response:
+                break
+            query_params['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    return {
+        'current_usage': current_usage,
+        'limit': int(quota['limit']) if quota and 'limit' in quota else None,
+        'period': (quota or {}).get('period', 'MONTH'),
+        'reset_date': next_period_start.isoformat()
+    }
+
+def _flush_on_shutdown(signum, frame):
+    """
+    Drain buffered clicks, counters and metrics when the Lambda runtime shuts the container down.
+
+    Lambda only delivers SIGTERM to the runtime when at least one extension is
+    registered (e.g. Lambda Insights or a telemetry layer). Otherwise the
+    container is reclaimed without a signal and this never runs; see the click
+    ingestion settings for what is lost then.
+    """
+    flush_ingestion_buffers(force=True)
+    flush_metrics(force=True)
+
+try:
+    signal.signal(signal.SIGTERM, _flush_on_shutdown)
+except ValueError:
+    # Not running in the main thread (e.g. imported by a test runner); rely on per-request flushes
+    pass
@@ -0,0 +1,156 @@
+"""
+Tests for the pure helpers of lambda_function: short code permutation and
+encoding, quota periods, entity tag matching, rate limit parsing and token
+buckets, and the short code Bloom filter and its delta items.
+
+Nothing here talks to AWS.
+
+Usage:
+    python -m pytest -q tests
+"""
+from collections import OrderedDict
+from datetime import date
+
+import pytest
+
+import lambda_function as lf
+
+
+def test_permutation_is_a_bijection_on_a_reduced_space(monkeypatch):
+    # Not a power of two, so cycle-walking is exercised
+    monkeypatch.setattr(lf, 'SHORT_CODE_SPACE', 1000)
+    permuted = [lf.permute_short_code_id(short_code_id) for short_code_id in range(1000)]
+    assert sorted(permuted) == list(range(1000))
+    assert permuted != list(range(1000))
+
+
+def test_permutation_depends_on_the_key(monkeypatch):
+    monkeypatch.setattr(lf, 'SHORT_CODE_SPACE', 1000)
+    monkeypatch.setattr(lf, 'SHORT_CODE_PERMUTATION_KEY', b'first')
+    first = [lf.permute_short_code_id(short_code_id) for short_code_id in range(100)]
+    monkeypatch.setattr(lf, 'SHORT_CODE_PERMUTATION_KEY', b'second')
+    second = [lf.permute_short_code_id(short_code_id) for short_code_id in range(100)]
+    assert first != second
+
+
+def test_encoding_is_a_bijection_on_a_reduced_space(monkeypatch):
+    monkeypatch.setattr(lf, 'SHORT_CODE_LENGTH', 2)
+    space = len(lf.SHORT_CODE_ALPHABET) ** 2
+    short_codes = [lf.encode_short_code(value) for value in range(space)]
+    assert len(set(short_codes)) == space
+    assert all(len(short_code) == 2 for short_code in short_codes)
+    assert short_codes[0] == '00' and short_codes[-1] == 'zz'
+
+
+def test_encoding_pads_to_the_code_length():
+    assert lf.encode_short_code(0) == '0' * lf.SHORT_CODE_LENGTH
+    assert lf.encode_short_code(lf.SHORT_CODE_SPACE - 1) == 'z' * lf.SHORT_CODE_LENGTH
+
+
+@pytest.mark.parametrize('quota, today, expected', [
+    (None, date(2026, 10, 18), (date(2026, 10, 1), date(2026, 11, 1))),
+    ({'period': 'DAY'}, date(2026, 10, 18), (date(2026, 10, 18), date(2026, 10, 19))),
+    # 2026-10-18 is a Sunday
+    ({'period': 'WEEK', 'offset': 0}, date(2026, 10, 18), (date(2026, 10, 18), date(2026, 10, 25))),
+    ({'period': 'WEEK', 'offset': 0}, date(2026, 10, 24), (date(2026, 10, 18), date(2026, 10, 25))),
+    ({'period': 'WEEK', 'offset': 1}, date(2026, 10, 18), (date(2026, 10, 12), date(2026, 10, 19))),
+    ({'period': 'MONTH', 'offset': 0}, date(2026, 12, 31), (date(2026, 12, 1), date(2027, 1, 1))),
+    ({'period': 'MONTH', 'offset': 14}, date(2026, 10, 15), (date(2026, 10, 15), date(2026, 11, 15))),
+    ({'period': 'MONTH', 'offset': 14}, date(2026, 10, 14), (date(2026, 9, 15), date(2026, 10, 15))),
+    ({'period': 'MONTH', 'offset': 14}, date(2026, 1, 5), (date(2025, 12, 15), date(2026, 1, 15))),
+])
+def test_get_quota_period(quota, today, expected):
+    assert lf.get_quota_period(quota, today) == expected
+
+
+@pytest.mark.parametrize('if_none_match, etag, expected', [
+    ('"abc"', '"abc"', True),
+    ('W/"abc"', '"abc"', True),
+    ('"abc"', 'W/"abc"', True),
+    ('"xyz", W/"abc"', '"abc"', True),
+    ('*', '"abc"', True),
+    ('"xyz"', '"abc"', False),
+    ('abc', '"abc"', False),
+])
+def test_etag_matches(if_none_match, etag, expected):
+    assert lf.etag_matches(if_none_match, etag) is expected
+
+
+def test_parse_rate_limits():
+    assert lf._parse_rate_limits('') == {}
+    assert lf._parse_rate_limits(' default=10/20, plan1:redirect=0.5/3 ,') == {
+        'default': (10.0, 20.0),
+        'plan1:redirect': (0.5, 3.0)
+    }
+
+
+@pytest.mark.parametrize('spec', ['default', 'default=10', '=10/20', 'default=0/20', 'default=10/0.5', 'default=a/b'])
+def test_parse_rate_limits_rejects_malformed_entries(spec):
+    with pytest.raises(ValueError):
+        lf._parse_rate_limits(spec)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(lf.time, 'monotonic', lambda: now[0])
+    monkeypatch.setattr(lf, '_rate_buckets', OrderedDict())
+    monkeypatch.setattr(lf, '_rate_leases', {})
+    return now
+
+
+def test_take_local_token_spends_the_burst_then_refills(clock):
+    assert [lf.take_local_token('ip|default', 2, 3) for _ in range(3)] == [0, 0, 0]
+    assert lf.take_local_token('ip|default', 2, 3) == pytest.approx(0.5)
+    clock[0] += 0.5
+    assert lf.take_local_token('ip|default', 2, 3) == 0
+    # Refills stop at the burst
+    clock[0] += 60
+    assert [lf.take_local_token('ip|default', 2, 3) for _ in range(3)] == [0, 0, 0]
+    assert lf.take_local_token('ip|default', 2, 3) > 0
+
+
+def test_take_local_token_evicts_the_least_recently_used_bucket(clock, monkeypatch):
+    monkeypatch.setattr(lf, 'RATE_LIMIT_MAX_BUCKETS', 2)
+    for bucket in ('a', 'b', 'c'):
+        lf.take_local_token(bucket, 1, 1)
+        lf._rate_leases[bucket] = 5
+    assert list(lf._rate_buckets) == ['b', 'c']
+    assert set(lf._rate_leases) == {'b', 'c'}
+    # An evicted bucket starts full again
+    assert lf.take_local_token('a', 1, 1) == 0
+
+
+def test_bloom_positions():
+    positions = list(lf.get_bloom_positions('abc123', 1024, 7))
+    assert len(positions) == 7
+    assert all(0 <= position < 1024 for position in positions)
+    assert positions == list(lf.get_bloom_positions('abc123', 1024, 7))
+    assert positions != list(lf.get_bloom_positions('abc124', 1024, 7))
+
+
+def test_bloom_filter_has_no_false_negatives():
+    size, hashes = 8 * 256, 5
+    bits = bytearray(size // 8)
+    short_codes = [lf.encode_short_code(value) for value in range(0, 10000, 97)]
+    for short_code in short_codes:
+        for position in lf.get_bloom_positions(short_code, size, hashes):
+            bits[position // 8] |= 1 << (position % 8)
+    for short_code in short_codes:
+        assert all(bits[position // 8] & (1 << (position % 8)) for position in lf.get_bloom_positions(short_code, size, hashes))
+
+
+def test_short_code_delta_shard():
+    shards = {lf.get_short_code_delta_shard(lf.encode_short_code(value)) for value in range(1000)}
+    assert shards == set(range(lf.SHORT_CODE_DELTA_SHARDS))
+    assert lf.get_short_code_delta_shard('abc123') == lf.get_short_code_delta_shard('abc123')
+
+
+def test_short_code_delta_keys():
+    interval = lf.SHORT_CODE_DELTA_INTERVAL
+    assert lf.get_short_code_delta_keys(interval * 2 + 1, interval * 2 + 5, 3) == [{'name': f'code_delta#{interval * 2}#3'}]
+    assert lf.get_short_code_delta_keys(interval - 1, interval * 2, 0) == [
+        {'name': 'code_delta#0#0'},
+        {'name': f'code_delta#{interval}#0'},
+        {'name': f'code_delta#{interval * 2}#0'}
+    ]